@@ -1,232 +1,512 @@
 import os
+import atexit
+import json
+import time
 import secrets
-from flask import Flask, render_template, request, redirect, url_for, flash, g, session, send_from_directory
-from flask_mysqldb import MySQL
+import hashlib
+import click
+from functools import wraps
+from flask import Flask, Blueprint, abort, render_template, request, redirect, url_for, flash, g, session, send_from_directory, jsonify, make_response, stream_with_context
 from datetime import datetime, date
-import MySQLdb.cursors
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
+from db import Database, ReplicaMonitor
+from expiry import ExpiryReaper
+from cache import TTLCache, TaggedCache
+from pagination import encode_cursor, decode_cursor, page_size
+import search
+import recommend
+import dedupe
+import job_import
+import projection
+import notify
+import mail
+import migrations
+import counters
+import versions
+from export import stream_csv, stream_zip
+from view_counter import ViewCounter
+from metrics import Instrumentation
+from cv_storage import CVStore, CVCollector, UploadTooLarge, claim_blob, digest_from_path
+
+def load_secret_key(path):
+    # Every worker process must sign sessions with the same key. The first one
+    # to start creates the file; os.link() fails for the others, which then
+    # read the key that won.
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(secrets.token_hex(32))
+    os.chmod(tmp, 0o600)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path) as f:
+        return f.read().strip()
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Session signing key: SECRET_KEY, or a key generated once into SECRET_KEY_FILE
+# and shared by every worker on the host (set SECRET_KEY when running several hosts)
+app.config['SECRET_KEY_FILE'] = os.environ.get('SECRET_KEY_FILE', os.path.join('instance', 'secret_key'))
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or load_secret_key(app.config['SECRET_KEY_FILE'])
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Browser cache lifetime for uploaded CVs (file names are never reused)
+app.config['UPLOAD_MAX_AGE'] = int(os.environ.get('UPLOAD_MAX_AGE', 86400))
+# CV storage: max CV size in bytes, orphan collection period and grace period in seconds
+app.config['CV_MAX_SIZE'] = int(os.environ.get('CV_MAX_SIZE', 5 * 1024 * 1024))
+app.config['CV_GC_INTERVAL'] = int(os.environ.get('CV_GC_INTERVAL', 3600))
+app.config['CV_GC_GRACE'] = int(os.environ.get('CV_GC_GRACE', 3600))
+# How /uploads is transferred once access is checked: 'direct' (through the
+# WSGI server's file wrapper, which uses sendfile() where supported),
+# 'x-sendfile' (Apache/lighttpd) or 'x-accel' (nginx internal location)
+app.config['UPLOAD_SERVE_MODE'] = os.environ.get('UPLOAD_SERVE_MODE', 'direct')
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SERVE_MODE'] == 'x-sendfile'
+# Rejects oversized bodies from Content-Length before any of it is read
+app.config['MAX_CONTENT_LENGTH'] = app.config['CV_MAX_SIZE'] + 64 * 1024
 # MySQL Configuration
-app.config['MYSQL_HOST'] = 'localhost'
-app.config['MYSQL_USER'] = 'root'
-app.config['MYSQL_PASSWORD'] = ''
-app.config['MYSQL_DB'] = 'dhandha_db'
-mysql = MySQL(app)
-# Database Setup - This will automatically create tables on first run
-def create_tables():
-    cursor = mysql.connection.cursor()
-    
-    # Create Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(20) UNIQUE NOT NULL,
-            password VARCHAR(60) NOT NULL,
-            email VARCHAR(120) UNIQUE NOT NULL,
-            phone VARCHAR(20),
-            firstname VARCHAR(20),
-            lastname VARCHAR(20),
-            is_agency BOOLEAN DEFAULT FALSE,
-            is_admin BOOLEAN DEFAULT FALSE,
-            status VARCHAR(20) DEFAULT 'verified'
-        )
-    """)
-    
-    # Create Agencies table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS agencies (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(20) UNIQUE NOT NULL,
-            password VARCHAR(60) NOT NULL,
-            email VARCHAR(120) UNIQUE NOT NULL,
-            phone VARCHAR(20),
-            company_name VARCHAR(100) NOT NULL,
-            trade_license VARCHAR(100) UNIQUE NOT NULL,
-            is_agency BOOLEAN DEFAULT TRUE,
-            is_admin BOOLEAN DEFAULT FALSE,
-            status VARCHAR(20) DEFAULT 'pending'
-        )
-    """)
-    
-    # Create Jobs table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS jobs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            title VARCHAR(100) NOT NULL,
-            country VARCHAR(50) NOT NULL,
-            deadline DATE NOT NULL,
-            description TEXT NOT NULL,
-            posted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            views INT DEFAULT 0,
-            agency_id INT NOT NULL,
-            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
-        )
-    """)
-    # Create Applications table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS applications (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            email VARCHAR(120) NOT NULL,
-            contact VARCHAR(20) NOT NULL,
-            cv_path VARCHAR(200) NOT NULL,
-            status VARCHAR(20) DEFAULT 'Pending',
-            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            user_id INT NOT NULL,
-            job_id INT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
-        )
-    """)
-    # Create Job Bookmarks table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS job_bookmarks (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            job_id INT NOT NULL,
-            bookmarked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
-        )
-    """)
-    # Create Notifications table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            message TEXT NOT NULL,
-            category VARCHAR(20) DEFAULT 'info',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_read BOOLEAN DEFAULT FALSE,
-            user_id INT,
-            agency_id INT,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
-        )
-    """)
-    # Create SuccessStories table and modify to allow agency stories
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS success_stories (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            content TEXT NOT NULL,
-            rating INT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            author_id INT,
-            agency_id INT,
-            FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
-        )
-    """)
-    # Insert a default admin user if not exists
-    cursor.execute("SELECT * FROM users WHERE is_admin = 1")
-    admin_exists = cursor.fetchone()
-    if not admin_exists:
-        cursor.execute("""
-            INSERT INTO users (username, password, email, firstname, lastname, is_admin)
-            VALUES ('admin', 'adminpassword', 'admin@example.com', 'Admin', 'User', TRUE)
-        """)
-    mysql.connection.commit()
-    cursor.close()
+app.config['MYSQL_HOST'] = os.environ.get('MYSQL_HOST', 'localhost')
+app.config['MYSQL_PORT'] = int(os.environ.get('MYSQL_PORT', 3306))
+app.config['MYSQL_USER'] = os.environ.get('MYSQL_USER', 'root')
+app.config['MYSQL_PASSWORD'] = os.environ.get('MYSQL_PASSWORD', '')
+app.config['MYSQL_DB'] = os.environ.get('MYSQL_DB', 'dhandha_db')
+# Read replicas ("host" or "host:port", comma separated; same credentials as the
+# primary), max replication lag in seconds before a replica is skipped, seconds
+# between lag checks, and how long a browser's reads stay on the primary after
+# it wrote something
+app.config['MYSQL_REPLICAS'] = [r.strip() for r in os.environ.get('MYSQL_REPLICAS', '').split(',') if r.strip()]
+app.config['REPLICA_MAX_LAG'] = int(os.environ.get('REPLICA_MAX_LAG', 5))
+app.config['REPLICA_CHECK_INTERVAL'] = int(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+# Connection pool: size bounds, checkout timeout and max connection age in seconds
+app.config['DB_POOL_MIN_SIZE'] = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+app.config['DB_POOL_MAX_SIZE'] = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+# Instrumentation: per-request JSON log line, slow statement threshold (ms),
+# share of requests run under cProfile, and an optional bearer token for /metrics
+app.config['REQUEST_LOG'] = os.environ.get('REQUEST_LOG', '1') == '1'
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Expired job cleanup: seconds between runs, rows per batch, 'delete' or 'archive'
+app.config['JOB_EXPIRY_INTERVAL'] = int(os.environ.get('JOB_EXPIRY_INTERVAL', 86400))
+app.config['JOB_EXPIRY_BATCH_SIZE'] = int(os.environ.get('JOB_EXPIRY_BATCH_SIZE', 500))
+app.config['JOB_EXPIRY_MODE'] = os.environ.get('JOB_EXPIRY_MODE', 'delete')
+# Logged-in principal cache, keyed by (account_type, username)
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 4096))
+# Admin dashboard: seconds the stats snapshot is reused, rows per account list page
+app.config['ADMIN_STATS_TTL'] = int(os.environ.get('ADMIN_STATS_TTL', 60))
+app.config['ADMIN_PAGE_SIZE'] = int(os.environ.get('ADMIN_PAGE_SIZE', 25))
+# Rendered pages for anonymous visitors, keyed by endpoint and query args
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 30))
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 512))
+# /jobs keyset pagination
+app.config['JOBS_PAGE_SIZE'] = int(os.environ.get('JOBS_PAGE_SIZE', 24))
+app.config['JOBS_MAX_PAGE_SIZE'] = int(os.environ.get('JOBS_MAX_PAGE_SIZE', 100))
+app.config['JOBS_SNIPPET_LENGTH'] = int(os.environ.get('JOBS_SNIPPET_LENGTH', 200))
+# Country counts for /jobs/search without a query, reused for this many seconds
+app.config['SEARCH_FACET_TTL'] = int(os.environ.get('SEARCH_FACET_TTL', 60))
+# JSON API (/api/v1) page sizes
+app.config['API_PAGE_SIZE'] = int(os.environ.get('API_PAGE_SIZE', 25))
+app.config['API_MAX_PAGE_SIZE'] = int(os.environ.get('API_MAX_PAGE_SIZE', 100))
+# "Jobs for you": results shown, recent applications/bookmarks that make up a
+# profile, profile terms and postings per term read, document frequency cache
+app.config['RECOMMEND_COUNT'] = int(os.environ.get('RECOMMEND_COUNT', 24))
+app.config['RECOMMEND_PROFILE_JOBS'] = int(os.environ.get('RECOMMEND_PROFILE_JOBS', 50))
+app.config['RECOMMEND_PROFILE_TERMS'] = int(os.environ.get('RECOMMEND_PROFILE_TERMS', 24))
+app.config['RECOMMEND_POSTINGS_PER_TERM'] = int(os.environ.get('RECOMMEND_POSTINGS_PER_TERM', 200))
+app.config['RECOMMEND_DF_CACHE_SIZE'] = int(os.environ.get('RECOMMEND_DF_CACHE_SIZE', 50000))
+app.config['RECOMMEND_DF_TTL'] = int(os.environ.get('RECOMMEND_DF_TTL', 3600))
+# Near-duplicate postings: 'warn' (the agency must confirm), 'block' or 'off',
+# estimated similarity that counts as a duplicate, admin report lifetime (seconds)
+app.config['DUPLICATE_MODE'] = os.environ.get('DUPLICATE_MODE', 'warn')
+app.config['DUPLICATE_THRESHOLD'] = float(os.environ.get('DUPLICATE_THRESHOLD', 0.6))
+app.config['DUPLICATE_REPORT_TTL'] = int(os.environ.get('DUPLICATE_REPORT_TTL', 600))
+# Bulk job import: jobs per transaction, largest file in bytes, row errors shown
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+app.config['IMPORT_MAX_SIZE'] = int(os.environ.get('IMPORT_MAX_SIZE', 64 * 1024 * 1024))
+app.config['IMPORT_MAX_ERRORS'] = int(os.environ.get('IMPORT_MAX_ERRORS', 100))
+# Broadcast notification fan-out worker: poll period, users per chunk and retry policy
+app.config['NOTIFY_BATCH_SIZE'] = int(os.environ.get('NOTIFY_BATCH_SIZE', 1000))
+app.config['NOTIFY_POLL_INTERVAL'] = int(os.environ.get('NOTIFY_POLL_INTERVAL', 5))
+app.config['NOTIFY_MAX_ATTEMPTS'] = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+app.config['NOTIFY_BACKOFF_BASE'] = int(os.environ.get('NOTIFY_BACKOFF_BASE', 30))
+app.config['NOTIFY_BACKOFF_MAX'] = int(os.environ.get('NOTIFY_BACKOFF_MAX', 3600))
+# Outgoing email: transport ('file', 'smtp' or 'sendgrid'), sender, and the
+# outbox worker's poll period, batch size and retry policy
+app.config['MAIL_TRANSPORT'] = os.environ.get('MAIL_TRANSPORT', 'file')
+app.config['MAIL_FROM'] = os.environ.get('MAIL_FROM', 'no-reply@dhandha.local')
+app.config['MAIL_FILE_DIR'] = os.environ.get('MAIL_FILE_DIR', 'mail_outbox')
+app.config['SENDGRID_API_KEY'] = os.environ.get('SENDGRID_API_KEY', '')
+app.config['SMTP_HOST'] = os.environ.get('SMTP_HOST', 'localhost')
+app.config['SMTP_PORT'] = int(os.environ.get('SMTP_PORT', 587))
+app.config['SMTP_USERNAME'] = os.environ.get('SMTP_USERNAME')
+app.config['SMTP_PASSWORD'] = os.environ.get('SMTP_PASSWORD')
+app.config['SMTP_USE_TLS'] = os.environ.get('SMTP_USE_TLS', '1') == '1'
+app.config['MAIL_POLL_INTERVAL'] = int(os.environ.get('MAIL_POLL_INTERVAL', 10))
+app.config['MAIL_BATCH_SIZE'] = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get('MAIL_MAX_ATTEMPTS', 8))
+app.config['MAIL_BACKOFF_BASE'] = int(os.environ.get('MAIL_BACKOFF_BASE', 30))
+app.config['MAIL_BACKOFF_MAX'] = int(os.environ.get('MAIL_BACKOFF_MAX', 3600))
+# Seconds a password reset link stays valid, and the site's public URL
+# (e.g. https://dhandha.example) that emailed links are built from. Links are
+# never built from the request's Host header, which the client controls.
+app.config['APP_BASE_URL'] = os.environ.get('APP_BASE_URL', '').rstrip('/')
+app.config['PASSWORD_RESET_TTL'] = int(os.environ.get('PASSWORD_RESET_TTL', 3600))
+# Live notifications: history page size, new-row poll period, SSE stream
+# lifetime and keep-alive, long-poll wait (seconds)
+app.config['NOTIFICATIONS_PAGE_SIZE'] = int(os.environ.get('NOTIFICATIONS_PAGE_SIZE', 30))
+app.config['NOTIFY_PUSH_POLL_INTERVAL'] = int(os.environ.get('NOTIFY_PUSH_POLL_INTERVAL', 2))
+app.config['NOTIFY_STREAM_MAX'] = int(os.environ.get('NOTIFY_STREAM_MAX', 300))
+app.config['NOTIFY_KEEPALIVE'] = int(os.environ.get('NOTIFY_KEEPALIVE', 15))
+app.config['NOTIFY_LONG_POLL_TIMEOUT'] = int(os.environ.get('NOTIFY_LONG_POLL_TIMEOUT', 25))
+# How pages update the unread badge. 'poll' fetches /notifications/unread_count
+# every NOTIFY_BADGE_POLL seconds and never holds a worker thread. 'stream'
+# keeps an SSE stream (or a long poll) open per tab, which ties up a thread
+# each under gthread, so only use it with an async worker (GUNICORN_WORKER_CLASS=gevent).
+app.config['NOTIFY_PUSH_MODE'] = os.environ.get('NOTIFY_PUSH_MODE', 'poll')
+app.config['NOTIFY_BADGE_POLL'] = int(os.environ.get('NOTIFY_BADGE_POLL', 30))
+# Buffered job view counts: flush period in seconds and max buffered views
+app.config['VIEW_FLUSH_INTERVAL'] = int(os.environ.get('VIEW_FLUSH_INTERVAL', 10))
+app.config['VIEW_FLUSH_THRESHOLD'] = int(os.environ.get('VIEW_FLUSH_THRESHOLD', 5000))
+db = Database(app)
+# Registered before the other request hooks so their queries are counted too
+instrumentation = Instrumentation(app)
+page_cache = TaggedCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+def pool_gauge():
+    pool = db.pool.get_metrics()
+    return {(state,): pool[state] for state in ('in_use', 'idle', 'checkouts', 'checkout_failures')}
+def replica_gauge():
+    return {(replica.name,): -1 if not replica.healthy or replica.lag is None else replica.lag for replica in db.replicas}
+def read_gauge():
+    return {(target,): count for target, count in db.read_stats.items()}
+def cache_gauge():
+    return {(name, key): cache.get_stats()[key]
+            for name, cache in (('pages', page_cache), ('identity', identity_cache)) for key in ('hits', 'misses', 'evictions')}
+def worker_gauge():
+    return {(worker.name,): worker.get_stats()['errors'] for worker in background_workers()}
+def background_workers():
+    return [expiry_reaper, notification_fanout, notification_hub, view_counter, cv_collector, mail_worker, replica_monitor]
+instrumentation.gauge('db_pool_connections', 'Connection pool state and checkout totals', pool_gauge, ('state',))
+instrumentation.gauge('db_replica_lag_seconds', 'Replication lag per replica (-1 while unusable)', replica_gauge, ('replica',))
+instrumentation.gauge('db_reads', 'Read connections by target', read_gauge, ('target',))
+instrumentation.gauge('cache_operations', 'Cache hits, misses and evictions', cache_gauge, ('cache', 'result'))
+instrumentation.gauge('background_worker_errors', 'Failed background worker runs', worker_gauge, ('worker',))
+def jobs_expired(count):
+    page_cache.invalidate('jobs')
+    cv_collector.wake()
+expiry_reaper = ExpiryReaper(app, db, on_expired=jobs_expired)
+notification_fanout = notify.NotificationFanout(app, db)
+notification_hub = notify.NotificationHub(app, db)
+mail_worker = mail.EmailWorker(app, db)
+replica_monitor = ReplicaMonitor(app, db)
+view_counter = ViewCounter(app, db)
+cv_store = CVStore(app.config['UPLOAD_FOLDER'], app.config['CV_MAX_SIZE'])
+cv_collector = CVCollector(app, db, cv_store)
+identity_cache = TTLCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+stats_cache = TTLCache(16, app.config['ADMIN_STATS_TTL'])
+facet_cache = TTLCache(256, app.config['SEARCH_FACET_TTL'])
+recommender = recommend.Recommender(
+    TTLCache(app.config['RECOMMEND_DF_CACHE_SIZE'], app.config['RECOMMEND_DF_TTL']),
+    profile_jobs=app.config['RECOMMEND_PROFILE_JOBS'], profile_terms=app.config['RECOMMEND_PROFILE_TERMS'],
+    postings_per_term=app.config['RECOMMEND_POSTINGS_PER_TERM'])
+USER_COLUMNS = "id, username, password, email, phone, firstname, lastname, is_agency, is_admin, status"
+AGENCY_COLUMNS = "id, username, password, email, phone, company_name, trade_license, is_agency, is_admin, status"
+def load_principal(account_type, username):
+    with db.cursor(as_dict=True) as cursor:
+        if account_type == 'agency':
+            cursor.execute(f"SELECT {AGENCY_COLUMNS} FROM agencies WHERE username = %s", (username,))
+        else:
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE username = %s", (username,))
+        row = cursor.fetchone()
+    if row:
+        row['is_agency'] = bool(row['is_agency'])
+        row['is_admin'] = bool(row['is_admin'])
+    return row
+def invalidate_principal(account_type, username):
+    identity_cache.delete((account_type, username))
 @app.before_request
 def before_request():
+    # Read-your-writes: this browser wrote recently, so replicas may not have it yet
+    if session.get('primary_until', 0) > time.time():
+        db.pin_primary()
     g.user = None
     if 'username' in session:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = %s", (session['username'],))
-        user = cursor.fetchone()
-        
+        username = session['username']
+        account_type = session.get('account_type')
+        if account_type is None:
+            # Sessions created before account_type was stored: probe once and remember
+            account_type = 'user' if load_principal('user', username) else 'agency'
+            session['account_type'] = account_type
+        key = (account_type, username)
+        user = identity_cache.get(key)
+        if user is None:
+            user = load_principal(account_type, username)
+            if user:
+                identity_cache.set(key, user)
         if user:
-            g.user = {
-                'id': user[0], 'username': user[1], 'password': user[2], 'email': user[3],
-                'phone': user[4], 'firstname': user[5], 'lastname': user[6], 'is_agency': bool(user[7]),
-                'is_admin': bool(user[8]), 'status': user[9]
-            }
-        else:
-            cursor.execute("SELECT * FROM agencies WHERE username = %s", (session['username'],))
-            agency = cursor.fetchone()
-            if agency:
-                g.user = {
-                    'id': agency[0], 'username': agency[1], 'password': agency[2], 'email': agency[3],
-                    'phone': agency[4], 'company_name': agency[5], 'trade_license': agency[6],
-                    'is_agency': bool(agency[7]), 'is_admin': bool(agency[8]), 'status': agency[9]
-                }
-        cursor.close()
-    
-    # Check for expired jobs and remove them
-    cursor = mysql.connection.cursor()
-    cursor.execute("DELETE FROM jobs WHERE deadline < CURDATE()")
-    mysql.connection.commit()
-    cursor.close()
+            g.user = dict(user)
+def cached_page(*tags):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Only anonymous GETs with no pending flash messages render the same page
+            if g.user or request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            # Built before rendering, so an invalidation during the render leaves this entry stale
+            key = page_cache.tagged_key((request.endpoint, tuple(sorted(request.args.items(multi=True)))), tags)
+            cached = page_cache.get(key)
+            if cached is not None:
+                body, mimetype, validators = cached
+                response = conditional(*validators) if validators else None
+                if response is None:
+                    response = app.response_class(body, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                page_cache.set(key, (response.get_data(), response.mimetype, g.get('validators')))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+def data_version(*parts):
+    # Pages differ per principal, so the viewer is part of every version
+    principal = (session.get('account_type'), g.user['id']) if g.user else None
+    return hashlib.sha1(repr((principal,) + parts).encode()).hexdigest()
+def conditional(etag, last_modified=None):
+    # Pending flash messages are part of the page, so those renders are never reused
+    if session.get('_flashes'):
+        return None
+    g.validators = (etag, last_modified)
+    # Only the ETag decides: deleting a job or marking notifications read
+    # changes the version hash but not the newest timestamp, so
+    # If-Modified-Since alone would keep serving the stale page
+    fresh = bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+    return app.response_class(status=304) if fresh else None
+@app.after_request
+def add_validators(response):
+    validators = g.get('validators')
+    if validators and response.status_code in (200, 304):
+        response.set_etag(validators[0], weak=True)
+        if validators[1]:
+            response.last_modified = validators[1]
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+@app.after_request
+def remember_writes(response):
+    if db.wrote and db.replicas:
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
 def is_authenticated():
     return g.user is not None
-def send_notification(user_id, agency_id, message, category='info'):
-    cursor = mysql.connection.cursor()
-    cursor.execute("""
-        INSERT INTO notifications (message, category, user_id, agency_id)
-        VALUES (%s, %s, %s, %s)
-    """, (message, category, user_id, agency_id))
-    mysql.connection.commit()
-    cursor.close()
+def send_notification(user_id, agency_id, message, category='info', email_subject=None):
+    with db.transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO notifications (message, category, user_id, agency_id)
+            VALUES (%s, %s, %s, %s)
+        """, (message, category, user_id, agency_id))
+        notification_id = cursor.lastrowid
+        if email_subject:
+            # Only queued here; the email worker does the sending
+            if agency_id:
+                cursor.execute("SELECT email FROM agencies WHERE id = %s", (agency_id,))
+            else:
+                cursor.execute("SELECT email FROM users WHERE id = %s", (user_id,))
+            recipient = cursor.fetchone()
+            if recipient:
+                mail.enqueue_email(cursor, recipient[0], email_subject, message)
+    notification_hub.publish(notification_id)
+    if email_subject:
+        mail_worker.wake()
+@app.errorhandler(413)
+def request_too_large(error):
+    if request.endpoint == 'import_jobs':
+        flash(f"Import files must be at most {app.config['IMPORT_MAX_SIZE'] // (1024 * 1024)} MB.", 'error')
+        return redirect(request.path)
+    flash(f"CV must be at most {app.config['CV_MAX_SIZE'] // (1024 * 1024)} MB.", 'error')
+    return redirect(request.path)
+def can_read_upload(filename):
+    # Only the applicant and the agency that owns the job may read a CV
+    owner = 'j.agency_id' if g.user['is_agency'] else 'a.user_id'
+    legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    with db.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT 1 FROM applications a JOIN jobs j ON a.job_id = j.id
+            WHERE (a.cv_sha256 = %s OR a.cv_path IN (%s, %s)) AND {owner} = %s
+            LIMIT 1
+        """, (digest_from_path(filename), filename, legacy_path, g.user['id']))
+        return cursor.fetchone() is not None
 # Route to serve uploaded files
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if not g.user:
+        flash('You must be logged in to view this file.', 'error')
+        return redirect(url_for('login'))
+    if not can_read_upload(filename):
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+
+    if app.config['UPLOAD_SERVE_MODE'] == 'x-accel':
+        # nginx serves the file (validators and ranges included) from an internal location
+        if not safe_join(app.config['UPLOAD_FOLDER'], filename):
+            return 'Not found', 404
+        response = app.response_class(mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'] + filename
+    else:
+        # send_from_directory handles ETag/Last-Modified, 304s and Range requests,
+        # or hands the path to the front server when USE_X_SENDFILE is set
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=app.config['UPLOAD_MAX_AGE'])
+    # CVs are personal: the browser may keep them, shared caches may not
+    response.cache_control.max_age = app.config['UPLOAD_MAX_AGE']
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 @app.route('/')
+@cached_page()
 def index():
     return render_template('index.html')
 
 @app.route('/jobs')
+@cached_page('jobs')
 def jobs():
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    
-    # Base query for all jobs, joining with agencies to get company name
+    per_page = page_size(request.args.get('per_page'), app.config['JOBS_PAGE_SIZE'], app.config['JOBS_MAX_PAGE_SIZE'])
+    after = decode_cursor(request.args.get('cursor'), (datetime, int))
+
+    with db.read_cursor() as cursor:
+        listing = versions.current(cursor, 'jobs')
+        flags = None
+        if g.user and not g.user['is_agency'] and not g.user['is_admin']:
+            cursor.execute("""
+                SELECT (SELECT CONCAT(COUNT(*), ':', COALESCE(MAX(id), 0)) FROM applications WHERE user_id = %s),
+                    (SELECT CONCAT(COUNT(*), ':', COALESCE(MAX(id), 0)) FROM job_bookmarks WHERE user_id = %s)
+            """, (g.user['id'], g.user['id']))
+            flags = cursor.fetchone()
+    not_modified = conditional(data_version('jobs', date.today(), listing[0], flags), listing[1])
+    if not_modified:
+        return not_modified
+
+    # List projection only: the full description is loaded on the details page
     query = """
-        SELECT j.*, a.company_name AS posted_by
+        SELECT j.id, j.title, j.country, j.deadline, j.posted_at, j.views,
+            LEFT(j.description, %s) AS snippet, a.company_name AS posted_by
         FROM jobs j
         JOIN agencies a ON j.agency_id = a.id
+        WHERE j.deadline >= CURDATE()
     """
+    params = [app.config['JOBS_SNIPPET_LENGTH']]
+    if after:
+        query += " AND (j.posted_at < %s OR (j.posted_at = %s AND j.id < %s))"
+        params += [after[0], after[0], after[1]]
+    query += " ORDER BY j.posted_at DESC, j.id DESC LIMIT %s"
+    params.append(per_page + 1)
+    with db.read_cursor(as_dict=True) as cursor:
+        cursor.execute(query, params)
+        page_jobs = list(cursor.fetchall())
 
-    if g.user and not g.user['is_agency'] and not g.user['is_admin']:
-        # If a regular user is logged in, get their application and bookmark statuses
-        query = """
-            SELECT
-                j.id, j.title, j.country, j.deadline, j.description, j.posted_at, j.views,
-                a.company_name AS posted_by,
-                CASE WHEN app.job_id IS NOT NULL THEN 'applied' ELSE NULL END AS user_application_status,
-                CASE WHEN bm.job_id IS NOT NULL THEN 'bookmarked' ELSE NULL END AS user_bookmark_status
-            FROM jobs AS j
-            JOIN agencies AS a ON j.agency_id = a.id
-            LEFT JOIN applications AS app ON j.id = app.job_id AND app.user_id = %s
-            LEFT JOIN job_bookmarks AS bm ON j.id = bm.job_id AND bm.user_id = %s
-            ORDER BY j.posted_at DESC
-        """
-        cursor.execute(query, (g.user['id'], g.user['id']))
-    else:
-        # For agencies, admins, or logged-out users, just get the jobs
-        cursor.execute(query + " ORDER BY j.posted_at DESC")
-    
-    all_jobs = cursor.fetchall()
-    cursor.close()
-    return render_template('jobs.html', jobs=all_jobs)
+        next_cursor = None
+        if len(page_jobs) > per_page:
+            page_jobs = page_jobs[:per_page]
+            next_cursor = encode_cursor(page_jobs[-1]['posted_at'], page_jobs[-1]['id'])
+
+        annotate_user_flags(cursor, page_jobs)
+    return render_template('jobs.html', jobs=page_jobs, next_cursor=next_cursor, per_page=per_page)
+
+@app.route('/jobs/search')
+def search_jobs():
+    q = request.args.get('q', '').strip()
+    country = request.args.get('country', '').strip()
+    agency_id = request.args.get('agency', type=int)
+    deadline_from = parse_date_arg('deadline_from')
+    deadline_to = parse_date_arg('deadline_to')
+    per_page = page_size(request.args.get('per_page'), app.config['JOBS_PAGE_SIZE'], app.config['JOBS_MAX_PAGE_SIZE'])
+    # Relevance-ranked results page by number, newest-first ones by cursor
+    page = max(request.args.get('page', 1, type=int), 1) if q else 1
+    after = None if q else decode_cursor(request.args.get('cursor'), (datetime, int))
+
+    results, facets, has_more = search.search_jobs(
+        db.read_connection, q=q, country=country, agency_id=agency_id,
+        deadline_from=deadline_from, deadline_to=deadline_to,
+        limit=per_page, offset=(page - 1) * per_page, after=after,
+        snippet_length=app.config['JOBS_SNIPPET_LENGTH'], facet_cache=facet_cache)
+    next_cursor = None
+    if has_more and not q:
+        next_cursor = encode_cursor(results[-1]['posted_at'], results[-1]['id'])
+    with db.read_cursor(as_dict=True) as cursor:
+        annotate_user_flags(cursor, results)
+    return render_template('search_jobs.html', jobs=results, facets=facets, page=page, has_more=has_more,
+                           next_cursor=next_cursor, q=q, country=country, deadline_from=deadline_from, deadline_to=deadline_to)
+
+@app.route('/jobs/recommended')
+def recommended_jobs():
+    if not g.user or g.user['is_agency'] or g.user['is_admin']:
+        flash('You must be a user to see job recommendations.', 'error')
+        return redirect(url_for('login'))
+
+    with db.read_cursor() as cursor:
+        ranked = recommender.recommend(cursor, g.user['id'], app.config['RECOMMEND_COUNT'])
+    page_jobs = []
+    if ranked:
+        job_ids = [job_id for job_id, score in ranked]
+        placeholders = ', '.join(['%s'] * len(job_ids))
+        with db.read_cursor(as_dict=True) as cursor:
+            cursor.execute(f"""
+                SELECT j.id, j.title, j.country, j.deadline, j.posted_at, j.views,
+                    LEFT(j.description, %s) AS snippet, a.company_name AS posted_by
+                FROM jobs j
+                JOIN agencies a ON j.agency_id = a.id
+                WHERE j.id IN ({placeholders}) AND j.deadline >= CURDATE()
+            """, [app.config['JOBS_SNIPPET_LENGTH']] + job_ids)
+            by_id = {job['id']: job for job in cursor.fetchall()}
+        page_jobs = [by_id[job_id] for job_id in job_ids if job_id in by_id]
+    return render_template('recommended_jobs.html', jobs=page_jobs)
+
+def parse_date_arg(name):
+    try:
+        return date.fromisoformat(request.args.get(name, ''))
+    except ValueError:
+        return None
+
+def annotate_user_flags(cursor, job_list):
+    # Resolve applied/bookmarked flags for the listed jobs only
+    if not job_list or not g.user or g.user['is_agency'] or g.user['is_admin']:
+        return
+    job_ids = [job['id'] for job in job_list]
+    placeholders = ', '.join(['%s'] * len(job_ids))
+    cursor.execute(f"SELECT job_id FROM applications WHERE user_id = %s AND job_id IN ({placeholders})", [g.user['id']] + job_ids)
+    applied = {row['job_id'] for row in cursor.fetchall()}
+    cursor.execute(f"SELECT job_id FROM job_bookmarks WHERE user_id = %s AND job_id IN ({placeholders})", [g.user['id']] + job_ids)
+    bookmarked = {row['job_id'] for row in cursor.fetchall()}
+    for job in job_list:
+        job['user_application_status'] = 'applied' if job['id'] in applied else None
+        job['user_bookmark_status'] = 'bookmarked' if job['id'] in bookmarked else None
 
 
 @app.route('/jobs/<int:job_id>')
 def job_details(job_id):
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    
-    # Increment job view count
-    cursor.execute("UPDATE jobs SET views = views + 1 WHERE id = %s", (job_id,))
-    mysql.connection.commit()
-    
-    cursor.execute("SELECT j.*, a.company_name FROM jobs j JOIN agencies a ON j.agency_id = a.id WHERE j.id = %s", (job_id,))
-    job_data = cursor.fetchone()
-    cursor.close()
-    
+    with db.read_cursor(as_dict=True) as cursor:
+        cursor.execute("SELECT j.*, a.company_name FROM jobs j JOIN agencies a ON j.agency_id = a.id WHERE j.id = %s AND j.deadline >= CURDATE()", (job_id,))
+        job_data = cursor.fetchone()
+
     if not job_data:
         flash('Job not found.', 'error')
         return redirect(url_for('jobs'))
-    
+
+    # Buffered; written to jobs.views by the flusher
+    view_counter.increment(job_id)
+    job_data['views'] += view_counter.pending([job_id]).get(job_id, 0)
     return render_template('job_details.html', job=job_data)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -236,88 +516,84 @@ def register():
         username = request.form.get('username')
         email = request.form.get('email')
         password = request.form.get('password')
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = %s OR email = %s", (username, email))
-        user_exists = cursor.fetchone()
-        cursor.execute("SELECT * FROM agencies WHERE username = %s OR email = %s", (username, email))
-        agency_exists = cursor.fetchone()
-        
-        if user_exists or agency_exists:
-            flash('Username or email already exists. Please choose a different one.', 'error')
-            cursor.close()
-            return redirect(url_for('register'))
-        if is_agency:
-            required_fields = ['username', 'email', 'password', 'company_name', 'trade_license']
-            for field in required_fields:
-                if not request.form.get(field):
-                    flash(f'Please provide {field}.', 'error')
-                    cursor.close()
-                    return redirect(url_for('register'))
-            
-            cursor.execute("""
-                INSERT INTO agencies (username, password, email, phone, company_name, trade_license)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (username, password, email, request.form.get('phone'), request.form.get('company_name'), request.form.get('trade_license')))
-            
-            flash('Registration successful! Your agency account is pending admin approval.', 'success')
-            
-            cursor.execute("SELECT id FROM users WHERE is_admin = TRUE")
-            admin_id = cursor.fetchone()
-            if admin_id:
-                send_notification(admin_id[0], None, f'New agency registration from {username} is awaiting your approval.', 'info')
-        else:
-            required_fields = ['username', 'email', 'password', 'firstname', 'lastname']
-            for field in required_fields:
-                if not request.form.get(field):
-                    flash(f'Please provide {field}.', 'error')
-                    cursor.close()
-                    return redirect(url_for('register'))
-            
-            cursor.execute("""
-                INSERT INTO users (username, password, email, phone, firstname, lastname)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (username, password, email, request.form.get('phone'), request.form.get('firstname'), request.form.get('lastname')))
-            
-            flash('Registration successful! Please log in.', 'success')
-        mysql.connection.commit()
-        cursor.close()
+        with db.transaction() as cursor:
+            cursor.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
+            user_exists = cursor.fetchone()
+            cursor.execute("SELECT id FROM agencies WHERE username = %s OR email = %s", (username, email))
+            agency_exists = cursor.fetchone()
+
+            if user_exists or agency_exists:
+                flash('Username or email already exists. Please choose a different one.', 'error')
+                return redirect(url_for('register'))
+            if is_agency:
+                required_fields = ['username', 'email', 'password', 'company_name', 'trade_license']
+                for field in required_fields:
+                    if not request.form.get(field):
+                        flash(f'Please provide {field}.', 'error')
+                        return redirect(url_for('register'))
+
+                cursor.execute("""
+                    INSERT INTO agencies (username, password, email, phone, company_name, trade_license)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (username, password, email, request.form.get('phone'), request.form.get('company_name'), request.form.get('trade_license')))
+
+                flash('Registration successful! Your agency account is pending admin approval.', 'success')
+
+                cursor.execute("SELECT id FROM users WHERE is_admin = TRUE")
+                admin_id = cursor.fetchone()
+            else:
+                required_fields = ['username', 'email', 'password', 'firstname', 'lastname']
+                for field in required_fields:
+                    if not request.form.get(field):
+                        flash(f'Please provide {field}.', 'error')
+                        return redirect(url_for('register'))
+
+                cursor.execute("""
+                    INSERT INTO users (username, password, email, phone, firstname, lastname)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (username, password, email, request.form.get('phone'), request.form.get('firstname'), request.form.get('lastname')))
+
+                flash('Registration successful! Please log in.', 'success')
+        if is_agency and admin_id:
+            send_notification(admin_id[0], None, f'New agency registration from {username} is awaiting your approval.', 'info')
         return redirect(url_for('login'))
-    
+
     return render_template('register.html')
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = %s AND password = %s", (username, password))
-        user_data = cursor.fetchone()
-        
+
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id FROM users WHERE username = %s AND password = %s", (username, password))
+            user_data = cursor.fetchone()
+            agency_data = None
+            if not user_data:
+                cursor.execute("SELECT id, status FROM agencies WHERE username = %s AND password = %s", (username, password))
+                agency_data = cursor.fetchone()
+
         if user_data:
             session['username'] = username
+            session['account_type'] = 'user'
             flash('Logged in successfully!', 'success')
-            cursor.close()
             return redirect(url_for('index'))
-        
-        cursor.execute("SELECT * FROM agencies WHERE username = %s AND password = %s", (username, password))
-        agency_data = cursor.fetchone()
+
         if agency_data:
-            if agency_data[9] != 'verified':
+            if agency_data[1] != 'verified':
                 flash('Your account is pending admin approval. Please wait for verification.', 'error')
-                cursor.close()
                 return redirect(url_for('login'))
             session['username'] = username
+            session['account_type'] = 'agency'
             flash('Logged in successfully!', 'success')
-            cursor.close()
             return redirect(url_for('index'))
-        
+
         flash('Invalid username or password.', 'error')
-        cursor.close()
     return render_template('login.html')
 @app.route('/logout')
 def logout():
     session.pop('username', None)
+    session.pop('account_type', None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 @app.route('/admin/dashboard')
@@ -325,94 +601,215 @@ def admin_dashboard():
     if not g.user or not g.user['is_admin']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM agencies WHERE status = 'pending'")
-    pending_agencies = cursor.fetchall()
-    cursor.execute("SELECT * FROM users WHERE is_admin = FALSE")
-    registered_users = cursor.fetchall()
-    cursor.execute("SELECT * FROM agencies WHERE status = 'verified'")
-    registered_agencies = cursor.fetchall()
-    cursor.execute("SELECT COUNT(*) FROM jobs")
-    job_count = cursor.fetchone()[0]
-    cursor.close()
-    
-    analytics = {
-        'users': len(registered_users),
-        'agencies': len(registered_agencies),
-        'jobs': job_count
-    }
-    pending_agencies_list = [{'id': p[0], 'username': p[1]} for p in pending_agencies]
-    registered_users_list = [{'username': u[1]} for u in registered_users]
-    registered_agencies_list = [{'username': a[1]} for a in registered_agencies]
-    return render_template('admin_dashboard.html', analytics=analytics, pending_agencies=pending_agencies_list, registered_users=registered_users_list, registered_agencies=registered_agencies_list)
+
+    per_page = app.config['ADMIN_PAGE_SIZE']
+    users_q = request.args.get('users_q', '').strip()
+    agencies_q = request.args.get('agencies_q', '').strip()
+    analytics = admin_stats()
+    with db.cursor(as_dict=True) as cursor:
+        cursor.execute("SELECT id, username FROM agencies WHERE status = 'pending' ORDER BY id LIMIT %s", (per_page,))
+        pending_agencies = cursor.fetchall()
+        registered_users, users_next = account_page(cursor, 'users', 'is_admin = FALSE', users_q, request.args.get('users_cursor'), per_page)
+        registered_agencies, agencies_next = account_page(cursor, 'agencies', "status = 'verified'", agencies_q, request.args.get('agencies_cursor'), per_page)
+    return render_template('admin_dashboard.html', analytics=analytics, pending_agencies=pending_agencies,
+                           registered_users=registered_users, users_next=users_next, users_q=users_q,
+                           registered_agencies=registered_agencies, agencies_next=agencies_next, agencies_q=agencies_q)
+def admin_stats():
+    # Aggregates only, and shared by every admin for ADMIN_STATS_TTL seconds
+    stats = stats_cache.get('admin')
+    if stats is None:
+        with db.cursor() as cursor:
+            cursor.execute("""
+                SELECT (SELECT COUNT(*) FROM users WHERE is_admin = FALSE),
+                    (SELECT COUNT(*) FROM agencies WHERE status = 'verified'),
+                    (SELECT COUNT(*) FROM agencies WHERE status = 'pending'),
+                    (SELECT COUNT(*) FROM jobs),
+                    (SELECT COUNT(*) FROM jobs WHERE deadline >= CURDATE())
+            """)
+            users, agencies, pending, jobs, active_jobs = cursor.fetchone()
+            cursor.execute("SELECT status, COUNT(*) FROM applications GROUP BY status ORDER BY status")
+            applications = cursor.fetchall()
+            cursor.execute("SELECT country, COUNT(*) AS n FROM jobs GROUP BY country ORDER BY n DESC, country LIMIT 20")
+            countries = cursor.fetchall()
+        stats = {
+            'users': users, 'agencies': agencies, 'pending_agencies': pending,
+            'jobs': jobs, 'active_jobs': active_jobs,
+            'applications': sum(n for _, n in applications),
+            'applications_by_status': [{'status': status, 'count': n} for status, n in applications],
+            'jobs_by_country': [{'country': country, 'count': n} for country, n in countries],
+            'generated_at': datetime.now()
+        }
+        stats_cache.set('admin', stats)
+    return stats
+def account_page(cursor, table, where, q, token, per_page):
+    # Keyset page of accounts by id, optionally narrowed to a username prefix
+    query = f"SELECT id, username, email FROM {table} WHERE {where}"
+    params = []
+    if q:
+        query += " AND username LIKE %s"
+        params.append(q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    after = decode_cursor(token, (int,))
+    if after:
+        query += " AND id > %s"
+        params.append(after[0])
+    query += " ORDER BY id LIMIT %s"
+    params.append(per_page + 1)
+    cursor.execute(query, params)
+    rows = list(cursor.fetchall())
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1]['id'])
+    return rows, next_cursor
+@app.route('/admin/duplicates')
+def duplicate_report():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+
+    report = stats_cache.get('duplicates')
+    if report is None:
+        with db.read_cursor(as_dict=True) as cursor:
+            clusters = dedupe.duplicate_clusters(cursor, app.config['DUPLICATE_THRESHOLD'])[:100]
+            job_ids = [job_id for cluster in clusters for job_id in cluster]
+            jobs_by_id = {}
+            if job_ids:
+                placeholders = ', '.join(['%s'] * len(job_ids))
+                cursor.execute(f"""
+                    SELECT j.id, j.title, j.country, j.posted_at, j.agency_id, a.company_name
+                    FROM jobs j JOIN agencies a ON j.agency_id = a.id
+                    WHERE j.id IN ({placeholders})
+                """, job_ids)
+                jobs_by_id = {job['id']: job for job in cursor.fetchall()}
+        report = {'generated_at': datetime.now(), 'clusters': []}
+        for cluster in clusters:
+            members = [jobs_by_id[job_id] for job_id in cluster if job_id in jobs_by_id]
+            if len(members) > 1:
+                report['clusters'].append({'jobs': members, 'agencies': len({job['agency_id'] for job in members})})
+        stats_cache.set('duplicates', report, app.config['DUPLICATE_REPORT_TTL'])
+    return render_template('admin_duplicates.html', report=report)
+@app.route('/admin/maintenance/expiry', methods=['GET', 'POST'])
+def expiry_stats():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    if request.method == 'POST':
+        expiry_reaper.run_once(force=True)
+    return jsonify(expiry_reaper.get_stats())
+@app.route('/admin/db/pool')
+def pool_stats():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    return jsonify(dict(db.pool.get_metrics(), reads=db.read_stats,
+                        replicas={replica.name: replica.get_stats() for replica in db.replicas}))
+@app.route('/admin/maintenance/cv')
+def cv_stats():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    return jsonify(cv_collector.get_stats())
+@app.route('/admin/maintenance/mail')
+def mail_stats():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    with db.cursor() as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+        outbox = dict(cursor.fetchall())
+    return jsonify({'outbox': outbox, 'worker': mail_worker.get_stats()})
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return 'Unauthorized', 401
+    return app.response_class(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+@app.route('/admin/cache')
+def cache_stats():
+    if not g.user or not g.user['is_admin']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    return jsonify({'pages': page_cache.get_stats(), 'identity': identity_cache.get_stats()})
+@app.route('/notifications/outbox')
+def notification_outbox():
+    if not g.user or not (g.user['is_admin'] or g.user['is_agency']):
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    query = """
+        SELECT id, message, status, total, delivered, attempts, error, next_attempt_at, created_at, completed_at
+        FROM notification_outbox
+    """
+    with db.cursor(as_dict=True) as cursor:
+        if g.user['is_admin']:
+            cursor.execute(query + " ORDER BY id DESC LIMIT 50")
+        else:
+            cursor.execute(query + " WHERE agency_id = %s ORDER BY id DESC LIMIT 50", (g.user['id'],))
+        entries = cursor.fetchall()
+    return jsonify({'outbox': list(entries), 'worker': notification_fanout.get_stats()})
 @app.route('/admin/verify_agency/<int:agency_id>')
 def verify_agency(agency_id):
     if not g.user or not g.user['is_admin']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT status, username FROM agencies WHERE id = %s", (agency_id,))
-    agency_data = cursor.fetchone()
-    
+
+    with db.transaction() as cursor:
+        cursor.execute("SELECT status, username FROM agencies WHERE id = %s", (agency_id,))
+        agency_data = cursor.fetchone()
+        if agency_data and agency_data[0] == 'pending':
+            cursor.execute("UPDATE agencies SET status = 'verified' WHERE id = %s", (agency_id,))
+
     if agency_data and agency_data[0] == 'pending':
-        cursor.execute("UPDATE agencies SET status = 'verified' WHERE id = %s", (agency_id,))
-        mysql.connection.commit()
+        invalidate_principal('agency', agency_data[1])
+        stats_cache.delete('admin')
         flash(f'Agency {agency_data[1]} has been approved.', 'success')
-        
-        cursor.execute("SELECT id FROM users WHERE is_admin = TRUE")
-        admin_id = cursor.fetchone()[0]
-        send_notification(None, agency_id, 'Congratulations! Your agency account has been approved by the admin.', 'success')
+        send_notification(None, agency_id, 'Congratulations! Your agency account has been approved by the admin.', 'success',
+                          email_subject='Your Dhandha agency account has been approved')
     else:
         flash('Agency not found or already verified.', 'error')
-    
-    cursor.close()
+
     return redirect(url_for('admin_dashboard'))
 @app.route('/admin/reject_agency/<int:agency_id>')
 def reject_agency(agency_id):
     if not g.user or not g.user['is_admin']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT status, username FROM agencies WHERE id = %s", (agency_id,))
-    agency_data = cursor.fetchone()
-    
+
+    with db.transaction() as cursor:
+        cursor.execute("SELECT status, username FROM agencies WHERE id = %s", (agency_id,))
+        agency_data = cursor.fetchone()
+        if agency_data and agency_data[0] == 'pending':
+            cursor.execute("DELETE FROM agencies WHERE id = %s", (agency_id,))
+
     if agency_data and agency_data[0] == 'pending':
-        cursor.execute("DELETE FROM agencies WHERE id = %s", (agency_id,))
-        mysql.connection.commit()
+        invalidate_principal('agency', agency_data[1])
+        stats_cache.delete('admin')
         flash(f'Agency {agency_data[1]} has been rejected and removed.', 'success')
     else:
         flash('Agency not found or not in pending status.', 'error')
-    
-    cursor.close()
+
     return redirect(url_for('admin_dashboard'))
 @app.route('/agency/dashboard')
 def agency_dashboard():
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("""
-        SELECT j.*, COUNT(a.id) as applications_count
-        FROM jobs j
-        LEFT JOIN applications a ON j.id = a.job_id
-        WHERE j.agency_id = %s
-        GROUP BY j.id
-    """, (g.user['id'],))
-    jobs_data = cursor.fetchall()
-    cursor.close()
-    
-    jobs = []
-    for job in jobs_data:
-        jobs.append({
-            'id': job[0], 'title': job[1], 'country': job[2], 'deadline': job[3],
-            'description': job[4], 'posted_at': job[5], 'views': job[6],
-            'applications_count': job[8]
-        })
-    
+
+    with db.cursor(as_dict=True) as cursor:
+        cursor.execute("""
+            SELECT id, title, country, deadline, posted_at, views, applications_pending,
+                applications_approved, applications_rejected, bookmarks_count
+            FROM jobs
+            WHERE agency_id = %s
+            ORDER BY id DESC
+        """, (g.user['id'],))
+        jobs = list(cursor.fetchall())
+
+    # Include views still sitting in this worker's buffer
+    pending_views = view_counter.pending([job['id'] for job in jobs])
+    for job in jobs:
+        job['views'] += pending_views.get(job['id'], 0)
+        job['applications_count'] = job['applications_pending'] + job['applications_approved'] + job['applications_rejected']
+
     return render_template('agency_dashboard.html', jobs=jobs)
 @app.route('/agency/post_job', methods=['GET', 'POST'])
 def post_job():
@@ -424,104 +821,173 @@ def post_job():
         country = request.form['country']
         deadline = request.form['deadline']
         description = request.form['description']
-        
-        cursor = mysql.connection.cursor()
-        cursor.execute("""
-            INSERT INTO jobs (title, country, deadline, description, agency_id)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (title, country, deadline, description, g.user['id']))
-        mysql.connection.commit()
-        cursor.close()
-        
+        signature = dedupe.signature(title, description)
+
+        with db.cursor() as cursor:
+            duplicates = near_duplicates(cursor, signature)
+        if duplicates:
+            return duplicate_form('post_job.html', request.form, duplicates)
+
+        with db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO jobs (title, country, deadline, description, agency_id)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (title, country, deadline, description, g.user['id']))
+            job_id = cursor.lastrowid
+            search.index_job(cursor, job_id)
+            recommend.index_job(cursor, job_id)
+            dedupe.index_job(cursor, job_id, signature)
+            # Users are notified by the fan-out worker, not inside this request
+            notify.enqueue_broadcast(cursor, f'New job posted: {title} in {country}!', agency_id=g.user['id'])
+            versions.bump(cursor, 'jobs')
+        page_cache.invalidate('jobs')
+        notification_fanout.wake()
+
         flash('Job posted successfully!', 'success')
-        
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT id FROM users WHERE is_agency = FALSE AND is_admin = FALSE")
-        users = cursor.fetchall()
-        for user_id in users:
-            send_notification(user_id[0], None, f'New job posted: {title} in {country}!')
-        cursor.close()
-        
         return redirect(url_for('agency_dashboard'))
-    
-    return render_template('post_job.html')
+
+    return render_template('post_job.html', job={})
+def near_duplicates(cursor, signature, job_id=None):
+    # The agency's live postings this one nearly repeats; skipped when the
+    # agency already confirmed a warning
+    mode = app.config['DUPLICATE_MODE']
+    if mode == 'off' or (mode == 'warn' and request.form.get('confirm_duplicate')):
+        return []
+    return dedupe.find_duplicates(cursor, signature, app.config['DUPLICATE_THRESHOLD'],
+                                  agency_id=g.user['id'], exclude_job_id=job_id)
+def duplicate_form(template, job, duplicates):
+    if app.config['DUPLICATE_MODE'] == 'block':
+        flash('This job nearly repeats one of your live postings. Edit the existing posting instead.', 'error')
+    else:
+        flash('This job looks like a near-duplicate of one of your live postings. Confirm below to save it anyway.', 'error')
+    return render_template(template, job=job, duplicates=duplicates, can_confirm=app.config['DUPLICATE_MODE'] == 'warn')
+@app.route('/agency/import_jobs', methods=['GET', 'POST'])
+def import_jobs():
+    if not g.user or not g.user['is_agency']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    if request.method == 'POST':
+        # Only this view accepts bodies beyond the CV limit
+        request.max_content_length = app.config['IMPORT_MAX_SIZE']
+        upload = request.files.get('file')
+        fmt = upload and job_import.detect_format(upload.filename)
+        if not fmt:
+            flash('Choose a .csv, .json or .jsonl file to import.', 'error')
+            return redirect(url_for('import_jobs'))
+        result = job_import.import_jobs(db, g.user['id'], job_import.read_records(upload.stream, fmt),
+                                        app.config['IMPORT_BATCH_SIZE'], app.config['IMPORT_MAX_ERRORS'])
+        jobs_imported(g.user['id'], g.user['company_name'], result['imported'])
+        if result['imported']:
+            flash(f"Imported {result['imported']} job(s).", 'success')
+        if result['rejected'] or result['stopped']:
+            flash('Some rows could not be imported; see the list below.', 'error')
+        return render_template('import_jobs.html', result=result)
+    return render_template('import_jobs.html', result=None)
+def jobs_imported(agency_id, company_name, count):
+    # One broadcast per import, however many jobs it added
+    if not count:
+        return
+    with db.transaction() as cursor:
+        notify.enqueue_broadcast(cursor, f'{company_name} posted {count} new jobs!', agency_id=agency_id)
+    page_cache.invalidate('jobs')
+    notification_fanout.wake()
 @app.route('/agency/edit_job/<int:job_id>', methods=['GET', 'POST'])
 def edit_job(job_id):
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM jobs WHERE id = %s AND agency_id = %s", (job_id, g.user['id']))
-    job_data = cursor.fetchone()
-    
-    if not job_data:
-        flash('Job not found or you do not have permission to edit it.', 'error')
-        cursor.close()
-        return redirect(url_for('agency_dashboard'))
+
+    with db.transaction() as cursor:
+        cursor.execute("SELECT id, title, country, deadline, description FROM jobs WHERE id = %s AND agency_id = %s", (job_id, g.user['id']))
+        job_data = cursor.fetchone()
+
+        if not job_data:
+            flash('Job not found or you do not have permission to edit it.', 'error')
+            return redirect(url_for('agency_dashboard'))
+        if request.method == 'POST':
+            title = request.form['title']
+            country = request.form['country']
+            deadline = request.form['deadline']
+            description = request.form['description']
+            signature = dedupe.signature(title, description)
+            duplicates = near_duplicates(cursor, signature, job_id)
+            if duplicates:
+                return duplicate_form('edit_job.html', dict(request.form.items(), id=job_id), duplicates)
+
+            cursor.execute("""
+                UPDATE jobs SET title = %s, country = %s, deadline = %s, description = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (title, country, deadline, description, job_id))
+            search.index_job(cursor, job_id)
+            recommend.index_job(cursor, job_id)
+            dedupe.index_job(cursor, job_id, signature)
+            versions.bump(cursor, 'jobs')
+
     if request.method == 'POST':
-        title = request.form['title']
-        country = request.form['country']
-        deadline = request.form['deadline']
-        description = request.form['description']
-        
-        cursor.execute("""
-            UPDATE jobs SET title = %s, country = %s, deadline = %s, description = %s
-            WHERE id = %s
-        """, (title, country, deadline, description, job_id))
-        mysql.connection.commit()
+        page_cache.invalidate('jobs')
         flash('Job updated successfully!', 'success')
-        cursor.close()
         return redirect(url_for('agency_dashboard'))
-    
+
     job = {
         'id': job_data[0], 'title': job_data[1], 'country': job_data[2],
         'deadline': job_data[3], 'description': job_data[4]
     }
-    cursor.close()
     return render_template('edit_job.html', job=job)
 @app.route('/agency/delete_job/<int:job_id>', methods=['POST'])
 def delete_job(job_id):
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
-    job_agency_id = cursor.fetchone()
-    
-    if job_agency_id and job_agency_id[0] == g.user['id']:
-        cursor.execute("DELETE FROM jobs WHERE id = %s", (job_id,))
-        mysql.connection.commit()
-        flash('Job deleted successfully!', 'success')
-    else:
-        flash('Job not found or you do not have permission to delete it.', 'error')
-    
-    cursor.close()
+    with db.transaction() as cursor:
+        cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
+        job_agency_id = cursor.fetchone()
+
+        if job_agency_id and job_agency_id[0] == g.user['id']:
+            cursor.execute("DELETE FROM jobs WHERE id = %s", (job_id,))
+            versions.bump(cursor, 'jobs')
+            flash('Job deleted successfully!', 'success')
+        else:
+            flash('Job not found or you do not have permission to delete it.', 'error')
+
+    page_cache.invalidate('jobs')
+    # The job's applications are gone; their CVs may now be orphaned
+    cv_collector.wake()
     return redirect(url_for('agency_dashboard'))
+def owned_job(cursor, job_id):
+    cursor.execute("SELECT title, agency_id FROM jobs WHERE id = %s", (job_id,))
+    job = cursor.fetchone()
+    return job if job and job[1] == g.user['id'] else None
+def cv_file_path(cv_path, cv_sha256):
+    if cv_sha256:
+        return cv_store.path(cv_sha256)
+    # Legacy rows stored the path including the upload folder
+    return cv_path if os.path.exists(cv_path) else os.path.join(app.config['UPLOAD_FOLDER'], cv_path)
 @app.route('/agency/view_applications/<int:job_id>')
 def view_applications(job_id):
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT title, agency_id FROM jobs WHERE id = %s", (job_id,))
-    job = cursor.fetchone()
-    
-    if not job or job[1] != g.user['id']:
-        flash('Job not found or you do not have permission to view its applications.', 'error')
-        cursor.close()
-        return redirect(url_for('agency_dashboard'))
-    
-    cursor.execute("""
-        SELECT a.id, a.name, a.email, a.contact, a.cv_path, a.status, a.applied_at, u.username
-        FROM applications a
-        JOIN users u ON a.user_id = u.id
-        WHERE a.job_id = %s
-        ORDER BY a.applied_at DESC
-    """, (job_id,))
-    applications_data = cursor.fetchall()
-    cursor.close()
+
+    with db.cursor() as cursor:
+        job = owned_job(cursor, job_id)
+        if not job:
+            flash('Job not found or you do not have permission to view its applications.', 'error')
+            return redirect(url_for('agency_dashboard'))
+
+        cursor.execute("SELECT COUNT(*), MAX(id), MAX(updated_at) FROM applications WHERE job_id = %s", (job_id,))
+        version = cursor.fetchone()
+        not_modified = conditional(data_version('applications', job, version), version[2])
+        if not_modified:
+            return not_modified
+
+        cursor.execute("""
+            SELECT a.id, a.name, a.email, a.contact, a.cv_path, a.status, a.applied_at, u.username
+            FROM applications a
+            JOIN users u ON a.user_id = u.id
+            WHERE a.job_id = %s
+            ORDER BY a.applied_at DESC
+        """, (job_id,))
+        applications_data = cursor.fetchall()
     applications = []
     for app_data in applications_data:
         applications.append({
@@ -534,61 +1000,110 @@ def view_applications(job_id):
             'applied_at': app_data[6],
             'username': app_data[7]
         })
-    return render_template('view_applications.html', job_title=job[0], applications=applications)
-@app.route('/agency/approve_application/<int:application_id>')
-def approve_application(application_id):
+    return render_template('view_applications.html', job_id=job_id, job_title=job[0], applications=applications)
+@app.route('/agency/view_applications/<int:job_id>/export.csv')
+def export_applications_csv(job_id):
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT job_id, user_id FROM applications WHERE id = %s", (application_id,))
-    application_data = cursor.fetchone()
-    if not application_data:
-        flash('Application not found.', 'error')
-        cursor.close()
+    with db.cursor() as cursor:
+        job = owned_job(cursor, job_id)
+    if not job:
+        flash('Job not found or you do not have permission to view its applications.', 'error')
         return redirect(url_for('agency_dashboard'))
-    
-    job_id = application_data[0]
-    user_id = application_data[1]
-    cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
-    job_agency_id = cursor.fetchone()[0]
-    if job_agency_id != g.user['id']:
-        flash('You do not have permission to approve this application.', 'error')
-        cursor.close()
+
+    def rows():
+        with db.cursor(server_side=True) as cursor:
+            cursor.execute("""
+                SELECT a.id, u.username, a.name, a.email, a.contact, a.status, a.applied_at
+                FROM applications a
+                JOIN users u ON a.user_id = u.id
+                WHERE a.job_id = %s
+                ORDER BY a.id
+            """, (job_id,))
+            for row in cursor:
+                yield row
+    header = ['id', 'username', 'name', 'email', 'contact', 'status', 'applied_at']
+    response = app.response_class(stream_with_context(stream_csv(header, rows())), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=job_{job_id}_applications.csv'
+    return response
+@app.route('/agency/view_applications/<int:job_id>/cvs.zip')
+def export_applications_cvs(job_id):
+    if not g.user or not g.user['is_agency']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    with db.cursor() as cursor:
+        job = owned_job(cursor, job_id)
+    if not job:
+        flash('Job not found or you do not have permission to view its applications.', 'error')
         return redirect(url_for('agency_dashboard'))
-    cursor.execute("UPDATE applications SET status = 'Approved' WHERE id = %s", (application_id,))
-    mysql.connection.commit()
+
+    def files():
+        with db.cursor(server_side=True) as cursor:
+            cursor.execute("""
+                SELECT a.id, u.username, a.cv_path, a.cv_sha256
+                FROM applications a
+                JOIN users u ON a.user_id = u.id
+                WHERE a.job_id = %s
+                ORDER BY a.id
+            """, (job_id,))
+            for application_id, username, cv_path, cv_sha256 in cursor:
+                yield f'{application_id}_{username}.pdf', cv_file_path(cv_path, cv_sha256)
+    response = app.response_class(stream_with_context(stream_zip(files())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=job_{job_id}_cvs.zip'
+    return response
+@app.route('/agency/approve_application/<int:application_id>')
+def approve_application(application_id):
+    if not g.user or not g.user['is_agency']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
+    with db.transaction() as cursor:
+        cursor.execute("SELECT job_id, user_id, status FROM applications WHERE id = %s FOR UPDATE", (application_id,))
+        application_data = cursor.fetchone()
+        if not application_data:
+            flash('Application not found.', 'error')
+            return redirect(url_for('agency_dashboard'))
+
+        job_id = application_data[0]
+        user_id = application_data[1]
+        cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
+        job_agency_id = cursor.fetchone()[0]
+        if job_agency_id != g.user['id']:
+            flash('You do not have permission to approve this application.', 'error')
+            return redirect(url_for('agency_dashboard'))
+        if application_data[2] != 'Approved':
+            cursor.execute("UPDATE applications SET status = 'Approved', updated_at = NOW() WHERE id = %s", (application_id,))
+            counters.move_status(cursor, job_id, application_data[2], 'Approved')
     flash('Application has been approved!', 'success')
-    
-    send_notification(user_id, None, 'Congratulations! Your job application has been approved.')
-    cursor.close()
+
+    send_notification(user_id, None, 'Congratulations! Your job application has been approved.',
+                      email_subject='Your job application has been approved')
     return redirect(url_for('view_applications', job_id=job_id))
 @app.route('/agency/reject_application/<int:application_id>')
 def reject_application(application_id):
     if not g.user or not g.user['is_agency']:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT job_id, user_id FROM applications WHERE id = %s", (application_id,))
-    application_data = cursor.fetchone()
-    if not application_data:
-        flash('Application not found.', 'error')
-        cursor.close()
-        return redirect(url_for('agency_dashboard'))
-    job_id = application_data[0]
-    user_id = application_data[1]
-    cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
-    job_agency_id = cursor.fetchone()[0]
-    if job_agency_id != g.user['id']:
-        flash('You do not have permission to reject this application.', 'error')
-        cursor.close()
-        return redirect(url_for('agency_dashboard'))
-    cursor.execute("UPDATE applications SET status = 'Rejected' WHERE id = %s", (application_id,))
-    mysql.connection.commit()
+    with db.transaction() as cursor:
+        cursor.execute("SELECT job_id, user_id, status FROM applications WHERE id = %s FOR UPDATE", (application_id,))
+        application_data = cursor.fetchone()
+        if not application_data:
+            flash('Application not found.', 'error')
+            return redirect(url_for('agency_dashboard'))
+        job_id = application_data[0]
+        user_id = application_data[1]
+        cursor.execute("SELECT agency_id FROM jobs WHERE id = %s", (job_id,))
+        job_agency_id = cursor.fetchone()[0]
+        if job_agency_id != g.user['id']:
+            flash('You do not have permission to reject this application.', 'error')
+            return redirect(url_for('agency_dashboard'))
+        if application_data[2] != 'Rejected':
+            cursor.execute("UPDATE applications SET status = 'Rejected', updated_at = NOW() WHERE id = %s", (application_id,))
+            counters.move_status(cursor, job_id, application_data[2], 'Rejected')
     flash('Application has been rejected.', 'success')
-    
-    send_notification(user_id, None, 'Your job application has been rejected.')
-    cursor.close()
+
+    send_notification(user_id, None, 'Your job application has been rejected.',
+                      email_subject='Update on your job application')
     return redirect(url_for('view_applications', job_id=job_id))
 
 @app.route('/bookmark_job/<int:job_id>', methods=['POST'])
@@ -597,18 +1112,23 @@ def bookmark_job(job_id):
         flash('You must be a user to bookmark a job.', 'error')
         return redirect(url_for('login'))
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT * FROM job_bookmarks WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
-    bookmark_exists = cursor.fetchone()
-
-    if bookmark_exists:
-        flash('Job is already bookmarked.', 'info')
-    else:
-        cursor.execute("INSERT INTO job_bookmarks (user_id, job_id) VALUES (%s, %s)", (g.user['id'], job_id))
-        mysql.connection.commit()
+    with db.transaction() as cursor:
+        # Lock the job row first: the FK check would otherwise take a shared
+        # lock on it and concurrent counter updates would deadlock
+        cursor.execute("SELECT id FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
+        # The unique (user_id, job_id) key makes a repeat bookmark a no-op
+        cursor.execute("""
+            INSERT INTO job_bookmarks (user_id, job_id) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE job_id = job_id
+        """, (g.user['id'], job_id))
+        bookmarked = cursor.rowcount == 1
+        if bookmarked:
+            counters.adjust(cursor, job_id, bookmarks_count=1)
+    if bookmarked:
         flash('Job bookmarked successfully!', 'success')
-    
-    cursor.close()
+    else:
+        flash('Job is already bookmarked.', 'info')
+
     return redirect(url_for('jobs'))
 
 @app.route('/remove_bookmark/<int:job_id>', methods=['POST'])
@@ -617,11 +1137,11 @@ def remove_bookmark(job_id):
         flash('Access denied.', 'error')
         return redirect(url_for('login'))
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("DELETE FROM job_bookmarks WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
-    mysql.connection.commit()
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM job_bookmarks WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
+        if cursor.rowcount:
+            counters.adjust(cursor, job_id, bookmarks_count=-1)
     flash('Bookmark removed.', 'info')
-    cursor.close()
     return redirect(url_for('my_applications'))
 
 @app.route('/apply_job/<int:job_id>', methods=['GET', 'POST'])
@@ -629,21 +1149,20 @@ def apply_job(job_id):
     if not g.user or g.user['is_agency']:
         flash('You must be a user to apply for jobs.', 'error')
         return redirect(url_for('login'))
-    
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
-    job_data = cursor.fetchone()
-    
+
+    with db.cursor(as_dict=True) as cursor:
+        cursor.execute("SELECT * FROM jobs WHERE id = %s AND deadline >= CURDATE()", (job_id,))
+        job_data = cursor.fetchone()
+        already_applied = None
+        if job_data:
+            cursor.execute("SELECT id FROM applications WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
+            already_applied = cursor.fetchone()
+
     if not job_data:
         flash('Job not found.', 'error')
-        cursor.close()
         return redirect(url_for('jobs'))
-    
-    cursor.execute("SELECT * FROM applications WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
-    already_applied = cursor.fetchone()
     if already_applied:
         flash('You have already applied for this job.', 'info')
-        cursor.close()
         return redirect(url_for('jobs'))
 
     if request.method == 'POST':
@@ -655,26 +1174,40 @@ def apply_job(job_id):
             flash('No CV file selected.', 'error')
             return redirect(url_for('job_details', job_id=job_id))
         if file:
-            filename = f"{g.user['username']}_{job_id}_{secrets.token_hex(4)}.pdf"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            cursor.execute("""
-                INSERT INTO applications (name, email, contact, cv_path, user_id, job_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (request.form['name'], request.form['email'], request.form['contact'], filepath, g.user['id'], job_id))
-            mysql.connection.commit()
-            
-            # Remove from bookmarks if it exists
-            cursor.execute("DELETE FROM job_bookmarks WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
-            mysql.connection.commit()
-            
+            try:
+                tmp, digest, size = cv_store.write_temp(file.stream)
+            except UploadTooLarge:
+                flash(f"CV must be at most {app.config['CV_MAX_SIZE'] // (1024 * 1024)} MB.", 'error')
+                return redirect(url_for('job_details', job_id=job_id))
+            with db.transaction() as cursor:
+                claim_blob(cursor, digest, size)
+            cv_path = cv_store.commit(tmp, digest)
+
+            with db.transaction() as cursor:
+                # Job row first, as in bookmark_job
+                cursor.execute("SELECT id FROM jobs WHERE id = %s FOR UPDATE", (job_id,))
+                # A concurrent duplicate submit hits the unique key and changes nothing
+                cursor.execute("""
+                    INSERT INTO applications (name, email, contact, cv_path, cv_sha256, user_id, job_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE job_id = job_id
+                """, (request.form['name'], request.form['email'], request.form['contact'], cv_path, digest, g.user['id'], job_id))
+                applied = cursor.rowcount == 1
+                if applied:
+                    # Remove from bookmarks if it exists
+                    cursor.execute("DELETE FROM job_bookmarks WHERE user_id = %s AND job_id = %s", (g.user['id'], job_id))
+                    counters.adjust(cursor, job_id, applications_pending=1, bookmarks_count=-cursor.rowcount)
+
+            if not applied:
+                # The blob stays; the collector removes it if nothing else uses it
+                flash('You have already applied for this job.', 'info')
+                return redirect(url_for('jobs'))
+
             flash('Application submitted successfully!', 'success')
-            
+
             # Send notification to the agency that owns the job
             send_notification(user_id=None, agency_id=job_data['agency_id'], message=f"A new application has been submitted for your job: '{job_data['title']}'.")
 
-    cursor.close()
     return render_template('apply_job.html', job=job_data)
 
 
@@ -683,57 +1216,54 @@ def my_applications():
     if not g.user or g.user['is_agency']:
         flash('You must be a user to view your applications.', 'error')
         return redirect(url_for('login'))
-    
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-
-    # Fetch applications
-    cursor.execute("""
-        SELECT a.id, a.status, a.applied_at, j.title, ag.company_name, j.id AS job_id
-        FROM applications a
-        JOIN jobs j ON a.job_id = j.id
-        JOIN agencies ag ON j.agency_id = ag.id
-        WHERE a.user_id = %s
-        ORDER BY a.applied_at DESC
-    """, (g.user['id'],))
-    applied_jobs = cursor.fetchall()
-    
-    # Fetch bookmarked jobs
-    cursor.execute("""
-        SELECT b.id, j.id AS job_id, 'bookmarked' AS status, b.bookmarked_at AS applied_at, j.title, ag.company_name
-        FROM job_bookmarks b
-        JOIN jobs j ON b.job_id = j.id
-        JOIN agencies ag ON j.agency_id = ag.id
-        WHERE b.user_id = %s
-        ORDER BY b.bookmarked_at DESC
-    """, (g.user['id'],))
-    bookmarked_jobs = cursor.fetchall()
-    
+
+    with db.read_cursor(as_dict=True) as cursor:
+        # Fetch applications
+        cursor.execute("""
+            SELECT a.id, a.status, a.applied_at, j.title, ag.company_name, j.id AS job_id
+            FROM applications a
+            JOIN jobs j ON a.job_id = j.id
+            JOIN agencies ag ON j.agency_id = ag.id
+            WHERE a.user_id = %s
+            ORDER BY a.applied_at DESC
+        """, (g.user['id'],))
+        applied_jobs = cursor.fetchall()
+
+        # Fetch bookmarked jobs
+        cursor.execute("""
+            SELECT b.id, j.id AS job_id, 'bookmarked' AS status, b.bookmarked_at AS applied_at, j.title, ag.company_name
+            FROM job_bookmarks b
+            JOIN jobs j ON b.job_id = j.id
+            JOIN agencies ag ON j.agency_id = ag.id
+            WHERE b.user_id = %s
+            ORDER BY b.bookmarked_at DESC
+        """, (g.user['id'],))
+        bookmarked_jobs = cursor.fetchall()
+
     applications = []
     # Combine the lists and standardize the key names
     for app in applied_jobs:
         applications.append({
-            'id': app['id'], 
-            'status': app['status'], 
-            'applied_at': app['applied_at'], 
-            'job_title': app['title'], 
+            'id': app['id'],
+            'status': app['status'],
+            'applied_at': app['applied_at'],
+            'job_title': app['title'],
             'agency': app['company_name'],
             'job_id': app['job_id']
         })
     for bookmark in bookmarked_jobs:
         applications.append({
             'id': bookmark['id'],
-            'status': 'Bookmarked', 
+            'status': 'Bookmarked',
             'applied_at': bookmark['applied_at'],
-            'job_title': bookmark['title'], 
+            'job_title': bookmark['title'],
             'agency': bookmark['company_name'],
             'job_id': bookmark['job_id']
         })
-    
+
     # Sort the combined list by date
     applications.sort(key=lambda x: x['applied_at'], reverse=True)
-    
-    cursor.close()
-    
+
     return render_template('my_applications.html', applications=applications)
 
 
@@ -742,24 +1272,139 @@ def notifications():
     if not g.user:
         flash('You must be logged in to view your notifications.', 'error')
         return redirect(url_for('login'))
-    
-    cursor = mysql.connection.cursor()
-    if g.user['is_agency']:
-        cursor.execute("SELECT * FROM notifications WHERE agency_id = %s ORDER BY timestamp DESC", (g.user['id'],))
-    else:
-        cursor.execute("SELECT * FROM notifications WHERE user_id = %s ORDER BY timestamp DESC", (g.user['id'],))
-    notifications_data = cursor.fetchall()
-    cursor.close()
-    
-    notifications = []
-    for notif in notifications_data:
-        notifications.append({
-            'id': notif[0], 'message': notif[1], 'category': notif[2],
-            'timestamp': notif[3], 'is_read': notif[4]
-        })
-    
-    return render_template('notification.html', notifications=notifications)
+
+    column = recipient_column()
+    per_page = app.config['NOTIFICATIONS_PAGE_SIZE']
+    before = decode_cursor(request.args.get('cursor'), (datetime, int))
+    with db.read_cursor(as_dict=True) as cursor:
+        # High-water mark of the recipient's notifications, including read flags
+        cursor.execute(f"SELECT COUNT(*), MAX(id), SUM(is_read), MAX(timestamp) FROM notifications WHERE {column} = %s", (g.user['id'],))
+        version = tuple(cursor.fetchone().values())
+        not_modified = conditional(data_version('notifications', version), version[3])
+        if not_modified:
+            return not_modified
+
+        query = f"SELECT id, message, category, timestamp, is_read FROM notifications WHERE {column} = %s"
+        params = [g.user['id']]
+        if before:
+            query += " AND (timestamp < %s OR (timestamp = %s AND id < %s))"
+            params += [before[0], before[0], before[1]]
+        query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+        params.append(per_page + 1)
+        cursor.execute(query, params)
+        notifications = list(cursor.fetchall())
+
+    next_cursor = None
+    if len(notifications) > per_page:
+        notifications = notifications[:per_page]
+        next_cursor = encode_cursor(notifications[-1]['timestamp'], notifications[-1]['id'])
+    return render_template('notification.html', notifications=notifications, next_cursor=next_cursor, unread=int(version[0] - (version[2] or 0)))
+def recipient_column():
+    return 'agency_id' if g.user['is_agency'] else 'user_id'
+def fetch_new_notifications(after_id, limit=50):
+    column = recipient_column()
+    with db.cursor(as_dict=True) as cursor:
+        cursor.execute(f"""
+            SELECT id, message, category, timestamp, is_read FROM notifications
+            WHERE {column} = %s AND id > %s ORDER BY id LIMIT %s
+        """, (g.user['id'], after_id, limit))
+        rows = list(cursor.fetchall())
+    for row in rows:
+        row['timestamp'] = row['timestamp'].isoformat()
+        row['is_read'] = bool(row['is_read'])
+    return rows
+def unread_count():
+    with db.read_cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM notifications WHERE {recipient_column()} = %s AND is_read = FALSE", (g.user['id'],))
+        return cursor.fetchone()[0]
+def latest_notification_id():
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM notifications WHERE {recipient_column()} = %s", (g.user['id'],))
+        return cursor.fetchone()[0]
+@app.route('/notifications/unread_count')
+def notifications_unread_count():
+    if not g.user:
+        return jsonify({'error': 'login required'}), 401
+    return jsonify({'unread': unread_count()})
+@app.route('/notifications/stream')
+def notification_stream():
+    if not g.user:
+        return jsonify({'error': 'login required'}), 401
+    if app.config['NOTIFY_PUSH_MODE'] != 'stream':
+        return jsonify({'error': 'notification streaming is disabled'}), 404
+    # Resume after the last event the browser saw, otherwise send only new ones
+    after_id = request.headers.get('Last-Event-ID', type=int)
+    if after_id is None:
+        after_id = request.args.get('after', type=int)
+    if after_id is None:
+        after_id = latest_notification_id()
+
+    def events(after_id):
+        deadline = time.monotonic() + app.config['NOTIFY_STREAM_MAX']
+        yield f"retry: 3000\nevent: unread\ndata: {unread_count()}\n\n"
+        while True:
+            seen = notification_hub.high_water
+            rows = fetch_new_notifications(after_id)
+            if rows:
+                after_id = rows[-1]['id']
+                for row in rows:
+                    yield f"id: {row['id']}\nevent: notification\ndata: {json.dumps(row)}\n\n"
+                yield f"event: unread\ndata: {unread_count()}\n\n"
+            # Don't keep a pooled connection while the stream is idle
+            db.release()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not notification_hub.wait(seen, min(app.config['NOTIFY_KEEPALIVE'], remaining)):
+                yield ": keep-alive\n\n"
+    response = app.response_class(stream_with_context(events(after_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+@app.route('/notifications/poll')
+def notification_poll():
+    # Long-poll fallback for clients without EventSource
+    if not g.user:
+        return jsonify({'error': 'login required'}), 401
+    after_id = request.args.get('after', type=int)
+    if after_id is None:
+        after_id = latest_notification_id()
+    timeout = min(request.args.get('timeout', app.config['NOTIFY_LONG_POLL_TIMEOUT'], type=int), app.config['NOTIFY_LONG_POLL_TIMEOUT'])
+    if app.config['NOTIFY_PUSH_MODE'] != 'stream':
+        # Threaded workers answer at once instead of parking a thread
+        timeout = 0
+    seen = notification_hub.high_water
+    rows = fetch_new_notifications(after_id)
+    if not rows:
+        db.release()
+        if notification_hub.wait(seen, max(timeout, 0)):
+            rows = fetch_new_notifications(after_id)
+    return jsonify({'notifications': rows, 'cursor': rows[-1]['id'] if rows else after_id, 'unread': unread_count()})
+@app.route('/notifications/mark_read', methods=['POST'])
+def mark_notifications_read():
+    if not g.user:
+        flash('You must be logged in to view your notifications.', 'error')
+        return redirect(url_for('login'))
+    column = recipient_column()
+    ids = [int(i) for i in request.form.getlist('ids') if i.isdigit()]
+    updated = 0
+    with db.transaction() as cursor:
+        if request.form.get('all'):
+            # Bounded by what the reader has seen, so newer arrivals stay unread
+            up_to = request.form.get('up_to', type=int) or latest_notification_id()
+            cursor.execute(f"UPDATE notifications SET is_read = TRUE WHERE {column} = %s AND is_read = FALSE AND id <= %s",
+                           (g.user['id'], up_to))
+            updated = cursor.rowcount
+        elif ids:
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"UPDATE notifications SET is_read = TRUE WHERE {column} = %s AND is_read = FALSE AND id IN ({placeholders})",
+                           [g.user['id']] + ids)
+            updated = cursor.rowcount
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'updated': updated, 'unread': unread_count()})
+    return redirect(url_for('notifications'))
 @app.route('/success_stories', methods=['GET', 'POST'])
+@cached_page('stories')
 def success_stories():
     if request.method == 'POST':
         # This part remains the same as our previous successful fix
@@ -768,99 +1413,90 @@ def success_stories():
             return redirect(url_for('login'))
         story_content = request.form['story']
         rating = request.form['rating']
-        
-        cursor = mysql.connection.cursor()
-        
-        if g.user['is_agency']:
-            cursor.execute("""
-                INSERT INTO success_stories (content, rating, agency_id)
-                VALUES (%s, %s, %s)
-            """, (story_content, rating, g.user['id']))
-        else:
-            cursor.execute("""
-                INSERT INTO success_stories (content, rating, author_id)
-                VALUES (%s, %s, %s)
-            """, (story_content, rating, g.user['id']))
-        mysql.connection.commit()
+
+        with db.transaction() as cursor:
+            if g.user['is_agency']:
+                cursor.execute("""
+                    INSERT INTO success_stories (content, rating, agency_id)
+                    VALUES (%s, %s, %s)
+                """, (story_content, rating, g.user['id']))
+            else:
+                cursor.execute("""
+                    INSERT INTO success_stories (content, rating, author_id)
+                    VALUES (%s, %s, %s)
+                """, (story_content, rating, g.user['id']))
+        page_cache.invalidate('stories')
         flash('Your story has been posted!', 'success')
-        cursor.close()
         return redirect(url_for('success_stories'))
     # This is the correct GET request logic to fetch all stories
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("""
-        SELECT 
-            s.id,
-            s.content,
-            s.rating,
-            s.timestamp,
-            COALESCE(u.username, a.company_name) AS author,
-            s.author_id,
-            s.agency_id
-        FROM success_stories AS s
-        LEFT JOIN users AS u ON s.author_id = u.id
-        LEFT JOIN agencies AS a ON s.agency_id = a.id
-        ORDER BY s.timestamp DESC
-    """)
-    stories = cursor.fetchall()
-    cursor.close()
+    with db.read_cursor(as_dict=True) as cursor:
+        cursor.execute("""
+            SELECT
+                s.id,
+                s.content,
+                s.rating,
+                s.timestamp,
+                COALESCE(u.username, a.company_name) AS author,
+                s.author_id,
+                s.agency_id
+            FROM success_stories AS s
+            LEFT JOIN users AS u ON s.author_id = u.id
+            LEFT JOIN agencies AS a ON s.agency_id = a.id
+            ORDER BY s.timestamp DESC
+        """)
+        stories = cursor.fetchall()
     return render_template('success_stories.html', stories=stories)
 @app.route('/edit_story/<int:story_id>', methods=['GET', 'POST'])
 def edit_story(story_id):
     if not g.user:
         flash('You must be logged in to edit a story.', 'error')
         return redirect(url_for('success_stories'))
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    
-    # Check if the user is the author (user or agency) of the story
-    if g.user['is_agency']:
-        cursor.execute("SELECT * FROM success_stories WHERE id = %s AND agency_id = %s", (story_id, g.user['id']))
-    else:
-        cursor.execute("SELECT * FROM success_stories WHERE id = %s AND author_id = %s", (story_id, g.user['id']))
-    
-    story = cursor.fetchone()
-    
-    if not story:
-        flash('Story not found or you do not have permission to edit it.', 'error')
-        cursor.close()
-        return redirect(url_for('success_stories'))
+    with db.transaction(as_dict=True) as cursor:
+        # Check if the user is the author (user or agency) of the story
+        if g.user['is_agency']:
+            cursor.execute("SELECT * FROM success_stories WHERE id = %s AND agency_id = %s", (story_id, g.user['id']))
+        else:
+            cursor.execute("SELECT * FROM success_stories WHERE id = %s AND author_id = %s", (story_id, g.user['id']))
+
+        story = cursor.fetchone()
+
+        if not story:
+            flash('Story not found or you do not have permission to edit it.', 'error')
+            return redirect(url_for('success_stories'))
+        if request.method == 'POST':
+            new_content = request.form['story']
+            new_rating = request.form['rating']
+
+            cursor.execute("UPDATE success_stories SET content = %s, rating = %s WHERE id = %s", (new_content, new_rating, story_id))
+
     if request.method == 'POST':
-        new_content = request.form['story']
-        new_rating = request.form['rating']
-        
-        cursor.execute("UPDATE success_stories SET content = %s, rating = %s WHERE id = %s", (new_content, new_rating, story_id))
-        mysql.connection.commit()
-        
+        page_cache.invalidate('stories')
         flash('Your story has been updated successfully!', 'success')
-        cursor.close()
         return redirect(url_for('success_stories'))
-    
-    cursor.close()
+
     return render_template('edit_story.html', story=story)
 @app.route('/delete_story/<int:story_id>', methods=['POST'])
 def delete_story(story_id):
     if not g.user:
         flash('You must be logged in to delete a story.', 'error')
         return redirect(url_for('success_stories'))
-    
-    cursor = mysql.connection.cursor()
-    
-    # Check if the user is the author (user or agency) of the story
-    if g.user['is_agency']:
-        cursor.execute("SELECT id FROM success_stories WHERE id = %s AND agency_id = %s", (story_id, g.user['id']))
-    else:
-        cursor.execute("SELECT id FROM success_stories WHERE id = %s AND author_id = %s", (story_id, g.user['id']))
-        
-    story_exists = cursor.fetchone()
-    
-    if not story_exists:
-        flash('Story not found or you do not have permission to delete it.', 'error')
-        cursor.close()
-        return redirect(url_for('success_stories'))
-    cursor.execute("DELETE FROM success_stories WHERE id = %s", (story_id,))
-    mysql.connection.commit()
-    
+
+    with db.transaction() as cursor:
+        # Check if the user is the author (user or agency) of the story
+        if g.user['is_agency']:
+            cursor.execute("SELECT id FROM success_stories WHERE id = %s AND agency_id = %s", (story_id, g.user['id']))
+        else:
+            cursor.execute("SELECT id FROM success_stories WHERE id = %s AND author_id = %s", (story_id, g.user['id']))
+
+        story_exists = cursor.fetchone()
+
+        if not story_exists:
+            flash('Story not found or you do not have permission to delete it.', 'error')
+            return redirect(url_for('success_stories'))
+        cursor.execute("DELETE FROM success_stories WHERE id = %s", (story_id,))
+
+    page_cache.invalidate('stories')
     flash('Your story has been deleted.', 'success')
-    cursor.close()
     return redirect(url_for('success_stories'))
 @app.route('/user/profile', methods=['GET', 'POST'])
 def user_profile():
@@ -872,33 +1508,348 @@ def user_profile():
         lastname = request.form.get('lastname')
         phone = request.form.get('phone')
         email = request.form.get('email')
-        
-        cursor = mysql.connection.cursor()
-        cursor.execute("""
-            UPDATE users SET firstname = %s, lastname = %s, phone = %s, email = %s
-            WHERE id = %s
-        """, (firstname, lastname, phone, email, g.user['id']))
-        mysql.connection.commit()
+
+        with db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE users SET firstname = %s, lastname = %s, phone = %s, email = %s
+                WHERE id = %s
+            """, (firstname, lastname, phone, email, g.user['id']))
+        invalidate_principal('user', g.user['username'])
         flash('Profile updated successfully!', 'success')
-        cursor.close()
         return redirect(url_for('user_profile'))
-    
+
     return render_template('user_profile.html', user=g.user)
 @app.route('/forget_password', methods=['GET', 'POST'])
 def forget_password():
     if request.method == 'POST':
-        flash('Password reset link has been sent to your email (This is a placeholder).', 'info')
+        if not app.config['APP_BASE_URL']:
+            app.logger.error('APP_BASE_URL is not set; password reset emails are disabled')
+            flash('Password reset by email is not available right now. Please contact support.', 'error')
+            return redirect(url_for('login'))
+        email = request.form.get('email', '').strip()
+        with db.transaction() as cursor:
+            account_type = 'user'
+            cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+            account = cursor.fetchone()
+            if not account:
+                account_type = 'agency'
+                cursor.execute("SELECT id FROM agencies WHERE email = %s", (email,))
+                account = cursor.fetchone()
+            if account:
+                token = secrets.token_urlsafe(32)
+                cursor.execute("""
+                    INSERT INTO password_resets (token_hash, account_type, account_id, expires_at)
+                    VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+                """, (hashlib.sha256(token.encode()).hexdigest(), account_type, account[0], app.config['PASSWORD_RESET_TTL']))
+                link = app.config['APP_BASE_URL'] + url_for('reset_password', token=token)
+                mail.enqueue_email(cursor, email, 'Reset your Dhandha password',
+                                   f'Use this link to choose a new password: {link}\n\n'
+                                   f'It expires in {app.config["PASSWORD_RESET_TTL"] // 60} minutes. '
+                                   'If you did not ask for a reset, ignore this email.')
+        if account:
+            mail_worker.wake()
+        # Same answer either way, so the form can't be used to probe for accounts
+        flash('If that email is registered, a password reset link has been sent to it.', 'info')
         return redirect(url_for('login'))
     return render_template('forget_password.html')
 @app.route('/reset_password', methods=['GET', 'POST'])
 def reset_password():
+    token = request.values.get('token', '')
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, account_type, account_id FROM password_resets
+            WHERE token_hash = %s AND used_at IS NULL AND expires_at > NOW()
+        """, (token_hash,))
+        reset = cursor.fetchone()
+    if not reset:
+        flash('This password reset link is invalid or has expired.', 'error')
+        return redirect(url_for('forget_password'))
+
     if request.method == 'POST':
+        new_password = request.form.get('new_password', '')
+        if not new_password or new_password != request.form.get('confirm_password'):
+            flash('Passwords do not match.', 'error')
+            return redirect(url_for('reset_password', token=token))
+        table = 'agencies' if reset[1] == 'agency' else 'users'
+        account = None
+        with db.transaction() as cursor:
+            # Single use, even if the form is submitted twice
+            cursor.execute("UPDATE password_resets SET used_at = NOW() WHERE id = %s AND used_at IS NULL", (reset[0],))
+            if cursor.rowcount == 1:
+                cursor.execute(f"UPDATE {table} SET password = %s WHERE id = %s", (new_password, reset[2]))
+                cursor.execute(f"SELECT username FROM {table} WHERE id = %s", (reset[2],))
+                account = cursor.fetchone()
+        if account:
+            invalidate_principal(reset[1], account[0])
         flash('Your password has been reset successfully.', 'success')
         return redirect(url_for('login'))
-    return render_template('reset_password.html')
-if __name__ == '__main__':
+    return render_template('reset_password.html', token=token)
+
+# JSON API for the mobile client. Same session login and role checks as the
+# HTML views, answered with 401/403 instead of a redirect.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+API_JOBS = projection.Resource('jobs j', {
+    'id': ('j.id', ()),
+    'title': ('j.title', ()),
+    'country': ('j.country', ()),
+    'deadline': ('j.deadline', ()),
+    'posted_at': ('j.posted_at', ()),
+    'views': ('j.views', ()),
+    'snippet': (f"LEFT(j.description, {app.config['JOBS_SNIPPET_LENGTH']})", ()),
+    'description': ('j.description', ()),
+    'agency_id': ('j.agency_id', ()),
+    'company_name': ('a.company_name', ('agency',)),
+}, default=('id', 'title', 'country', 'deadline', 'posted_at', 'company_name', 'snippet'),
+    sort=('j.posted_at', 'j.id'), joins={'agency': 'JOIN agencies a ON a.id = j.agency_id'})
+API_JOB_DETAIL_FIELDS = ('id', 'title', 'country', 'deadline', 'posted_at', 'views', 'description', 'agency_id', 'company_name')
+API_MY_APPLICATIONS = projection.Resource('applications ap', {
+    'id': ('ap.id', ()),
+    'job_id': ('ap.job_id', ()),
+    'status': ('ap.status', ()),
+    'applied_at': ('ap.applied_at', ()),
+    'updated_at': ('ap.updated_at', ()),
+    'job_title': ('j.title', ('job',)),
+    'deadline': ('j.deadline', ('job',)),
+    'company_name': ('ag.company_name', ('job', 'agency')),
+}, default=('id', 'job_id', 'status', 'applied_at', 'job_title', 'company_name'),
+    sort=('ap.applied_at', 'ap.id'),
+    joins={'job': 'JOIN jobs j ON j.id = ap.job_id', 'agency': 'JOIN agencies ag ON ag.id = j.agency_id'})
+API_MY_BOOKMARKS = projection.Resource('job_bookmarks b', {
+    'id': ('b.id', ()),
+    'job_id': ('b.job_id', ()),
+    'bookmarked_at': ('b.bookmarked_at', ()),
+    'job_title': ('j.title', ('job',)),
+    'deadline': ('j.deadline', ('job',)),
+    'company_name': ('ag.company_name', ('job', 'agency')),
+}, default=('id', 'job_id', 'bookmarked_at', 'job_title', 'company_name'),
+    sort=('b.bookmarked_at', 'b.id'),
+    joins={'job': 'JOIN jobs j ON j.id = b.job_id', 'agency': 'JOIN agencies ag ON ag.id = j.agency_id'})
+API_JOB_APPLICATIONS = projection.Resource('applications ap', {
+    'id': ('ap.id', ()),
+    'name': ('ap.name', ()),
+    'email': ('ap.email', ()),
+    'contact': ('ap.contact', ()),
+    'status': ('ap.status', ()),
+    'applied_at': ('ap.applied_at', ()),
+    'updated_at': ('ap.updated_at', ()),
+    'cv_url': ('ap.cv_path', ()),
+    'username': ('u.username', ('user',)),
+}, default=('id', 'name', 'email', 'contact', 'status', 'applied_at', 'cv_url', 'username'),
+    sort=('ap.applied_at', 'ap.id'), joins={'user': 'JOIN users u ON u.id = ap.user_id'},
+    convert={'cv_url': lambda cv_path: url_for('uploaded_file', filename=cv_path)})
+API_NOTIFICATIONS = projection.Resource('notifications n', {
+    'id': ('n.id', ()),
+    'message': ('n.message', ()),
+    'category': ('n.category', ()),
+    'timestamp': ('n.timestamp', ()),
+    'is_read': ('n.is_read', ()),
+}, default=('id', 'message', 'category', 'timestamp', 'is_read'),
+    sort=('n.timestamp', 'n.id'), convert={'is_read': bool})
+@api.errorhandler(HTTPException)
+def api_error(error):
+    return jsonify({'error': error.description}), error.code
+def api_fields(resource, default=None):
+    requested = request.args.get('fields')
+    if not requested and default:
+        return list(default)
+    try:
+        return resource.parse_fields(requested)
+    except ValueError as e:
+        abort(400, str(e))
+def api_page(resource, where, params):
+    names = api_fields(resource)
+    token = request.args.get('cursor')
+    after = decode_cursor(token, (datetime, int))
+    if token and after is None:
+        abort(400, 'invalid cursor')
+    per_page = page_size(request.args.get('per_page'), app.config['API_PAGE_SIZE'], app.config['API_MAX_PAGE_SIZE'])
+    sql, params = resource.select(names, where, params, after, per_page + 1)
+    with db.read_cursor(as_dict=True) as cursor:
+        cursor.execute(sql, params)
+        rows = list(cursor.fetchall())
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1]['_sort_at'], rows[-1]['_sort_id'])
+    return jsonify({'data': [resource.serialize(row, names) for row in rows], 'next_cursor': next_cursor})
+@api.route('/jobs')
+def api_jobs():
+    return api_page(API_JOBS, ["j.deadline >= CURDATE()"], [])
+@api.route('/jobs/<int:job_id>')
+def api_job(job_id):
+    names = api_fields(API_JOBS, API_JOB_DETAIL_FIELDS)
+    sql, params = API_JOBS.select(names, ["j.id = %s", "j.deadline >= CURDATE()"], [job_id])
+    with db.read_cursor(as_dict=True) as cursor:
+        cursor.execute(sql, params)
+        job = cursor.fetchone()
+    if not job:
+        abort(404, 'job not found')
+    # A view through the app counts like one on the website
+    view_counter.increment(job_id)
+    if 'views' in names:
+        job['views'] += view_counter.pending([job_id]).get(job_id, 0)
+    return jsonify({'data': API_JOBS.serialize(job, names)})
+@api.route('/me/applications')
+def api_my_applications():
+    if not g.user:
+        abort(401, 'login required')
+    if g.user['is_agency']:
+        abort(403, 'only job seekers have applications')
+    return api_page(API_MY_APPLICATIONS, ["ap.user_id = %s"], [g.user['id']])
+@api.route('/me/bookmarks')
+def api_my_bookmarks():
+    if not g.user:
+        abort(401, 'login required')
+    if g.user['is_agency'] or g.user['is_admin']:
+        abort(403, 'only job seekers have bookmarks')
+    return api_page(API_MY_BOOKMARKS, ["b.user_id = %s"], [g.user['id']])
+@api.route('/agency/jobs/<int:job_id>/applications')
+def api_job_applications(job_id):
+    if not g.user:
+        abort(401, 'login required')
+    if not g.user['is_agency']:
+        abort(403, 'only agencies can view applications')
+    with db.cursor() as cursor:
+        if not owned_job(cursor, job_id):
+            abort(404, 'job not found')
+    return api_page(API_JOB_APPLICATIONS, ["ap.job_id = %s"], [job_id])
+@api.route('/notifications')
+def api_notifications():
+    if not g.user:
+        abort(401, 'login required')
+    return api_page(API_NOTIFICATIONS, [f"n.{recipient_column()} = %s"], [g.user['id']])
+app.register_blueprint(api)
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = migrations.migrate(db.connection)
+    print(f'Applied {len(applied)} migration(s).' if applied else 'Database is up to date.')
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the hot queries and report full scans and filesorts."""
+    print(migrations.format_findings(migrations.check_indexes(db.connection)))
+@app.cli.command('check-replicas')
+def check_replicas_command():
+    """Report each read replica's health and replication lag."""
+    if not db.replicas:
+        print('No replicas configured (MYSQL_REPLICAS).')
+    for replica in db.replicas:
+        replica.check()
+        stats = replica.get_stats()
+        state = 'ok' if stats['healthy'] else f"skipped ({stats['last_error']})"
+        print(f"{replica.name:<30} lag={stats['lag']}s {state}")
+@app.cli.command('index-recommendations')
+def index_recommendations_command():
+    """Build recommendation terms for jobs that don't have any yet."""
+    with db.cursor() as cursor:
+        indexed = recommend.backfill(cursor, log=print)
+    print(f'Indexed {indexed} job(s).' if indexed else 'All jobs are indexed.')
+@app.cli.command('import-jobs')
+@click.argument('path')
+@click.option('--agency', required=True, help='Username of the agency posting the jobs.')
+def import_jobs_command(path, agency):
+    """Import jobs from a CSV, JSON or JSON Lines file."""
+    fmt = job_import.detect_format(path)
+    if not fmt:
+        print('The file must end in .csv, .json, .jsonl or .ndjson.')
+        return
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id, company_name FROM agencies WHERE username = %s", (agency,))
+        found = cursor.fetchone()
+    if not found:
+        print(f'No agency named {agency}.')
+        return
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        result = job_import.import_jobs(db, found[0], job_import.read_records(f, fmt),
+                                        app.config['IMPORT_BATCH_SIZE'], app.config['IMPORT_MAX_ERRORS'])
+    jobs_imported(found[0], found[1], result['imported'])
+    for position, reason in result['errors']:
+        print(f'{position}: {reason}')
+    if result['stopped']:
+        print(f"Stopped reading the file: {result['stopped']}")
+    print(f"Imported {result['imported']} job(s) and skipped {result['rejected']} row(s) in {time.perf_counter() - started:.1f}s.")
+@app.cli.command('import-cvs')
+def import_cvs_command():
+    """Move CVs uploaded before content-addressed storage into the CV store."""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id, cv_path FROM applications WHERE cv_sha256 IS NULL")
+        legacy = cursor.fetchall()
+    imported = missing = 0
+    for application_id, cv_path in legacy:
+        if not os.path.exists(cv_path):
+            missing += 1
+            continue
+        with open(cv_path, 'rb') as f:
+            tmp, digest, size = cv_store.write_temp(f)
+        with db.transaction() as cursor:
+            claim_blob(cursor, digest, size)
+        new_path = cv_store.commit(tmp, digest)
+        with db.transaction() as cursor:
+            cursor.execute("UPDATE applications SET cv_path = %s, cv_sha256 = %s WHERE id = %s", (new_path, digest, application_id))
+        # Legacy uploads got a fresh random name per application, so nothing else points here
+        os.remove(cv_path)
+        imported += 1
+    print(f'Imported {imported} CV(s), {missing} file(s) missing.')
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Rebuild the per-job application and bookmark counters."""
+    with db.transaction() as cursor:
+        repaired = counters.reconcile(cursor)
+    print(f'Repaired counters on {repaired} job(s).' if repaired else 'All job counters are correct.')
+@app.cli.command('requeue-dead-mail')
+def requeue_dead_mail_command():
+    """Give dead-lettered emails a fresh set of delivery attempts."""
+    with db.transaction() as cursor:
+        cursor.execute("""
+            UPDATE email_outbox SET status = 'pending', attempts = 0, next_attempt_at = NOW(), updated_at = NOW()
+            WHERE status = 'dead'
+        """)
+        requeued = cursor.rowcount
+    print(f'Requeued {requeued} email(s).')
+@app.cli.command('requeue-dead-broadcasts')
+def requeue_dead_broadcasts_command():
+    """Give dead-lettered broadcasts a fresh set of delivery attempts."""
+    with db.transaction() as cursor:
+        cursor.execute("""
+            UPDATE notification_outbox SET status = 'pending', attempts = 0, next_attempt_at = NOW(), updated_at = NOW()
+            WHERE status = 'dead'
+        """)
+        requeued = cursor.rowcount
+    print(f'Requeued {requeued} broadcast(s).')
+    notification_fanout.wake()
+def flush_view_counts():
+    with app.app_context():
+        view_counter.flush()
+def prepare():
+    # Once per deployment, before any worker serves: schema migrations (also
+    # serialized across hosts by the migration lock) and the upload folder
     with app.app_context():
-        create_tables()
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
+        migrations.migrate(db.connection)
+    db.pool.close_idle()
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def create_app():
+    # Compiles every template up front; in a pre-forking server this runs in
+    # the master so the workers share the compiled code
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    return app
+def start_worker():
+    # Once per serving process, after any fork: fill the pool and start the
+    # background threads (threads and sockets don't survive a fork)
+    db.warm()
+    for worker in background_workers():
+        worker.start()
+    atexit.register(flush_view_counts)
+def stop_worker():
+    for worker in background_workers():
+        worker.stop()
+    flush_view_counts()
+if __name__ == '__main__':
+    # The reloader's parent process only watches files; set up in the child that serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        prepare()
+        create_app()
+        start_worker()
     app.run(debug=True)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+# Small in-process LRU cache with per-entry TTL, shared by the identity cache
+# and anything else that wants to skip a repeated query within one worker.
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# TTLCache whose keys carry the current generation of each tag they depend on.
+# invalidate(tag) bumps the generation, so every entry built from older data
+# stops matching and ages out through the normal LRU/TTL path.
+class TaggedCache(TTLCache):
+    def __init__(self, maxsize=1024, ttl=60):
+        super().__init__(maxsize, ttl)
+        self.invalidations = 0
+        self._generations = {}
+
+    def tagged_key(self, key, tags):
+        with self._lock:
+            return (key, tuple(self._generations.get(tag, 0) for tag in tags))
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            self.invalidations += 1
+
+    def get_stats(self):
+        stats = super().get_stats()
+        with self._lock:
+            stats.update({'invalidations': self.invalidations, 'generations': dict(self._generations)})
+        return stats
@@ -0,0 +1,46 @@
+# Per-job application and bookmark counters, kept on the jobs row so the agency
+# dashboard reads them without joining applications. Views adjust them in the
+# same transaction as the row they count; reconcile() rebuilds them from the
+# source tables when they drift (manual SQL, restores, ...).
+STATUS_COLUMNS = {
+    'Pending': 'applications_pending',
+    'Approved': 'applications_approved',
+    'Rejected': 'applications_rejected',
+}
+
+
+def adjust(cursor, job_id, **deltas):
+    assignments = ', '.join(f"{column} = GREATEST({column} + %s, 0)" for column in deltas)
+    cursor.execute(f"UPDATE jobs SET {assignments} WHERE id = %s", list(deltas.values()) + [job_id])
+
+
+def move_status(cursor, job_id, old_status, new_status):
+    deltas = {}
+    if old_status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[old_status]] = -1
+    if new_status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[new_status]] = 1
+    if deltas:
+        adjust(cursor, job_id, **deltas)
+
+
+def reconcile(cursor):
+    # Returns the number of jobs whose counters were wrong
+    cursor.execute("""
+        UPDATE jobs j
+        LEFT JOIN (
+            SELECT job_id,
+                SUM(status = 'Pending') AS pending,
+                SUM(status = 'Approved') AS approved,
+                SUM(status = 'Rejected') AS rejected
+            FROM applications GROUP BY job_id
+        ) a ON a.job_id = j.id
+        LEFT JOIN (
+            SELECT job_id, COUNT(*) AS bookmarks FROM job_bookmarks GROUP BY job_id
+        ) b ON b.job_id = j.id
+        SET j.applications_pending = COALESCE(a.pending, 0),
+            j.applications_approved = COALESCE(a.approved, 0),
+            j.applications_rejected = COALESCE(a.rejected, 0),
+            j.bookmarks_count = COALESCE(b.bookmarks, 0)
+    """)
+    return cursor.rowcount
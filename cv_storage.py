@@ -0,0 +1,135 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from worker import PeriodicWorker
+
+# Content-addressed CV storage. Uploads are streamed to a temp file while
+# being hashed, then moved to cv/<aa>/<bb>/<sha256>.pdf under the upload
+# folder, so the same PDF sent to several jobs is stored once. cv_blobs has a
+# row per stored file; applications point at it through cv_sha256.
+#
+# References are counted from applications when the collector runs rather
+# than kept in a counter: applications also disappear through ON DELETE
+# CASCADE (job deletes, expiry), which no counter or trigger would see.
+BLOB_PATH = re.compile(r'^cv/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})\.pdf$')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def create_blob_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cv_blobs (
+            sha256 CHAR(64) PRIMARY KEY,
+            size INT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def digest_from_path(relative_path):
+    match = BLOB_PATH.match(relative_path)
+    if match and match.group(3).startswith(match.group(1) + match.group(2)):
+        return match.group(3)
+    return None
+
+
+def claim_blob(cursor, digest, size):
+    # Touching last_used_at keeps the collector away until the referencing
+    # application is written. Waits on the row lock of a collection in progress.
+    cursor.execute("""
+        INSERT INTO cv_blobs (sha256, size) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE last_used_at = NOW()
+    """, (digest, size))
+    return cursor.rowcount == 1
+
+
+class CVStore:
+    def __init__(self, root, max_size, chunk_size=64 * 1024):
+        self.root = root
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def relative_path(self, digest):
+        # Also the URL path under /uploads, so always '/'-separated
+        return f'cv/{digest[:2]}/{digest[2:4]}/{digest}.pdf'
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def write_temp(self, stream):
+        tmp_dir = os.path.join(self.root, 'cv', 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge(f'CV is larger than {self.max_size} bytes')
+                    sha.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return tmp, sha.hexdigest(), size
+
+    def commit(self, tmp, digest):
+        # Always replace: the content is identical, and it restores a file a
+        # collection removed just before this upload claimed the blob again
+        target = self.path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp, target)
+        return self.relative_path(digest)
+
+    def remove(self, digest):
+        try:
+            os.remove(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class CVCollector(PeriodicWorker):
+    name = 'cv-collector'
+
+    def __init__(self, app, db, store):
+        super().__init__(app, db, app.config.get('CV_GC_INTERVAL', 3600))
+        self.store = store
+        self.grace = app.config.get('CV_GC_GRACE', 3600)
+        self.batch_size = app.config.get('CV_GC_BATCH_SIZE', 500)
+        self.stats.update({'collected': 0, 'freed_bytes': 0})
+
+    def run_once(self):
+        conn = self.db.connection
+        cursor = conn.cursor()
+        orphaned = """
+            last_used_at < NOW() - INTERVAL %s SECOND
+            AND NOT EXISTS (SELECT 1 FROM applications a WHERE a.cv_sha256 = cv_blobs.sha256)
+        """
+        try:
+            cursor.execute(f"SELECT sha256 FROM cv_blobs WHERE {orphaned} LIMIT %s", (self.grace, self.batch_size))
+            candidates = [row[0] for row in cursor.fetchall()]
+            for digest in candidates:
+                # Re-check under the row lock; a concurrent upload of the same
+                # CV waits in claim_blob() until this blob is gone
+                cursor.execute(f"SELECT size FROM cv_blobs WHERE sha256 = %s AND {orphaned} FOR UPDATE",
+                               (digest, self.grace))
+                row = cursor.fetchone()
+                if row:
+                    self.store.remove(digest)
+                    cursor.execute("DELETE FROM cv_blobs WHERE sha256 = %s", (digest,))
+                    self.count(collected=1, freed_bytes=row[0])
+                conn.commit()
+        finally:
+            cursor.close()
+        self.mark_run()
@@ -0,0 +1,442 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+from worker import PeriodicWorker
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Called as hook(sql, seconds) after every statement run through the cursors
+# below (per-request SQL metrics hang off this)
+QUERY_HOOKS = []
+
+
+class TimedCursorMixin:
+    _timing = False
+
+    def _timed(self, method, query, args):
+        # executemany() may fall back to execute(); only time the outer call
+        if self._timing:
+            return method(query, args)
+        self._timing = True
+        started = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            self._timing = False
+            elapsed = time.perf_counter() - started
+            for hook in QUERY_HOOKS:
+                hook(query, elapsed)
+
+    def execute(self, query, args=None):
+        return self._timed(super().execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(super().executemany, query, args)
+
+
+class Cursor(TimedCursorMixin, MySQLdb.cursors.Cursor):
+    pass
+
+
+class DictCursor(TimedCursorMixin, MySQLdb.cursors.DictCursor):
+    pass
+
+
+class SSCursor(TimedCursorMixin, MySQLdb.cursors.SSCursor):
+    pass
+
+
+class SSDictCursor(TimedCursorMixin, MySQLdb.cursors.SSDictCursor):
+    pass
+
+
+# Process-wide MySQL connection pool. Connections are created lazily up to
+# max_size, checked with ping() before being handed out and replaced once
+# they are older than `recycle` seconds. A fork (pre-fork servers) drops the
+# parent's connections instead of sharing sockets with it.
+class ConnectionPool:
+    def __init__(self, connect_kwargs, min_size=1, max_size=10, timeout=5, recycle=3600, pre_ping=True):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle = deque()
+        self._size = 0
+        self._pid = os.getpid()
+        self._created = {}
+        # Re-entrant, so _connect() can count under it while warm() holds it
+        self._cond = threading.Condition(threading.RLock())
+        self.metrics = {
+            'checkouts': 0, 'checkout_failures': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0,
+            'created': 0, 'recycled': 0, 'ping_failures': 0, 'discarded': 0
+        }
+
+    def _connect(self):
+        conn = MySQLdb.connect(**self.connect_kwargs)
+        with self._cond:
+            self.metrics['created'] += 1
+        return conn, time.monotonic()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._idle.clear()
+            self._created.clear()
+            self._size = 0
+            self._pid = os.getpid()
+
+    def warm(self):
+        with self._cond:
+            self._check_fork()
+            while self._size < self.min_size:
+                self._idle.append(self._connect())
+                self._size += 1
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            self._check_fork()
+            while True:
+                if self._idle:
+                    conn, created = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['checkout_failures'] += 1
+                    raise PoolTimeout(f'No database connection available after {timeout}s')
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn, created = self._connect()
+            elif self.recycle and time.monotonic() - created > self.recycle:
+                self._close(conn)
+                self._count('recycled')
+                conn, created = self._connect()
+            elif self.pre_ping:
+                try:
+                    conn.ping()
+                except MySQLdb.Error:
+                    self._count('ping_failures')
+                    self._close(conn)
+                    conn, created = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self.metrics['checkout_failures'] += 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self.metrics['checkouts'] += 1
+            self.metrics['wait_time_total'] += waited
+            self.metrics['wait_time_max'] = max(self.metrics['wait_time_max'], waited)
+            self._created[id(conn)] = created
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # Never hand an open transaction to the next borrower
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            created = self._created.pop(id(conn), time.monotonic())
+            if discard:
+                self._close(conn)
+                self._size -= 1
+                self.metrics['discarded'] += 1
+            else:
+                self._idle.append((conn, created))
+            self._cond.notify()
+
+    def close_idle(self):
+        # Used by a pre-fork master after its own setup queries, so no open
+        # socket is inherited by (and shared between) the forked workers
+        with self._cond:
+            while self._idle:
+                conn, created = self._idle.popleft()
+                self._created.pop(id(conn), None)
+                self._close(conn)
+                self._size -= 1
+
+    def _count(self, key):
+        with self._cond:
+            self.metrics[key] += 1
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def get_metrics(self):
+        with self._cond:
+            metrics = dict(self.metrics)
+            metrics.update({'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                            'min_size': self.min_size, 'max_size': self.max_size})
+        metrics['wait_time_avg'] = metrics['wait_time_total'] / metrics['checkouts'] if metrics['checkouts'] else 0.0
+        return metrics
+
+
+def replication_lag(cursor):
+    # Seconds the replica is behind its source, or None if it isn't replicating
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except MySQLdb.ProgrammingError:
+        # Before MySQL 8.0.22 / MariaDB 10.5.1
+        cursor.execute("SHOW SLAVE STATUS")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return None if lag is None else int(lag)
+
+
+# A read replica: its own pool plus a health flag kept current by
+# ReplicaMonitor. A replica that is too far behind, has stopped replicating or
+# can't be reached is skipped until a later check passes. Requests only read
+# the flag, so none of them waits on a probe of a dead replica.
+class Replica:
+    def __init__(self, name, pool, max_lag=5):
+        self.name = name
+        self.pool = pool
+        self.max_lag = max_lag
+        self.healthy = True
+        self.lag = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def usable(self):
+        return self.healthy
+
+    def check(self):
+        try:
+            conn = self.pool.acquire()
+        except (PoolTimeout, MySQLdb.Error) as e:
+            self.failed(e)
+            return
+        cursor = conn.cursor(DictCursor)
+        try:
+            lag = replication_lag(cursor)
+        except MySQLdb.Error as e:
+            cursor.close()
+            self.pool.release(conn, discard=True)
+            self.failed(e)
+            return
+        cursor.close()
+        self.pool.release(conn)
+        with self._lock:
+            self.lag = lag
+            self.healthy = lag is not None and lag <= self.max_lag
+            if lag is None:
+                self.last_error = 'not replicating'
+            elif lag > self.max_lag:
+                self.last_error = f'{lag}s behind'
+            else:
+                self.last_error = None
+
+    def failed(self, error):
+        with self._lock:
+            self.healthy = False
+            self.last_error = str(error)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {'healthy': self.healthy, 'lag': self.lag, 'last_error': self.last_error}
+        stats['pool'] = self.pool.get_metrics()
+        return stats
+
+
+class ReplicaMonitor(PeriodicWorker):
+    name = 'replica-monitor'
+
+    def __init__(self, app, db):
+        super().__init__(app, db, app.config.get('REPLICA_CHECK_INTERVAL', 5))
+
+    def run_once(self):
+        for replica in self.db.replicas:
+            replica.check()
+        self.mark_run()
+
+
+def cursor_class(as_dict, server_side):
+    if server_side:
+        return SSDictCursor if as_dict else SSCursor
+    return DictCursor if as_dict else Cursor
+
+
+# Flask integration. `db.connection` is the connection checked out for the
+# current app context (released on teardown); views use the cursor()/
+# transaction() context managers instead of closing and committing by hand.
+#
+# Read-only views may use read_cursor() instead, which goes to a healthy
+# replica from MYSQL_REPLICAS. Reads stay on the primary once the context has
+# written (or pin_primary() was called, e.g. for read-your-writes after a
+# redirect) and whenever no replica is usable.
+class Database:
+    def __init__(self, app=None):
+        self.pool = None
+        self.replicas = []
+        self.read_stats = {'replica': 0, 'primary_pinned': 0, 'primary_fallback': 0}
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        connect_kwargs = {
+            'host': config['MYSQL_HOST'],
+            'port': config.get('MYSQL_PORT', 3306),
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'],
+            'db': config['MYSQL_DB'],
+            'charset': config.get('MYSQL_CHARSET', 'utf8mb4'),
+            'connect_timeout': config.get('MYSQL_CONNECT_TIMEOUT', 10),
+            # Plain connection.cursor() calls (background workers) are timed too
+            'cursorclass': Cursor,
+        }
+        self.pool = self._make_pool(config, connect_kwargs)
+        for address in config.get('MYSQL_REPLICAS', []):
+            host, _, port = address.partition(':')
+            pool = self._make_pool(config, dict(connect_kwargs, host=host, port=int(port or 3306)))
+            self.replicas.append(Replica(address, pool, config.get('REPLICA_MAX_LAG', 5)))
+        app.teardown_appcontext(self.teardown)
+
+    def _make_pool(self, config, connect_kwargs):
+        return ConnectionPool(
+            connect_kwargs,
+            min_size=config.get('DB_POOL_MIN_SIZE', 1),
+            max_size=config.get('DB_POOL_MAX_SIZE', 10),
+            timeout=config.get('DB_POOL_TIMEOUT', 5),
+            recycle=config.get('DB_POOL_RECYCLE', 3600),
+            pre_ping=config.get('DB_POOL_PRE_PING', True))
+
+    def warm(self):
+        self.pool.warm()
+        for replica in self.replicas:
+            try:
+                replica.pool.warm()
+            except MySQLdb.Error as e:
+                replica.failed(e)
+
+    @property
+    def connection(self):
+        conn = g.get('_db_connection')
+        if conn is None:
+            conn = g._db_connection = self.pool.acquire()
+        return conn
+
+    @property
+    def read_connection(self):
+        if g.get('_db_primary'):
+            self._count_read('primary_pinned')
+            return self.connection
+        checked_out = g.get('_db_read')
+        if checked_out is not None:
+            return checked_out[1]
+        for replica in random.sample(self.replicas, len(self.replicas)):
+            if not replica.usable():
+                continue
+            try:
+                conn = replica.pool.acquire()
+            except (PoolTimeout, MySQLdb.Error) as e:
+                replica.failed(e)
+                continue
+            g._db_read = (replica, conn)
+            self._count_read('replica')
+            return conn
+        if self.replicas:
+            self._count_read('primary_fallback')
+        return self.connection
+
+    def _count_read(self, target):
+        with self._stats_lock:
+            self.read_stats[target] += 1
+
+    def pin_primary(self):
+        g._db_primary = True
+
+    @property
+    def wrote(self):
+        return g.get('_db_wrote', False)
+
+    def _mark_written(self):
+        # Later reads in this context must see the write
+        g._db_wrote = True
+        self.pin_primary()
+
+    def teardown(self, exception):
+        self.release()
+
+    def release(self):
+        # Hand the connection back early, e.g. before a long-lived response
+        # goes idle; the next query checks out a fresh one
+        conn = g.pop('_db_connection', None)
+        if conn is not None:
+            self.pool.release(conn)
+        checked_out = g.pop('_db_read', None)
+        if checked_out is not None:
+            replica, conn = checked_out
+            replica.pool.release(conn)
+
+    @contextmanager
+    def cursor(self, as_dict=False, server_side=False):
+        # Server-side cursors stream rows instead of buffering the whole result;
+        # the connection can't run another query until they are exhausted.
+        cursor = self.connection.cursor(cursor_class(as_dict, server_side))
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def read_cursor(self, as_dict=False, server_side=False):
+        cursor = self.read_connection.cursor(cursor_class(as_dict, server_side))
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self, as_dict=False):
+        conn = self.connection
+        cursor = conn.cursor(cursor_class(as_dict, False))
+        try:
+            yield cursor
+            conn.commit()
+            self._mark_written()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def commit(self):
+        self.connection.commit()
+        self._mark_written()
+
+    def rollback(self):
+        self.connection.rollback()
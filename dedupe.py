@@ -0,0 +1,203 @@
+import hashlib
+import random
+import re
+import sys
+from array import array
+from collections import defaultdict
+
+# Near-duplicate job detection. Each job's title and description are reduced
+# to word 3-gram shingles and a MinHash signature of NUM_HASHES values, whose
+# agreement estimates the Jaccard similarity of two jobs' shingle sets. For
+# lookups the signature is cut into BANDS bands; jobs sharing any band hash
+# are candidates (LSH), so a lookup reads BANDS primary-key ranges of
+# job_lsh_buckets instead of comparing against every job. With 16 bands of 4
+# rows, a pair at 0.6 similarity shares a band ~90% of the time and one at
+# 0.7 ~98%; candidates are then confirmed against the full signatures.
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+SHINGLE_SIZE = 3
+# Fixed seed: signatures are stored, so the hash family must never change
+_MASKS = [random.Random(20240601 + i).getrandbits(32) for i in range(NUM_HASHES)]
+WORD = re.compile(r'\w+')
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_signatures (
+            job_id INT PRIMARY KEY,
+            signature VARBINARY(256) NOT NULL,
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_lsh_buckets (
+            band TINYINT NOT NULL,
+            bucket BIGINT NOT NULL,
+            job_id INT NOT NULL,
+            PRIMARY KEY (band, bucket, job_id),
+            KEY idx_job_lsh_buckets_job (job_id),
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB
+    """)
+
+
+def shingles(title, description):
+    words = WORD.findall(f'{title} {description}'.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def signature(title, description):
+    # One 32-bit hash per shingle; each of the NUM_HASHES functions is that
+    # hash XORed with a fixed random mask. The hashes are packed side by side
+    # into one integer so each mask is applied with a single XOR and the
+    # minimum taken over a memoryview, without a Python loop per shingle.
+    hashes = array('I', [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'big')
+                         for s in shingles(title, description)])
+    width = len(hashes) * hashes.itemsize
+    packed = int.from_bytes(hashes, sys.byteorder)
+    lanes = int.from_bytes(array('I', [1]) * len(hashes), sys.byteorder)
+    return [min(memoryview((packed ^ mask * lanes).to_bytes(width, sys.byteorder)).cast('I')) for mask in _MASKS]
+
+
+def pack(values):
+    return b''.join(value.to_bytes(4, 'big') for value in values)
+
+
+def unpack(blob):
+    return [int.from_bytes(blob[i:i + 4], 'big') for i in range(0, len(blob), 4)]
+
+
+def band_buckets(values):
+    # Signed 64-bit so it fits a BIGINT column
+    for band in range(BANDS):
+        digest = hashlib.blake2b(pack(values[band * ROWS:(band + 1) * ROWS]), digest_size=8).digest()
+        yield band, int.from_bytes(digest, 'big', signed=True)
+
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+def write_signature(cursor, job_id, values):
+    cursor.execute("""
+        INSERT INTO job_signatures (job_id, signature) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE signature = VALUES(signature)
+    """, (job_id, pack(values)))
+    cursor.execute("DELETE FROM job_lsh_buckets WHERE job_id = %s", (job_id,))
+    cursor.executemany("INSERT INTO job_lsh_buckets (band, bucket, job_id) VALUES (%s, %s, %s)",
+                       [(band, bucket, job_id) for band, bucket in band_buckets(values)])
+
+
+def write_signatures(cursor, signed):
+    # signed is [(job_id, values)] for jobs that have no signature yet
+    cursor.executemany("INSERT INTO job_signatures (job_id, signature) VALUES (%s, %s)",
+                       [(job_id, pack(values)) for job_id, values in signed])
+    cursor.executemany("INSERT INTO job_lsh_buckets (band, bucket, job_id) VALUES (%s, %s, %s)",
+                       [(band, bucket, job_id) for job_id, values in signed for band, bucket in band_buckets(values)])
+
+
+def index_job(cursor, job_id, values=None):
+    if values is None:
+        cursor.execute("SELECT title, description FROM jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+        if not row:
+            return
+        values = signature(row[0], row[1])
+    write_signature(cursor, job_id, values)
+
+
+def find_duplicates(cursor, values, threshold, agency_id=None, exclude_job_id=None, limit=5):
+    # Live jobs whose estimated similarity to `values` is at least threshold,
+    # as [(job_id, title, similarity)], most similar first
+    buckets = list(band_buckets(values))
+    where = " OR ".join(["(b.band = %s AND b.bucket = %s)"] * len(buckets))
+    params = [value for pair in buckets for value in pair]
+    query = f"""
+        SELECT DISTINCT j.id, j.title, s.signature
+        FROM job_lsh_buckets b
+        JOIN jobs j ON j.id = b.job_id
+        JOIN job_signatures s ON s.job_id = b.job_id
+        WHERE ({where}) AND j.deadline >= CURDATE()
+    """
+    if agency_id is not None:
+        query += " AND j.agency_id = %s"
+        params.append(agency_id)
+    if exclude_job_id is not None:
+        query += " AND j.id <> %s"
+        params.append(exclude_job_id)
+    cursor.execute(query, params)
+    matches = []
+    for job_id, title, blob in cursor.fetchall():
+        score = similarity(values, unpack(blob))
+        if score >= threshold:
+            matches.append((job_id, title, score))
+    matches.sort(key=lambda match: match[2], reverse=True)
+    return matches[:limit]
+
+
+def duplicate_clusters(cursor, threshold, max_bucket_size=50):
+    # Groups live jobs into clusters of near-duplicates across all agencies.
+    # Buckets larger than max_bucket_size (boilerplate shared by many jobs) are
+    # skipped; every candidate pair is confirmed against the full signatures.
+    cursor.execute("""
+        SELECT GROUP_CONCAT(b.job_id)
+        FROM job_lsh_buckets b
+        JOIN jobs j ON j.id = b.job_id
+        WHERE j.deadline >= CURDATE()
+        GROUP BY b.band, b.bucket
+        HAVING COUNT(*) BETWEEN 2 AND %s
+    """, (max_bucket_size,))
+    groups = [[int(job_id) for job_id in row[0].split(',')] for row in cursor.fetchall()]
+    candidates = sorted({job_id for group in groups for job_id in group})
+    if not candidates:
+        return []
+    signatures = {}
+    for start in range(0, len(candidates), 1000):
+        chunk = candidates[start:start + 1000]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT job_id, signature FROM job_signatures WHERE job_id IN ({placeholders})", chunk)
+        signatures.update((job_id, unpack(blob)) for job_id, blob in cursor.fetchall())
+
+    parent = {}
+
+    def find(job_id):
+        parent.setdefault(job_id, job_id)
+        while parent[job_id] != job_id:
+            parent[job_id] = parent[parent[job_id]]
+            job_id = parent[job_id]
+        return job_id
+
+    for group in groups:
+        for i, a in enumerate(group):
+            for b in group[i + 1:]:
+                if a in signatures and b in signatures and similarity(signatures[a], signatures[b]) >= threshold:
+                    parent[find(a)] = find(b)
+    clusters = defaultdict(list)
+    for job_id in parent:
+        clusters[find(job_id)].append(job_id)
+    return sorted((sorted(members) for members in clusters.values() if len(members) > 1), key=len, reverse=True)
+
+
+def backfill(cursor, batch_size=1000, log=None):
+    # Signs jobs that have no signature yet, one batch per transaction
+    indexed = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT j.id, j.title, j.description FROM jobs j
+            WHERE j.id > %s AND NOT EXISTS (SELECT 1 FROM job_signatures s WHERE s.job_id = j.id)
+            ORDER BY j.id LIMIT %s
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        write_signatures(cursor, [(job_id, signature(title, description)) for job_id, title, description in rows])
+        cursor.connection.commit()
+        indexed += len(rows)
+        last_id = rows[-1][0]
+        if log:
+            log(f'Signed {indexed} job(s) for duplicate detection')
+    return indexed
@@ -0,0 +1,87 @@
+import time
+from datetime import datetime
+
+import versions
+from worker import PeriodicWorker
+
+# Background reaper for jobs whose deadline has passed. Every worker may run
+# one, but a MySQL named lock plus the job_runs row make sure only one of them
+# actually does the work per interval.
+EXPIRY_JOB_NAME = 'job_expiry'
+EXPIRY_LOCK_NAME = 'dhandha_job_expiry'
+
+
+class ExpiryReaper(PeriodicWorker):
+    name = 'job-expiry-reaper'
+
+    def __init__(self, app, db, on_expired=None):
+        self.on_expired = on_expired
+        self.run_interval = app.config.get('JOB_EXPIRY_INTERVAL', 86400)
+        # Poll more often than the interval so a worker picks the job up soon
+        # after another worker's run becomes due.
+        super().__init__(app, db, min(self.run_interval, 300))
+        self.batch_size = app.config.get('JOB_EXPIRY_BATCH_SIZE', 500)
+        self.archive = app.config.get('JOB_EXPIRY_MODE', 'delete') == 'archive'
+        self.stats.update({'skipped': 0, 'expired_total': 0, 'last_expired': 0, 'last_duration': None})
+
+    def run_once(self, force=False):
+        conn = self.db.connection
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (EXPIRY_LOCK_NAME,))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            self.count(skipped=1)
+            return 0
+        try:
+            cursor.execute("SELECT last_run_at FROM job_runs WHERE name = %s", (EXPIRY_JOB_NAME,))
+            row = cursor.fetchone()
+            if not force and row and row[0] and (datetime.now() - row[0]).total_seconds() < self.run_interval:
+                self.count(skipped=1)
+                return 0
+
+            started = time.monotonic()
+            expired = 0
+            while True:
+                cursor.execute("SELECT id FROM jobs WHERE deadline < CURDATE() ORDER BY id LIMIT %s", (self.batch_size,))
+                ids = [r[0] for r in cursor.fetchall()]
+                if not ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(ids))
+                if self.archive:
+                    cursor.execute(f"""
+                        INSERT INTO expired_jobs (id, title, country, deadline, description, posted_at, views, agency_id)
+                        SELECT id, title, country, deadline, description, posted_at, views, agency_id
+                        FROM jobs WHERE id IN ({placeholders})
+                    """, ids)
+                cursor.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", ids)
+                versions.bump(cursor, 'jobs')
+                conn.commit()
+                expired += len(ids)
+                if len(ids) < self.batch_size:
+                    break
+
+            duration = time.monotonic() - started
+            cursor.execute("""
+                INSERT INTO job_runs (name, last_run_at, last_affected, total_affected)
+                VALUES (%s, NOW(), %s, %s)
+                ON DUPLICATE KEY UPDATE last_run_at = NOW(), last_affected = VALUES(last_affected),
+                    total_affected = total_affected + VALUES(total_affected)
+            """, (EXPIRY_JOB_NAME, expired, expired))
+            conn.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (EXPIRY_LOCK_NAME,))
+            cursor.fetchone()
+            cursor.close()
+
+        self.mark_run()
+        self.count(expired_total=expired)
+        self.note(last_expired=expired, last_duration=round(duration, 3))
+        if expired and self.on_expired:
+            self.on_expired(expired)
+        return expired
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({'interval': self.run_interval, 'batch_size': self.batch_size,
+                      'mode': 'archive' if self.archive else 'delete'})
+        return stats
@@ -0,0 +1,67 @@
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+
+# Generators behind the application exports. Both yield output as they go, so
+# memory use depends on the chunk size, not on how many applicants a job has.
+CHUNK_SIZE = 64 * 1024
+
+
+def stream_csv(header, rows, batch=100):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _Pipe:
+    # Write-only file object for ZipFile; whatever was written is drained and
+    # sent after every chunk. Being unseekable makes ZipFile write data
+    # descriptors instead of going back to patch the local headers.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(files):
+    # files yields (name in archive, path on disk); missing files are listed
+    # in MISSING.txt instead of failing a download that is already under way
+    pipe = _Pipe()
+    missing = []
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_STORED) as archive:
+        for name, path in files:
+            if not path or not os.path.isfile(path):
+                missing.append(name)
+                continue
+            info = zipfile.ZipInfo(name, datetime.fromtimestamp(os.path.getmtime(path)).timetuple()[:6])
+            info.file_size = os.path.getsize(path)
+            with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield pipe.drain()
+            yield pipe.drain()
+        if missing:
+            archive.writestr('MISSING.txt', '\n'.join(missing) + '\n')
+    yield pipe.drain()
@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+
+# Pre-fork server settings; every value can be overridden from the environment
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# gthread serves one request per thread. Notification streams
+# (NOTIFY_PUSH_MODE=stream) hold a connection each for minutes, so run them
+# with an async class such as 'gevent', where idle streams cost no thread.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+# Import the app (and compile templates) once in the master; workers inherit it
+preload_app = True
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+
+
+def on_starting(server):
+    # Master only, before any worker is forked
+    import app
+    app.prepare()
+
+
+def post_fork(server, worker):
+    import app
+    app.start_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.stop_worker()
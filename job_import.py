@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+import re
+from datetime import date
+
+import dedupe
+import recommend
+import search
+import versions
+
+# Bulk job import. Files are parsed a record at a time and valid rows are
+# inserted in batches, each batch committed in its own transaction together
+# with its search, recommendation and duplicate-detection rows, so memory and
+# lock time depend on the batch size rather than on the file. Batches before a
+# failure stay committed; invalid rows are skipped and reported.
+FIELDS = ('title', 'country', 'deadline', 'description')
+MAX_LENGTHS = {'title': 100, 'country': 50}
+MAX_DESCRIPTION_BYTES = 65535
+COUNTRY = re.compile(r"[^\W\d_]+(?:[ .'(),-]+[^\W\d_]+)*\.?\)?")
+# Rows per INSERT statement. A statement's auto-increment ids start at
+# lastrowid and step by auto_increment_increment (above 1 on multi-primary
+# setups such as Galera), which is how the new job ids are known without
+# reading them back.
+INSERT_ROWS = 100
+JSON_CHUNK = 64 * 1024
+JSON_MAX_RECORD = 1024 * 1024
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'json', '.ndjson': 'json'}
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def detect_format(filename):
+    return FORMATS.get(('.' + filename.rsplit('.', 1)[-1].lower()) if '.' in filename else '')
+
+
+def read_csv(stream):
+    # Yields (position, record); the header row names the columns
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    try:
+        for record in reader:
+            yield f'line {reader.line_num}', record
+    except csv.Error as e:
+        raise ImportFileError(f'line {reader.line_num}: {e}')
+
+
+def read_json(stream):
+    # A top-level array of objects, or one object per line (JSON Lines).
+    # Records are decoded from a sliding buffer, so only the current chunk and
+    # record are held in memory.
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    decoder = json.JSONDecoder()
+    separators = re.compile(r'[\s,]*')
+    buffer = ''
+    pos = 0
+    number = 0
+    opened = eof = False
+    while True:
+        pos = separators.match(buffer, pos).end()
+        if not opened and pos < len(buffer):
+            opened = True
+            if buffer[pos] == '[':
+                pos += 1
+                continue
+        if buffer.startswith(']', pos):
+            return
+        if pos < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof or len(buffer) - pos > JSON_MAX_RECORD:
+                    raise ImportFileError(f'item {number + 1}: {e.msg}')
+            else:
+                number += 1
+                yield f'item {number}', record
+                pos = end
+                continue
+        if eof:
+            return
+        chunk = text.read(JSON_CHUNK)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def read_records(stream, fmt):
+    return read_csv(stream) if fmt == 'csv' else read_json(stream)
+
+
+def validate(record, today):
+    # Returns (row, None) for a valid record, (None, reason) otherwise
+    if not isinstance(record, dict):
+        return None, 'not an object'
+    values = {}
+    for field in FIELDS:
+        value = record.get(field)
+        value = '' if value is None else str(value).strip()
+        if not value:
+            return None, f'{field} is required'
+        if field in MAX_LENGTHS and len(value) > MAX_LENGTHS[field]:
+            return None, f'{field} is longer than {MAX_LENGTHS[field]} characters'
+        values[field] = value
+    country = ' '.join(values['country'].split())
+    if not COUNTRY.fullmatch(country):
+        return None, f'{country!r} is not a country name'
+    try:
+        deadline = date.fromisoformat(values['deadline'])
+    except ValueError:
+        return None, 'deadline must be a date (YYYY-MM-DD)'
+    if deadline <= today:
+        return None, 'deadline must be in the future'
+    if len(values['description'].encode()) > MAX_DESCRIPTION_BYTES:
+        return None, 'description is too long'
+    return (values['title'], country, deadline, values['description']), None
+
+
+def insert_batch(cursor, agency_id, rows):
+    cursor.execute("SELECT @@auto_increment_increment")
+    step = cursor.fetchone()[0]
+    job_ids = []
+    for start in range(0, len(rows), INSERT_ROWS):
+        chunk = rows[start:start + INSERT_ROWS]
+        cursor.execute(
+            "INSERT INTO jobs (title, country, deadline, description, agency_id) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk)),
+            [value for row in chunk for value in row + (agency_id,)])
+        job_ids.extend(range(cursor.lastrowid, cursor.lastrowid + len(chunk) * step, step))
+    search.index_jobs(cursor, job_ids)
+    recommend.write_batch(cursor, [(job_id, title, description, country, deadline)
+                                   for job_id, (title, country, deadline, description) in zip(job_ids, rows)])
+    dedupe.write_signatures(cursor, [(job_id, dedupe.signature(title, description))
+                                     for job_id, (title, country, deadline, description) in zip(job_ids, rows)])
+    versions.bump(cursor, 'jobs')
+    return job_ids
+
+
+def import_jobs(db, agency_id, records, batch_size=1000, max_errors=100):
+    # records yields (position, record). Returns the number of jobs imported,
+    # the number of rows rejected, the first max_errors (position, reason) and
+    # why reading stopped early if the file turned out to be malformed.
+    result = {'imported': 0, 'rejected': 0, 'errors': [], 'stopped': None}
+    today = date.today()
+    batch = []
+
+    def reject(position, reason):
+        result['rejected'] += 1
+        if len(result['errors']) < max_errors:
+            result['errors'].append((position, reason))
+
+    def flush():
+        with db.transaction() as cursor:
+            insert_batch(cursor, agency_id, batch)
+        result['imported'] += len(batch)
+        batch.clear()
+
+    try:
+        for position, record in records:
+            row, reason = validate(record, today)
+            if reason:
+                reject(position, reason)
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+    except (ImportFileError, UnicodeDecodeError) as e:
+        # Rows read so far are still imported
+        result['stopped'] = str(e)
+    if batch:
+        flush()
+    return result
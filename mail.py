@@ -0,0 +1,218 @@
+import os
+import random
+import smtplib
+import uuid
+from datetime import datetime
+from email.message import EmailMessage
+
+from worker import PeriodicWorker
+
+# Outgoing email goes through email_outbox: requests only insert a row, and
+# EmailWorker sends pending rows in batches through the configured transport.
+# A failed send is retried with exponential backoff (plus jitter) until
+# MAIL_MAX_ATTEMPTS, after which the row is parked as 'dead' for inspection
+# and `flask requeue-dead-mail`.
+CLAIMABLE = """(
+    (status = 'pending' AND next_attempt_at <= NOW())
+    OR (status = 'sending' AND updated_at < NOW() - INTERVAL %s SECOND)
+)"""
+
+
+def create_email_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            recipient VARCHAR(120) NOT NULL,
+            subject VARCHAR(200) NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            attempts INT DEFAULT 0,
+            claim_token CHAR(32),
+            last_error TEXT,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME,
+            KEY idx_email_outbox_status (status, next_attempt_at),
+            KEY idx_email_outbox_claim (claim_token)
+        )
+    """)
+
+
+def enqueue_email(cursor, recipient, subject, body):
+    cursor.execute("""
+        INSERT INTO email_outbox (recipient, subject, body)
+        VALUES (%s, %s, %s)
+    """, (recipient, subject, body))
+    return cursor.lastrowid
+
+
+class FileTransport:
+    # Writes each message to an .eml file; for development and tests
+    def __init__(self, directory, sender):
+        self.directory = directory
+        self.sender = sender
+
+    def send(self, recipient, subject, body):
+        os.makedirs(self.directory, exist_ok=True)
+        message = build_message(self.sender, recipient, subject, body)
+        name = f"{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}.eml"
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(message.as_bytes())
+
+
+class SMTPTransport:
+    def __init__(self, host, port, sender, username=None, password=None, use_tls=True, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send(self, recipient, subject, body):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(build_message(self.sender, recipient, subject, body))
+
+
+class SendGridTransport:
+    def __init__(self, api_key, sender):
+        # Imported here so the other transports work without the package
+        from sendgrid import SendGridAPIClient
+        self.client = SendGridAPIClient(api_key)
+        self.sender = sender
+
+    def send(self, recipient, subject, body):
+        from sendgrid.helpers.mail import Mail
+        response = self.client.send(Mail(from_email=self.sender, to_emails=recipient,
+                                         subject=subject, plain_text_content=body))
+        if response.status_code >= 300:
+            raise RuntimeError(f'SendGrid returned {response.status_code}')
+
+
+def build_message(sender, recipient, subject, body):
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+
+def make_transport(config):
+    kind = config.get('MAIL_TRANSPORT', 'file')
+    sender = config.get('MAIL_FROM', 'no-reply@dhandha.local')
+    if kind == 'sendgrid':
+        return SendGridTransport(config['SENDGRID_API_KEY'], sender)
+    if kind == 'smtp':
+        return SMTPTransport(config.get('SMTP_HOST', 'localhost'), config.get('SMTP_PORT', 587), sender,
+                             config.get('SMTP_USERNAME'), config.get('SMTP_PASSWORD'), config.get('SMTP_USE_TLS', True))
+    if kind == 'file':
+        return FileTransport(config.get('MAIL_FILE_DIR', 'mail_outbox'), sender)
+    raise ValueError(f'Unknown MAIL_TRANSPORT: {kind}')
+
+
+class EmailWorker(PeriodicWorker):
+    name = 'email-sender'
+
+    def __init__(self, app, db, transport=None):
+        super().__init__(app, db, app.config.get('MAIL_POLL_INTERVAL', 10))
+        self.transport = transport or make_transport(app.config)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 50)
+        self.max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 8)
+        self.backoff_base = app.config.get('MAIL_BACKOFF_BASE', 30)
+        self.backoff_max = app.config.get('MAIL_BACKOFF_MAX', 3600)
+        self.stale_after = app.config.get('MAIL_STALE_AFTER', 300)
+        self.stats.update({'sent': 0, 'failed': 0, 'dead': 0})
+
+    def run_once(self):
+        while True:
+            token, batch = self.claim()
+            for row in batch:
+                if self.renew(token, row[0]):
+                    self.deliver(token, *row)
+            if len(batch) < self.batch_size:
+                break
+        self.mark_run()
+
+    def claim(self):
+        # The claim token tells this worker which rows of the batch it won
+        token = uuid.uuid4().hex
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                UPDATE email_outbox SET status = 'sending', claim_token = %s, updated_at = NOW()
+                WHERE {CLAIMABLE}
+                ORDER BY next_attempt_at LIMIT %s
+            """, (token, self.stale_after, self.batch_size))
+            conn.commit()
+            cursor.execute("SELECT id, recipient, subject, body, attempts FROM email_outbox WHERE claim_token = %s", (token,))
+            return token, cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def renew(self, token, email_id):
+        # Before each send: refresh the whole claim so the rest of a slow batch
+        # never looks stale, and skip the row if another worker reclaimed it
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE email_outbox SET updated_at = NOW() WHERE claim_token = %s", (token,))
+            cursor.execute("SELECT 1 FROM email_outbox WHERE id = %s AND claim_token = %s", (email_id, token))
+            owned = cursor.fetchone() is not None
+            conn.commit()
+            return owned
+        finally:
+            cursor.close()
+
+    def backoff(self, attempts):
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        return int(delay * random.uniform(0.8, 1.2))
+
+    def deliver(self, token, email_id, recipient, subject, body, attempts):
+        # Every outcome is written only while this worker still holds the claim
+        try:
+            self.transport.send(recipient, subject, body)
+        except Exception as e:
+            attempts += 1
+            conn = self.db.connection
+            cursor = conn.cursor()
+            try:
+                if attempts >= self.max_attempts:
+                    cursor.execute("""
+                        UPDATE email_outbox SET status = 'dead', attempts = %s, last_error = %s,
+                            claim_token = NULL, updated_at = NOW()
+                        WHERE id = %s AND claim_token = %s
+                    """, (attempts, str(e), email_id, token))
+                    self.count(dead=1)
+                else:
+                    cursor.execute("""
+                        UPDATE email_outbox SET status = 'pending', attempts = %s, last_error = %s, claim_token = NULL,
+                            next_attempt_at = NOW() + INTERVAL %s SECOND, updated_at = NOW()
+                        WHERE id = %s AND claim_token = %s
+                    """, (attempts, str(e), self.backoff(attempts), email_id, token))
+                    self.count(failed=1)
+                conn.commit()
+            finally:
+                cursor.close()
+            return False
+
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, claim_token = NULL,
+                    sent_at = NOW(), updated_at = NOW()
+                WHERE id = %s AND claim_token = %s
+            """, (email_id, token))
+            conn.commit()
+        finally:
+            cursor.close()
+        self.count(sent=1)
+        return True
@@ -0,0 +1,195 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+
+import db as db_module
+
+# Per-request instrumentation: route latency, SQL statement count/time and
+# Jinja render time, kept in a small in-process registry and rendered in the
+# Prometheus text format by /metrics. Each request also logs one JSON line to
+# the 'dhandha.requests' logger. Metrics are per process; scrape every worker
+# (or put them behind a multiprocess-aware exporter) to see the whole fleet.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger('dhandha.requests')
+
+
+class Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _labels(self, labels, extra=''):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f'{self.name}{self._labels(labels)} {value}' for labels, value in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self.values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f'{self.name}_bucket{self._labels(labels, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{self._labels(labels)} {total}')
+                lines.append(f'{self.name}_count{self._labels(labels)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames, collect):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{self._labels(labels)} {value}' for labels, value in sorted(values.items())]
+
+
+class Instrumentation:
+    def __init__(self, app):
+        self.app = app
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', 100)
+        self.profile_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_dir = app.config.get('PROFILE_DIR', 'profiles')
+        self.metrics = []
+        self.requests = self.add(Counter('http_requests_total', 'Requests handled', ('endpoint', 'method', 'status')))
+        self.latency = self.add(Histogram('http_request_duration_seconds', 'Request latency', ('endpoint',)))
+        self.sql_per_request = self.add(Histogram('sql_queries_per_request', 'SQL statements per request', ('endpoint',), COUNT_BUCKETS))
+        self.sql_time = self.add(Histogram('sql_time_per_request_seconds', 'Total SQL time per request', ('endpoint',)))
+        self.sql_duration = self.add(Histogram('sql_query_duration_seconds', 'Duration of single SQL statements'))
+        self.slow_queries = self.add(Counter('sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS', ('endpoint',)))
+        self.render_time = self.add(Histogram('template_render_seconds', 'Jinja render time', ('template',)))
+        self.profiled = self.add(Counter('profiled_requests_total', 'Requests captured by the sampling profiler'))
+
+        if app.config.get('REQUEST_LOG', True) and not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        db_module.QUERY_HOOKS.append(self.record_query)
+        app.before_request(self.start_request)
+        app.after_request(self.capture_status)
+        app.teardown_request(self.finish_request)
+        before_render_template.connect(self.start_render, app)
+        template_rendered.connect(self.finish_render, app)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, collect, labelnames=()):
+        return self.add(Gauge(name, help, labelnames, collect))
+
+    def record_query(self, sql, seconds):
+        self.sql_duration.observe((), seconds)
+        if not has_request_context() or 'request_started' not in g:
+            return
+        g.sql_count += 1
+        g.sql_time += seconds
+        if seconds * 1000 >= self.slow_query_ms:
+            g.slow_queries.append({'ms': round(seconds * 1000, 1), 'sql': ' '.join(str(sql).split())[:300]})
+
+    def start_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.slow_queries = []
+        g.render_time = 0.0
+        if self.profile_rate and random.random() < self.profile_rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def capture_status(self, response):
+        g.response_status = response.status_code
+        return response
+
+    def finish_request(self, exception):
+        if 'request_started' not in g:
+            return
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        status = g.get('response_status', 500)
+        self.requests.inc((endpoint, request.method, str(status)))
+        self.latency.observe((endpoint,), elapsed)
+        self.sql_per_request.observe((endpoint,), g.sql_count)
+        self.sql_time.observe((endpoint,), g.sql_time)
+        if g.slow_queries:
+            self.slow_queries.inc((endpoint,), len(g.slow_queries))
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f'{int(time.time())}_{endpoint}_{int(elapsed * 1000)}ms.prof'))
+            self.profiled.inc()
+        logger.info(json.dumps({
+            'method': request.method, 'path': request.path, 'endpoint': endpoint, 'status': status,
+            'ms': round(elapsed * 1000, 1), 'sql_count': g.sql_count, 'sql_ms': round(g.sql_time * 1000, 1),
+            'render_ms': round(g.render_time * 1000, 1), 'slow_queries': g.slow_queries,
+        }))
+
+    def start_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.render_started = time.perf_counter()
+
+    def finish_render(self, sender, template, context, **extra):
+        if has_request_context() and 'render_started' in g:
+            elapsed = time.perf_counter() - g.pop('render_started')
+            g.render_time = g.get('render_time', 0.0) + elapsed
+            self.render_time.observe((template.name,), elapsed)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
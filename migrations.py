@@ -0,0 +1,479 @@
+import MySQLdb.cursors
+
+import counters
+import cv_storage
+import dedupe
+import mail
+import notify
+import recommend
+import search
+import versions
+
+# Ordered, recorded schema migrations. Each migration runs once per database
+# and is recorded in schema_migrations. MySQL commits DDL implicitly, so every
+# step is written to be safe to re-run if a migration dies half way.
+MIGRATIONS = []
+MIGRATION_LOCK_NAME = 'dhandha_migrations'
+
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def ensure_index(cursor, table, name, columns, unique=False):
+    if not index_exists(cursor, table, name):
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+
+
+def column_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def ensure_column(cursor, table, name, definition):
+    if not column_exists(cursor, table, name):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def drop_index(cursor, table, name):
+    if index_exists(cursor, table, name):
+        cursor.execute(f"DROP INDEX {name} ON {table}")
+
+
+@migration(1, 'initial_schema')
+def initial_schema(cursor):
+    # Create Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(20) UNIQUE NOT NULL,
+            password VARCHAR(60) NOT NULL,
+            email VARCHAR(120) UNIQUE NOT NULL,
+            phone VARCHAR(20),
+            firstname VARCHAR(20),
+            lastname VARCHAR(20),
+            is_agency BOOLEAN DEFAULT FALSE,
+            is_admin BOOLEAN DEFAULT FALSE,
+            status VARCHAR(20) DEFAULT 'verified'
+        )
+    """)
+
+    # Create Agencies table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agencies (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(20) UNIQUE NOT NULL,
+            password VARCHAR(60) NOT NULL,
+            email VARCHAR(120) UNIQUE NOT NULL,
+            phone VARCHAR(20),
+            company_name VARCHAR(100) NOT NULL,
+            trade_license VARCHAR(100) UNIQUE NOT NULL,
+            is_agency BOOLEAN DEFAULT TRUE,
+            is_admin BOOLEAN DEFAULT FALSE,
+            status VARCHAR(20) DEFAULT 'pending'
+        )
+    """)
+
+    # Create Jobs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            title VARCHAR(100) NOT NULL,
+            country VARCHAR(50) NOT NULL,
+            deadline DATE NOT NULL,
+            description TEXT NOT NULL,
+            posted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            views INT DEFAULT 0,
+            agency_id INT NOT NULL,
+            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
+        )
+    """)
+    # Create Applications table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS applications (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(120) NOT NULL,
+            contact VARCHAR(20) NOT NULL,
+            cv_path VARCHAR(200) NOT NULL,
+            status VARCHAR(20) DEFAULT 'Pending',
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_id INT NOT NULL,
+            job_id INT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        )
+    """)
+    # Create Job Bookmarks table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_bookmarks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            job_id INT NOT NULL,
+            bookmarked_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        )
+    """)
+    # Create Notifications table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            message TEXT NOT NULL,
+            category VARCHAR(20) DEFAULT 'info',
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_read BOOLEAN DEFAULT FALSE,
+            user_id INT,
+            agency_id INT,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
+        )
+    """)
+    # Create SuccessStories table and modify to allow agency stories
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS success_stories (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            content TEXT NOT NULL,
+            rating INT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            author_id INT,
+            agency_id INT,
+            FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE CASCADE
+        )
+    """)
+    # Insert a default admin user if not exists
+    cursor.execute("SELECT * FROM users WHERE is_admin = 1")
+    admin_exists = cursor.fetchone()
+    if not admin_exists:
+        cursor.execute("""
+            INSERT INTO users (username, password, email, firstname, lastname, is_admin)
+            VALUES ('admin', 'adminpassword', 'admin@example.com', 'Admin', 'User', TRUE)
+        """)
+
+
+@migration(2, 'background_job_tables')
+def background_job_tables(cursor):
+    # Bookkeeping for background jobs so several workers don't repeat a run
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            name VARCHAR(50) PRIMARY KEY,
+            last_run_at DATETIME,
+            last_affected INT DEFAULT 0,
+            total_affected BIGINT DEFAULT 0
+        )
+    """)
+    # Expired jobs moved out of jobs when JOB_EXPIRY_MODE is 'archive'
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS expired_jobs (
+            id INT PRIMARY KEY,
+            title VARCHAR(100) NOT NULL,
+            country VARCHAR(50) NOT NULL,
+            deadline DATE NOT NULL,
+            description TEXT NOT NULL,
+            posted_at DATETIME,
+            views INT DEFAULT 0,
+            agency_id INT NOT NULL,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Pending broadcast notifications
+    notify.create_outbox_table(cursor)
+
+
+@migration(3, 'job_search')
+def job_search(cursor):
+    search.create_search_table(cursor)
+
+
+@migration(4, 'hot_query_indexes')
+def hot_query_indexes(cursor):
+    # /jobs listing order and the expiry reaper's deadline scan
+    ensure_index(cursor, 'jobs', 'idx_jobs_posted_at_id', 'posted_at, id')
+    ensure_index(cursor, 'jobs', 'idx_jobs_deadline', 'deadline')
+    # Notification history per recipient, newest first
+    ensure_index(cursor, 'notifications', 'idx_notifications_user_timestamp', 'user_id, timestamp')
+    ensure_index(cursor, 'notifications', 'idx_notifications_agency_timestamp', 'agency_id, timestamp')
+
+
+@migration(5, 'unique_applications_and_bookmarks')
+def unique_applications_and_bookmarks(cursor):
+    # Keep the earliest row of any duplicates left by the old check-then-insert
+    cursor.execute("""
+        DELETE later FROM applications later
+        JOIN applications earlier
+            ON later.user_id = earlier.user_id AND later.job_id = earlier.job_id AND later.id > earlier.id
+    """)
+    cursor.execute("""
+        DELETE later FROM job_bookmarks later
+        JOIN job_bookmarks earlier
+            ON later.user_id = earlier.user_id AND later.job_id = earlier.job_id AND later.id > earlier.id
+    """)
+    ensure_index(cursor, 'applications', 'uq_applications_user_job', 'user_id, job_id', unique=True)
+    ensure_index(cursor, 'job_bookmarks', 'uq_job_bookmarks_user_job', 'user_id, job_id', unique=True)
+    # Superseded by the unique keys
+    drop_index(cursor, 'applications', 'idx_applications_user_job')
+    drop_index(cursor, 'job_bookmarks', 'idx_job_bookmarks_user_job')
+
+
+@migration(6, 'data_version_columns')
+def data_version_columns(cursor):
+    # Set explicitly on edits (not ON UPDATE, so view count flushes don't touch
+    # it); the listing ETags are built from these.
+    ensure_column(cursor, 'jobs', 'updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP')
+    cursor.execute("UPDATE jobs SET updated_at = posted_at WHERE updated_at > posted_at")
+    ensure_column(cursor, 'applications', 'updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP')
+    cursor.execute("UPDATE applications SET updated_at = applied_at WHERE updated_at > applied_at")
+    # Lets the /jobs version query run from the index alone
+    ensure_index(cursor, 'jobs', 'idx_jobs_deadline_updated_at', 'deadline, updated_at')
+    drop_index(cursor, 'jobs', 'idx_jobs_deadline')
+
+
+@migration(7, 'cv_blobs')
+def cv_blobs(cursor):
+    cv_storage.create_blob_table(cursor)
+    ensure_index(cursor, 'cv_blobs', 'idx_cv_blobs_last_used_at', 'last_used_at')
+    # NULL for CVs uploaded before content-addressed storage (see `flask import-cvs`)
+    ensure_column(cursor, 'applications', 'cv_sha256', 'CHAR(64) NULL')
+    cursor.execute("""
+        SELECT 1 FROM information_schema.referential_constraints
+        WHERE constraint_schema = DATABASE() AND constraint_name = 'fk_applications_cv_blob'
+    """)
+    if not cursor.fetchone():
+        cursor.execute("""
+            ALTER TABLE applications ADD CONSTRAINT fk_applications_cv_blob
+            FOREIGN KEY (cv_sha256) REFERENCES cv_blobs(sha256)
+        """)
+
+
+@migration(8, 'admin_stats_indexes')
+def admin_stats_indexes(cursor):
+    # Index-only COUNT/GROUP BY for the admin stats snapshot and pending list
+    ensure_index(cursor, 'applications', 'idx_applications_status', 'status')
+    ensure_index(cursor, 'jobs', 'idx_jobs_country', 'country')
+    ensure_index(cursor, 'agencies', 'idx_agencies_status', 'status, id')
+
+
+@migration(9, 'job_counters')
+def job_counters(cursor):
+    for column in list(counters.STATUS_COLUMNS.values()) + ['bookmarks_count']:
+        ensure_column(cursor, 'jobs', column, 'INT NOT NULL DEFAULT 0')
+    counters.reconcile(cursor)
+
+
+@migration(10, 'notification_unread_indexes')
+def notification_unread_indexes(cursor):
+    # Unread badge counts; the FK indexes already cover "id > cursor" reads
+    ensure_index(cursor, 'notifications', 'idx_notifications_user_unread', 'user_id, is_read')
+    ensure_index(cursor, 'notifications', 'idx_notifications_agency_unread', 'agency_id, is_read')
+
+
+@migration(11, 'email_outbox_and_password_resets')
+def email_outbox_and_password_resets(cursor):
+    mail.create_email_table(cursor)
+    # Only a hash of the emailed token is stored
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS password_resets (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            token_hash CHAR(64) NOT NULL UNIQUE,
+            account_type VARCHAR(10) NOT NULL,
+            account_id INT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            used_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(12, 'job_terms')
+def job_terms(cursor):
+    recommend.create_terms_table(cursor)
+    recommend.backfill(cursor)
+
+
+@migration(13, 'job_signatures')
+def job_signatures(cursor):
+    dedupe.create_tables(cursor)
+    dedupe.backfill(cursor)
+
+
+@migration(14, 'keyset_indexes')
+def keyset_indexes(cursor):
+    # Newest-first keyset pages of a user's applications and bookmarks and of
+    # a job's applications (the API lists; the id tiebreak is the PK suffix)
+    ensure_index(cursor, 'applications', 'idx_applications_user_applied_at', 'user_id, applied_at')
+    ensure_index(cursor, 'applications', 'idx_applications_job_applied_at', 'job_id, applied_at')
+    ensure_index(cursor, 'job_bookmarks', 'idx_job_bookmarks_user_bookmarked_at', 'user_id, bookmarked_at')
+
+
+@migration(15, 'data_versions')
+def data_versions(cursor):
+    versions.create_table(cursor)
+
+
+@migration(16, 'search_listing_indexes')
+def search_listing_indexes(cursor):
+    # Searches without q list newest first, optionally in one country. The
+    # deadline filter is a range, so it trails the sort column: a leading
+    # deadline would sort every live row before the LIMIT. The job_id
+    # tiebreak is the PK suffix.
+    ensure_index(cursor, 'job_search', 'idx_job_search_posted_at_deadline', 'posted_at, deadline')
+    ensure_index(cursor, 'job_search', 'idx_job_search_country_posted_at', 'country, posted_at, deadline')
+    drop_index(cursor, 'job_search', 'idx_job_search_country')
+
+
+@migration(17, 'notification_outbox_retries')
+def notification_outbox_retries(cursor):
+    # Failed broadcasts are retried with backoff instead of stopping for good;
+    # rows that failed before this are parked as dead for requeue-dead-broadcasts
+    ensure_column(cursor, 'notification_outbox', 'attempts', 'INT DEFAULT 0')
+    ensure_column(cursor, 'notification_outbox', 'next_attempt_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP')
+    cursor.execute("UPDATE notification_outbox SET status = 'dead' WHERE status = 'failed'")
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(connection):
+    cursor = connection.cursor()
+    applied = applied_versions(cursor)
+    cursor.close()
+    return [(version, name) for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]) if version not in applied]
+
+
+def migrate(connection, log=print):
+    cursor = connection.cursor()
+    # Several workers may start at once; only one runs the migrations
+    cursor.execute("SELECT GET_LOCK(%s, 60)", (MIGRATION_LOCK_NAME,))
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        raise RuntimeError('Timed out waiting for the migration lock')
+    applied = []
+    try:
+        done = applied_versions(cursor)
+        for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            log(f'Applying migration {version:04d} {name}')
+            fn(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            connection.commit()
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+    return applied
+
+
+# The app's hot queries, EXPLAINed by check_indexes() to spot missing indexes.
+# Parameters are representative values; only the plan matters.
+HOT_QUERIES = [
+    ('jobs listing', """
+        SELECT j.id, j.title, j.country, j.deadline, j.posted_at, j.views, a.company_name
+        FROM jobs j JOIN agencies a ON j.agency_id = a.id
+        WHERE j.deadline >= CURDATE()
+        ORDER BY j.posted_at DESC, j.id DESC LIMIT 25
+    """, ()),
+    ('job details', "SELECT j.*, a.company_name FROM jobs j JOIN agencies a ON j.agency_id = a.id WHERE j.id = %s", (1,)),
+    ('applied flags', "SELECT job_id FROM applications WHERE user_id = %s AND job_id IN (%s, %s)", (1, 1, 2)),
+    ('bookmarked flags', "SELECT job_id FROM job_bookmarks WHERE user_id = %s AND job_id IN (%s, %s)", (1, 1, 2)),
+    ('already applied', "SELECT id FROM applications WHERE user_id = %s AND job_id = %s", (1, 1)),
+    ('my applications', """
+        SELECT a.id, a.status, a.applied_at, j.title FROM applications a
+        JOIN jobs j ON a.job_id = j.id
+        WHERE a.user_id = %s ORDER BY a.applied_at DESC
+    """, (1,)),
+    ('view applications', """
+        SELECT a.id, a.name, a.status, u.username FROM applications a
+        JOIN users u ON a.user_id = u.id
+        WHERE a.job_id = %s ORDER BY a.applied_at DESC
+    """, (1,)),
+    ('agency dashboard', "SELECT id, title, applications_pending FROM jobs WHERE agency_id = %s ORDER BY id DESC", (1,)),
+    ('user notifications', "SELECT * FROM notifications WHERE user_id = %s ORDER BY timestamp DESC", (1,)),
+    ('agency notifications', "SELECT * FROM notifications WHERE agency_id = %s ORDER BY timestamp DESC", (1,)),
+    ('expired jobs', "SELECT id FROM jobs WHERE deadline < CURDATE() ORDER BY id LIMIT 500", ()),
+    ('applications by status', "SELECT status, COUNT(*) FROM applications GROUP BY status", ()),
+    ('jobs by country', "SELECT country, COUNT(*) AS n FROM jobs GROUP BY country ORDER BY n DESC LIMIT 20", ()),
+    ('pending agencies', "SELECT id, username FROM agencies WHERE status = 'pending' ORDER BY id LIMIT 25", ()),
+    ('unread count', "SELECT COUNT(*) FROM notifications WHERE user_id = %s AND is_read = FALSE", (1,)),
+    ('new notifications', "SELECT id, message FROM notifications WHERE user_id = %s AND id > %s ORDER BY id LIMIT 50", (1, 0)),
+    ('jobs version', "SELECT version, updated_at FROM data_versions WHERE name = %s", ('jobs',)),
+    ('applications version', "SELECT COUNT(*), MAX(updated_at) FROM applications WHERE job_id = %s", (1,)),
+    ('my bookmarks', """
+        SELECT b.id, b.job_id, b.bookmarked_at FROM job_bookmarks b
+        WHERE b.user_id = %s ORDER BY b.bookmarked_at DESC, b.id DESC LIMIT 26
+    """, (1,)),
+    ('recommendation postings', """
+        SELECT job_id, term, weight FROM job_terms
+        WHERE term = %s AND deadline >= CURDATE() ORDER BY weight DESC LIMIT 200
+    """, ('driver',)),
+    ('duplicate candidates', """
+        SELECT DISTINCT j.id FROM job_lsh_buckets b JOIN jobs j ON j.id = b.job_id
+        WHERE ((b.band = %s AND b.bucket = %s) OR (b.band = %s AND b.bucket = %s)) AND j.agency_id = %s
+    """, (0, 1, 1, 2, 1)),
+    ('recommendation profile', "SELECT term, weight FROM job_terms WHERE job_id IN (%s, %s)", (1, 2)),
+    ('search listing', """
+        SELECT s.job_id FROM job_search s
+        WHERE s.deadline >= CURDATE() AND (s.posted_at < %s OR (s.posted_at = %s AND s.job_id < %s))
+        ORDER BY s.posted_at DESC, s.job_id DESC LIMIT 25
+    """, ('2030-01-01', '2030-01-01', 1)),
+    ('search listing by country', """
+        SELECT s.job_id FROM job_search s
+        WHERE s.deadline >= CURDATE() AND s.country = %s
+        ORDER BY s.posted_at DESC, s.job_id DESC LIMIT 25
+    """, ('Qatar',)),
+    ('search facets', """
+        SELECT s.country, COUNT(*) AS count FROM job_search s
+        WHERE s.deadline >= CURDATE() GROUP BY s.country
+    """, ()),
+]
+
+
+def check_indexes(connection):
+    # Returns (query name, table, access type, key, extra) for every plan row
+    # that scans a whole table or sorts/groups through a temporary table.
+    findings = []
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    for name, sql, params in HOT_QUERIES:
+        cursor.execute("EXPLAIN " + sql, params)
+        for row in cursor.fetchall():
+            extra = row.get('Extra') or ''
+            if row.get('type') == 'ALL' or 'Using temporary' in extra or 'Using filesort' in extra:
+                findings.append((name, row.get('table'), row.get('type'), row.get('key'), extra))
+    cursor.close()
+    return findings
+
+
+def format_findings(findings):
+    if not findings:
+        return f'All {len(HOT_QUERIES)} hot queries use indexes.'
+    lines = [f'{"query":<22} {"table":<16} {"type":<8} {"key":<36} extra']
+    for name, table, access, key, extra in findings:
+        lines.append(f'{name:<22} {table or "":<16} {access or "":<8} {key or "-":<36} {extra}')
+    return '\n'.join(lines)
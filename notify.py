@@ -0,0 +1,213 @@
+import random
+import threading
+
+from worker import PeriodicWorker
+
+# Broadcast notifications ("new job posted") go through notification_outbox:
+# the request inserts one outbox row and returns, and NotificationFanout copies
+# it into per-user notification rows in keyset-ordered chunks. Progress
+# (delivered, last_user_id) is committed with every chunk, so a crashed run
+# resumes where it stopped once its claim goes stale. A failed run puts the
+# row back to 'pending' after an exponential backoff (plus jitter); after
+# NOTIFY_MAX_ATTEMPTS it is parked as 'dead' for inspection and
+# `flask requeue-dead-broadcasts`.
+AUDIENCE_QUERIES = {
+    'users': "SELECT id FROM users WHERE is_agency = FALSE AND is_admin = FALSE AND id > %s ORDER BY id LIMIT %s",
+}
+AUDIENCE_COUNTS = {
+    'users': "SELECT COUNT(*) FROM users WHERE is_agency = FALSE AND is_admin = FALSE",
+}
+CLAIMABLE = """(
+    (status = 'pending' AND next_attempt_at <= NOW())
+    OR (status = 'processing' AND updated_at < NOW() - INTERVAL %s SECOND)
+)"""
+
+
+def create_outbox_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            message TEXT NOT NULL,
+            category VARCHAR(20) DEFAULT 'info',
+            audience VARCHAR(20) NOT NULL DEFAULT 'users',
+            agency_id INT,
+            status VARCHAR(20) DEFAULT 'pending',
+            total INT,
+            delivered INT DEFAULT 0,
+            last_user_id INT DEFAULT 0,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            completed_at DATETIME,
+            KEY idx_notification_outbox_status (status, id),
+            FOREIGN KEY (agency_id) REFERENCES agencies(id) ON DELETE SET NULL
+        )
+    """)
+
+
+def enqueue_broadcast(cursor, message, category='info', audience='users', agency_id=None):
+    cursor.execute("""
+        INSERT INTO notification_outbox (message, category, audience, agency_id)
+        VALUES (%s, %s, %s, %s)
+    """, (message, category, audience, agency_id))
+    return cursor.lastrowid
+
+
+class NotificationFanout(PeriodicWorker):
+    name = 'notification-fanout'
+
+    def __init__(self, app, db):
+        super().__init__(app, db, app.config.get('NOTIFY_POLL_INTERVAL', 5))
+        self.batch_size = app.config.get('NOTIFY_BATCH_SIZE', 1000)
+        self.stale_after = app.config.get('NOTIFY_STALE_AFTER', 300)
+        self.max_attempts = app.config.get('NOTIFY_MAX_ATTEMPTS', 5)
+        self.backoff_base = app.config.get('NOTIFY_BACKOFF_BASE', 30)
+        self.backoff_max = app.config.get('NOTIFY_BACKOFF_MAX', 3600)
+        self.stats.update({'broadcasts': 0, 'delivered_total': 0, 'failed': 0, 'dead': 0})
+
+    def run_once(self):
+        while True:
+            outbox_id = self.claim()
+            if outbox_id is None:
+                break
+            self.deliver(outbox_id)
+        self.mark_run()
+
+    def claim(self):
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT id FROM notification_outbox WHERE {CLAIMABLE} ORDER BY id LIMIT 1", (self.stale_after,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            # Only one worker wins the conditional update
+            cursor.execute(f"""
+                UPDATE notification_outbox SET status = 'processing', updated_at = NOW()
+                WHERE id = %s AND {CLAIMABLE}
+            """, (row[0], self.stale_after))
+            conn.commit()
+            return row[0] if cursor.rowcount == 1 else self.claim()
+        finally:
+            cursor.close()
+
+    def deliver(self, outbox_id):
+        try:
+            self.fan_out(outbox_id)
+        except Exception as e:
+            self.retry_later(outbox_id, e)
+            raise
+
+    def fan_out(self, outbox_id):
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT message, category, audience, total, last_user_id
+                FROM notification_outbox WHERE id = %s
+            """, (outbox_id,))
+            message, category, audience, total, last_user_id = cursor.fetchone()
+            if audience not in AUDIENCE_QUERIES:
+                raise ValueError(f'Unknown notification audience: {audience}')
+            if total is None:
+                cursor.execute(AUDIENCE_COUNTS[audience])
+                cursor.execute("UPDATE notification_outbox SET total = %s WHERE id = %s", (cursor.fetchone()[0], outbox_id))
+                conn.commit()
+
+            while True:
+                cursor.execute(AUDIENCE_QUERIES[audience], (last_user_id, self.batch_size))
+                user_ids = [r[0] for r in cursor.fetchall()]
+                if not user_ids:
+                    break
+                cursor.executemany("""
+                    INSERT INTO notifications (message, category, user_id)
+                    VALUES (%s, %s, %s)
+                """, [(message, category, user_id) for user_id in user_ids])
+                last_user_id = user_ids[-1]
+                cursor.execute("""
+                    UPDATE notification_outbox SET delivered = delivered + %s, last_user_id = %s, updated_at = NOW()
+                    WHERE id = %s
+                """, (len(user_ids), last_user_id, outbox_id))
+                conn.commit()
+                self.count(delivered_total=len(user_ids))
+
+            cursor.execute("""
+                UPDATE notification_outbox SET status = 'done', completed_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+            """, (outbox_id,))
+            conn.commit()
+            self.count(broadcasts=1)
+        finally:
+            cursor.close()
+
+    def backoff(self, attempts):
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        return int(delay * random.uniform(0.8, 1.2))
+
+    def retry_later(self, outbox_id, error):
+        # The failure may have been the connection itself: hand it back (the
+        # pool drops it if it can't roll back) and record the outcome on a
+        # fresh one. Delivery progress is kept, so the retry resumes.
+        self.db.release()
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT attempts FROM notification_outbox WHERE id = %s", (outbox_id,))
+            attempts = cursor.fetchone()[0] + 1
+            if attempts >= self.max_attempts:
+                cursor.execute("""
+                    UPDATE notification_outbox SET status = 'dead', attempts = %s, error = %s, updated_at = NOW()
+                    WHERE id = %s AND status = 'processing'
+                """, (attempts, str(error), outbox_id))
+                self.count(dead=1)
+            else:
+                cursor.execute("""
+                    UPDATE notification_outbox SET status = 'pending', attempts = %s, error = %s,
+                        next_attempt_at = NOW() + INTERVAL %s SECOND, updated_at = NOW()
+                    WHERE id = %s AND status = 'processing'
+                """, (attempts, str(error), self.backoff(attempts), outbox_id))
+                self.count(failed=1)
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+# Wakes requests waiting for new notifications (SSE streams, long polls).
+# Waiters hold no database connection while they sleep. send_notification()
+# publishes its own inserts straight away; rows written by other processes or
+# by the fan-out worker are picked up by polling the global MAX(id), one
+# query per process rather than one per connected client.
+class NotificationHub(PeriodicWorker):
+    name = 'notification-hub'
+
+    def __init__(self, app, db):
+        super().__init__(app, db, app.config.get('NOTIFY_PUSH_POLL_INTERVAL', 2))
+        self.high_water = 0
+        self._cond = threading.Condition()
+        self.stats.update({'waiters': 0, 'wakeups': 0})
+
+    def run_once(self):
+        cursor = self.db.connection.cursor()
+        try:
+            cursor.execute("SELECT MAX(id) FROM notifications")
+            self.publish(cursor.fetchone()[0] or 0)
+        finally:
+            cursor.close()
+        self.mark_run()
+
+    def publish(self, notification_id):
+        with self._cond:
+            if notification_id <= self.high_water:
+                return
+            self.high_water = notification_id
+            self._cond.notify_all()
+        self.count(wakeups=1)
+
+    def wait(self, seen, timeout):
+        # True once anything newer than `seen` (an earlier high_water) exists
+        self.count(waiters=1)
+        try:
+            with self._cond:
+                return self._cond.wait_for(lambda: self.high_water > seen, timeout)
+        finally:
+            self.count(waiters=-1)
@@ -0,0 +1,45 @@
+import base64
+import json
+from datetime import datetime, date
+
+
+# Opaque keyset cursors: the sort key of the last row on a page, serialized as
+# urlsafe base64 JSON so clients can't depend on its shape.
+def encode_cursor(*values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, types):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if len(values) != len(types):
+            return None
+        return tuple(_decode_value(v, t) for v, t in zip(values, types))
+    except (ValueError, TypeError):
+        return None
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(value, kind):
+    if kind is datetime:
+        return datetime.fromisoformat(value)
+    if kind is date:
+        return date.fromisoformat(value)
+    return kind(value)
+
+
+def page_size(requested, default, maximum):
+    try:
+        size = int(requested) if requested else default
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
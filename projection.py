@@ -0,0 +1,67 @@
+from datetime import date, datetime
+
+# Sparse fieldsets for the JSON API. A Resource names the fields a client may
+# request with ?fields=, each with the SQL expression behind it and the joins
+# it needs, so a query selects and joins only what the response returns.
+# Lists are keyset-ordered newest first on (sort timestamp, id); the sort key
+# is always selected, as _sort_at and _sort_id, to build the next cursor.
+
+
+class Resource:
+    def __init__(self, table, fields, default, sort, joins=None, convert=None):
+        self.table = table
+        self.fields = fields
+        self.default = tuple(default)
+        self.sort = sort
+        self.joins = joins or {}
+        self.convert = convert or {}
+
+    def parse_fields(self, value):
+        # Comma-separated field names, in the order given; raises ValueError
+        if not value:
+            return list(self.default)
+        names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise ValueError(f"unknown field(s) {', '.join(unknown) or '(none given)'}; "
+                             f"available: {', '.join(self.fields)}")
+        return names
+
+    def select(self, names, where, params, after=None, limit=None):
+        # Returns (sql, params). With a limit the rows are ordered for keyset
+        # paging and start after the (timestamp, id) cursor, if any.
+        sort_at, sort_id = self.sort
+        needed = {join for name in names for join in self.fields[name][1]}
+        columns = [f'{self.fields[name][0]} AS `{name}`' for name in names]
+        columns += [f'{sort_at} AS _sort_at', f'{sort_id} AS _sort_id']
+        sql = f"SELECT {', '.join(columns)} FROM {self.table}"
+        for join, clause in self.joins.items():
+            if join in needed:
+                sql += f" {clause}"
+        sql += f" WHERE {' AND '.join(where)}"
+        params = list(params)
+        if after:
+            sql += f" AND ({sort_at} < %s OR ({sort_at} = %s AND {sort_id} < %s))"
+            params += [after[0], after[0], after[1]]
+        if limit:
+            sql += f" ORDER BY {sort_at} DESC, {sort_id} DESC LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    def serialize(self, row, names):
+        item = {}
+        for name in names:
+            value = row[name]
+            if name in self.convert and value is not None:
+                value = self.convert[name](value)
+            item[name] = compact(value)
+        return item
+
+
+def compact(value):
+    # ISO 8601 without microseconds: 2024-05-01 and 2024-05-01T09:30:00
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
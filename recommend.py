@@ -0,0 +1,173 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# "Jobs for you": every job is stored as a sparse TF-IDF-style vector in
+# job_terms (one row per term, at most MAX_TERMS per job), written by
+# post_job/edit_job in the same transaction as the job and removed with it by
+# the ON DELETE CASCADE foreign key. The (term, weight) index keeps each term's
+# postings in impact order, so a recommendation reads the top postings of the
+# user's strongest terms instead of scanning jobs.
+#
+# Stored weights are length-normalized term frequencies; IDF is applied on the
+# profile side at query time from document frequencies counted (up to DF_CAP,
+# which bounds the count and floors the IDF of very common terms) and cached,
+# so adding a job never requires rewriting other jobs' rows.
+MAX_TERMS = 32
+TITLE_BOOST = 3
+DF_CAP = 10000
+TOKEN = re.compile(r'[a-z][a-z0-9+#]{1,38}')
+STOPWORDS = frozenset("""
+    a about above after all also an and any are as at be been being below between both but by can could did do
+    does doing during each few for from further had has have having here how if in into is it its just more most
+    must need needed no nor not now of off on once only or other our out over own per same should so some such
+    than that the their them then there these they this those through to too under until up very was we were what
+    when where which while who will with within would you your job jobs work working worker workers apply
+""".split())
+
+
+def create_terms_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_terms (
+            job_id INT NOT NULL,
+            term VARCHAR(40) NOT NULL,
+            weight FLOAT NOT NULL,
+            deadline DATE NOT NULL,
+            PRIMARY KEY (job_id, term),
+            KEY idx_job_terms_term_weight (term, weight, deadline),
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB
+    """)
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def vectorize(title, description, country):
+    # Title words count TITLE_BOOST times; the country is one opaque term so
+    # "Saudi Arabia" doesn't match jobs that merely mention Arabia.
+    counts = Counter(tokenize(description))
+    for token in tokenize(title):
+        counts[token] += TITLE_BOOST
+    counts['country:' + country.strip().lower()[:32]] += TITLE_BOOST
+    weights = {term: 1 + math.log(count) for term, count in counts.most_common(MAX_TERMS)}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {term: w / norm for term, w in weights.items()}
+
+
+def write_terms(cursor, job_id, deadline, vector):
+    cursor.execute("DELETE FROM job_terms WHERE job_id = %s", (job_id,))
+    if vector:
+        cursor.executemany("INSERT INTO job_terms (job_id, term, weight, deadline) VALUES (%s, %s, %s, %s)",
+                           [(job_id, term, weight, deadline) for term, weight in vector.items()])
+
+
+def write_batch(cursor, jobs):
+    # jobs is [(job_id, title, description, country, deadline)] for jobs that
+    # have no terms yet; one executemany for the whole batch
+    cursor.executemany("INSERT INTO job_terms (job_id, term, weight, deadline) VALUES (%s, %s, %s, %s)",
+                       [(job_id, term, weight, deadline)
+                        for job_id, title, description, country, deadline in jobs
+                        for term, weight in vectorize(title, description, country).items()])
+
+
+def index_job(cursor, job_id):
+    cursor.execute("SELECT title, description, country, deadline FROM jobs WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    if row:
+        write_terms(cursor, job_id, row[3], vectorize(row[0], row[1], row[2]))
+
+
+def backfill(cursor, batch_size=1000, log=None):
+    # Indexes jobs that have no terms yet, one batch per transaction; safe to
+    # re-run after an interruption
+    indexed = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT j.id, j.title, j.description, j.country, j.deadline FROM jobs j
+            WHERE j.id > %s AND NOT EXISTS (SELECT 1 FROM job_terms t WHERE t.job_id = j.id)
+            ORDER BY j.id LIMIT %s
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        write_batch(cursor, rows)
+        cursor.connection.commit()
+        indexed += len(rows)
+        last_id = rows[-1][0]
+        if log:
+            log(f'Indexed {indexed} job(s) for recommendations')
+    return indexed
+
+
+class Recommender:
+    def __init__(self, df_cache, profile_jobs=50, profile_terms=24, postings_per_term=200):
+        self.df_cache = df_cache
+        self.profile_jobs = profile_jobs
+        self.profile_terms = profile_terms
+        self.postings_per_term = postings_per_term
+
+    def document_frequencies(self, cursor, terms):
+        found = {term: self.df_cache.get(('df', term)) for term in terms}
+        missing = [term for term, df in found.items() if df is None]
+        if missing:
+            cursor.execute(" UNION ALL ".join(
+                ["SELECT %s, COUNT(*) FROM (SELECT 1 FROM job_terms WHERE term = %s LIMIT %s) t"] * len(missing)),
+                [value for term in missing for value in (term, term, DF_CAP)])
+            for term, df in cursor.fetchall():
+                found[term] = df
+                self.df_cache.set(('df', term), df)
+        total = self.df_cache.get('jobs')
+        if total is None:
+            cursor.execute("SELECT COUNT(*) FROM jobs WHERE deadline >= CURDATE()")
+            total = cursor.fetchone()[0]
+            self.df_cache.set('jobs', total)
+        return found, max(total, 1)
+
+    def profile(self, cursor, user_id):
+        # Most recent applications and bookmarks make the profile; everything
+        # the user has already applied to or bookmarked is excluded from results
+        cursor.execute("""
+            SELECT job_id FROM (
+                SELECT job_id, applied_at AS at FROM applications WHERE user_id = %s
+                UNION ALL
+                SELECT job_id, bookmarked_at AS at FROM job_bookmarks WHERE user_id = %s
+            ) seen ORDER BY at DESC
+        """, (user_id, user_id))
+        seen = [row[0] for row in cursor.fetchall()]
+        recent = list(dict.fromkeys(seen))[:self.profile_jobs]
+        vector = defaultdict(float)
+        if recent:
+            placeholders = ', '.join(['%s'] * len(recent))
+            cursor.execute(f"SELECT term, weight FROM job_terms WHERE job_id IN ({placeholders})", recent)
+            for term, weight in cursor.fetchall():
+                vector[term] += weight
+        return vector, set(seen)
+
+    def recommend(self, cursor, user_id, k=20):
+        # Returns [(job_id, score)], best first
+        vector, seen = self.profile(cursor, user_id)
+        if not vector:
+            return []
+        # IDF is only looked up for the strongest raw terms, to bound the counting
+        shortlist = sorted(vector, key=vector.get, reverse=True)[:self.profile_terms * 3]
+        df, total = self.document_frequencies(cursor, shortlist)
+        weighted = {term: vector[term] * math.log(1 + total / max(df.get(term) or 1, 1)) for term in shortlist}
+        terms = sorted(weighted, key=weighted.get, reverse=True)[:self.profile_terms]
+
+        # One index range read per term, strongest postings first
+        query = " UNION ALL ".join(["""
+            (SELECT job_id, term, weight FROM job_terms
+             WHERE term = %s AND deadline >= CURDATE() ORDER BY weight DESC LIMIT %s)
+        """] * len(terms))
+        params = []
+        for term in terms:
+            params += [term, self.postings_per_term]
+        cursor.execute(query, params)
+        scores = defaultdict(float)
+        for job_id, term, weight in cursor.fetchall():
+            if job_id not in seen:
+                scores[job_id] += weighted[term] * weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
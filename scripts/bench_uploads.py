@@ -0,0 +1,63 @@
+"""Compare /uploads serving modes.
+
+Start one instance per UPLOAD_SERVE_MODE (behind nginx for x-accel, Apache or
+lighttpd for x-sendfile), log in as the applicant or agency that owns a CV,
+then point this script at the same CV through each instance:
+
+    python scripts/bench_uploads.py --cookie 'session=...' \
+        direct=http://localhost:8000/uploads/cv/ab/cd/<sha256>.pdf \
+        x-accel=http://localhost:8080/uploads/cv/ab/cd/<sha256>.pdf
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url, cookie):
+    request = urllib.request.Request(url, headers={'Cookie': cookie} if cookie else {})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        size = 0
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+    return time.perf_counter() - started, size
+
+
+def run(url, cookie, requests, concurrency):
+    fetch(url, cookie)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, cookie), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(r[0] for r in results)
+    return {
+        'req/s': requests / elapsed,
+        'MB/s': sum(r[1] for r in results) / elapsed / (1024 * 1024),
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p95 ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='+', help='label=url pairs, one per serving mode')
+    parser.add_argument('--cookie', help='Cookie header of a session allowed to read the CV')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    columns = ['req/s', 'MB/s', 'p50 ms', 'p95 ms']
+    print(f'{"mode":<12}' + ''.join(f'{c:>10}' for c in columns))
+    for target in args.targets:
+        label, url = target.split('=', 1)
+        result = run(url, args.cookie, args.requests, args.concurrency)
+        print(f'{label:<12}' + ''.join(f'{result[c]:>10.1f}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
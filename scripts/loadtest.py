@@ -0,0 +1,273 @@
+"""Replay a mix of user journeys against a running Dhandha instance.
+
+Seed a database with scripts/seed_data.py, start the app against it, then:
+
+    python scripts/loadtest.py http://localhost:5000 --duration 60 --concurrency 32
+    python scripts/loadtest.py http://localhost:5000 --save-baseline loadtest_baseline.json
+    python scripts/loadtest.py http://localhost:5000 --baseline loadtest_baseline.json
+
+Each virtual user repeatedly runs one of three journeys, chosen by --mix:
+anonymous browsing (job listing, next page, search, job details), an
+applicant (login, browse, apply with a CV, my applications, notifications)
+and an agency (login, dashboard, view applications, post a job). Redirects
+are not followed, so each request is timed on its own route.
+
+The report lists requests, errors, throughput and p50/p95/p99 per route.
+With --baseline the run exits with status 1 if any route's p95 or p99 is more
+than --tolerance slower than the baseline, its error rate rose by more than
+1%, or the overall throughput dropped by more than --tolerance.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+
+JOB_LINK = re.compile(r'href="/jobs/(\d+)"')
+NEXT_PAGE = re.compile(r'href="/jobs\?cursor=([^"&]+)')
+APPLICATIONS_LINK = re.compile(r'href="/agency/view_applications/(\d+)"')
+SEARCH_TERMS = ['driver', 'electrician', 'nurse', 'cook', 'welder', 'hotel', 'factory', 'Qatar', 'Japan']
+# A tiny but well-formed PDF; every application uploads different bytes so
+# CV storage does real work instead of deduplicating everything.
+PDF_HEAD = b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\n'
+PDF_TAIL = b'trailer<</Root 1 0 R>>\n%%EOF\n'
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+class Session:
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def request(self, route, path, data=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, body = 0, b''
+        elapsed = time.perf_counter() - started
+        self.recorder.record(('POST ' if data is not None else 'GET ') + route, elapsed, 0 < status < 400)
+        return status, body.decode('utf-8', 'replace')
+
+    def get(self, route, path, **params):
+        return self.request(route, path + ('?' + urllib.parse.urlencode(params) if params else ''))
+
+    def post(self, route, path, fields):
+        return self.request(route, path, urllib.parse.urlencode(fields).encode(),
+                            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def post_multipart(self, route, path, fields, files):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, (filename, content) in files.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return self.request(route, path, b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def random_job(rng, manifest):
+    return rng.randrange(*manifest['jobs'])
+
+
+def browse(session, rng, manifest):
+    status, body = session.get('jobs', '/jobs')
+    job_ids = JOB_LINK.findall(body)
+    if rng.random() < 0.3:
+        next_page = NEXT_PAGE.search(body)
+        if next_page:
+            session.get('jobs', '/jobs', cursor=urllib.parse.unquote(next_page.group(1)))
+    if rng.random() < 0.3:
+        session.get('search_jobs', '/jobs/search', q=rng.choice(SEARCH_TERMS))
+    for _ in range(rng.randint(1, 3)):
+        # Mostly jobs from the listing, sometimes a deep link to an old one
+        job_id = rng.choice(job_ids) if job_ids and rng.random() < 0.8 else random_job(rng, manifest)
+        session.get('job_details', f'/jobs/{job_id}')
+    return job_ids
+
+
+def applicant(session, rng, manifest):
+    username = f"user{rng.randrange(*manifest['users'])}"
+    session.post('login', '/login', {'username': username, 'password': manifest['password']})
+    job_ids = browse(session, rng, manifest)
+    job_id = rng.choice(job_ids) if job_ids else random_job(rng, manifest)
+    status, _ = session.get('apply_job', f'/apply_job/{job_id}')
+    if status == 200:
+        cv = PDF_HEAD + b'% ' + uuid.uuid4().hex.encode() + b'\n' + PDF_TAIL
+        session.post_multipart('apply_job', f'/apply_job/{job_id}',
+                               {'name': username, 'email': f'{username}@load.test', 'contact': '01800000000'},
+                               {'cv': ('cv.pdf', cv)})
+    session.get('my_applications', '/my_applications')
+    session.get('notifications', '/notifications')
+    session.get('unread_count', '/notifications/unread_count')
+
+
+def agency(session, rng, manifest):
+    username = f"agency{rng.randrange(*manifest['agencies'])}"
+    session.post('login', '/login', {'username': username, 'password': manifest['password']})
+    status, body = session.get('agency_dashboard', '/agency/dashboard')
+    job_ids = APPLICATIONS_LINK.findall(body)
+    if job_ids:
+        session.get('view_applications', f'/agency/view_applications/{rng.choice(job_ids)}')
+    if rng.random() < 0.2:
+        session.get('post_job', '/agency/post_job')
+        session.post('post_job', '/agency/post_job', {
+            'title': f'Load test job {uuid.uuid4().hex[:8]}', 'country': 'Qatar',
+            'deadline': (date.today() + timedelta(days=60)).isoformat(),
+            'description': 'Synthetic job posted by the load test harness.',
+        })
+    session.get('notifications', '/notifications')
+
+
+JOURNEYS = {'browse': browse, 'applicant': applicant, 'agency': agency}
+
+
+def virtual_user(number, args, manifest, recorder, deadline, mix):
+    rng = random.Random(args.seed * 100003 + number)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        journey = rng.choices(names, weights)[0]
+        JOURNEYS[journey](Session(args.url, recorder, args.timeout), rng, manifest)
+
+
+def run(args, manifest, mix, seconds):
+    recorder = Recorder()
+    deadline = time.monotonic() + seconds
+    started = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(n, args, manifest, recorder, deadline, mix), daemon=True)
+               for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return values[min(len(values) - 1, max(int(len(values) * fraction + 0.5) - 1, 0))]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[route],
+            'error_rate': recorder.errors[route] / len(latencies),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return {'elapsed_s': elapsed, 'requests': total, 'rps': total / elapsed if elapsed else 0, 'routes': routes}
+
+
+def print_report(summary):
+    print(f'{"route":<28}{"requests":>10}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}')
+    for route, r in summary['routes'].items():
+        print(f'{route:<28}{r["requests"]:>10}{r["errors"]:>8}{r["rps"]:>9.1f}'
+              f'{r["p50_ms"]:>9.1f}{r["p95_ms"]:>9.1f}{r["p99_ms"]:>9.1f}')
+    print(f'{summary["requests"]} requests in {summary["elapsed_s"]:.1f}s, {summary["rps"]:.1f} req/s')
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    if summary['rps'] < baseline['rps'] * (1 - tolerance):
+        found.append(f'throughput {summary["rps"]:.1f} req/s < baseline {baseline["rps"]:.1f} req/s')
+    for route, expected in baseline['routes'].items():
+        actual = summary['routes'].get(route)
+        if actual is None:
+            found.append(f'{route}: no requests recorded')
+            continue
+        for key in ('p95_ms', 'p99_ms'):
+            if actual[key] > expected[key] * (1 + tolerance):
+                found.append(f'{route}: {key} {actual[key]:.1f} > baseline {expected[key]:.1f}')
+        if actual['error_rate'] > expected['error_rate'] + 0.01:
+            found.append(f'{route}: error rate {actual["error_rate"]:.2%} > baseline {expected["error_rate"]:.2%}')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url', help='base URL of the running app')
+    parser.add_argument('--manifest', default='loadtest_manifest.json', help='written by scripts/seed_data.py')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds to run before measuring')
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    parser.add_argument('--mix', default='browse=70,applicant=20,agency=10', help='journey weights')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help='fail if this run regresses against the stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, as a fraction')
+    parser.add_argument('--save-baseline', help='write this run as the new baseline')
+    parser.add_argument('--json', help='also write the full report as JSON')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    mix = {name: float(weight) for name, weight in (part.split('=') for part in args.mix.split(','))}
+    unknown = set(mix) - set(JOURNEYS)
+    if unknown:
+        parser.error(f'unknown journeys in --mix: {", ".join(sorted(unknown))}')
+
+    if args.warmup:
+        run(args, manifest, mix, args.warmup)
+    summary = summarize(*run(args, manifest, mix, args.duration))
+    summary.update({'concurrency': args.concurrency, 'mix': mix})
+    print_report(summary)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f), args.tolerance)
+        if found:
+            print('\nRegressions against baseline:')
+            for line in found:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nNo regressions against baseline.')
+
+
+if __name__ == '__main__':
+    main()
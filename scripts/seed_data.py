@@ -0,0 +1,228 @@
+"""Fill a database with synthetic Dhandha data for load testing.
+
+Runs the schema migrations, then bulk-inserts agencies, users, jobs,
+applications, bookmarks and notifications. Use a MySQL or MariaDB server you
+can throw away, e.g. `docker run -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -p 3306:3306
+mysql:8`. The connection comes from the same MYSQL_* environment variables as
+the app. --scale multiplies the full-size dataset (10k agencies, 500k users,
+1M jobs, 5M applications, 20M notifications):
+
+    MYSQL_DB=dhandha_load python scripts/seed_data.py --scale 0.01
+    python scripts/seed_data.py --jobs 200000 --applications 0
+
+Every generated account uses the password given by --password. The id ranges
+are written to --manifest, which scripts/loadtest.py reads to pick accounts
+and jobs.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import MySQLdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import counters  # noqa: E402
+import dedupe  # noqa: E402
+import migrations  # noqa: E402
+import recommend  # noqa: E402
+import search  # noqa: E402
+
+FULL_SCALE = {
+    'agencies': 10_000,
+    'users': 500_000,
+    'jobs': 1_000_000,
+    'applications': 5_000_000,
+    'bookmarks': 2_000_000,
+    'notifications': 20_000_000,
+}
+COUNTRIES = ['Saudi Arabia', 'United Arab Emirates', 'Qatar', 'Kuwait', 'Oman', 'Bahrain', 'Malaysia',
+             'Singapore', 'Japan', 'South Korea', 'Italy', 'Romania', 'Poland', 'Maldives', 'Jordan']
+TITLES = ['Electrician', 'Plumber', 'Welder', 'Driver', 'Cook', 'Waiter', 'Housekeeper', 'Security Guard',
+          'Construction Worker', 'Mason', 'Carpenter', 'Nurse', 'Caregiver', 'Factory Worker', 'Farm Worker',
+          'Mechanic', 'Painter', 'Cleaner', 'Steel Fixer', 'Sales Assistant']
+WORDS = ('experience salary accommodation food transport overtime visa contract medical insurance shift '
+         'skilled helper site hotel hospital factory warehouse company benefits training years ticket').split()
+STATUSES = ['Pending'] * 6 + ['Approved'] * 2 + ['Rejected'] * 2
+
+
+def connect():
+    return MySQLdb.connect(
+        host=os.environ.get('MYSQL_HOST', 'localhost'), port=int(os.environ.get('MYSQL_PORT', 3306)),
+        user=os.environ.get('MYSQL_USER', 'root'), passwd=os.environ.get('MYSQL_PASSWORD', ''),
+        db=os.environ.get('MYSQL_DB', 'dhandha_db'), charset='utf8mb4')
+
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def insert_rows(connection, sql, rows, total, label, batch_size):
+    # executemany folds each batch into one multi-row INSERT
+    cursor = connection.cursor()
+    started = time.perf_counter()
+    batch = []
+    done = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            connection.commit()
+            done += len(batch)
+            batch = []
+            print(f'\r{label}: {done}/{total}', end='', flush=True)
+    if batch:
+        cursor.executemany(sql, batch)
+        connection.commit()
+        done += len(batch)
+    cursor.close()
+    elapsed = time.perf_counter() - started
+    print(f'\r{label}: {done} rows in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f} rows/s)')
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def agency_rows(first, count, password):
+    for n in range(first, first + count):
+        yield (n, f'agency{n}', password, f'agency{n}@load.test', f'0170{n:07d}', f'Load Agency {n}',
+               f'TL-LOAD-{n}', 'verified')
+
+
+def user_rows(first, count, password):
+    for n in range(first, first + count):
+        yield (n, f'user{n}', password, f'user{n}@load.test', f'0180{n:07d}', 'Load', f'User{n}')
+
+
+def job_rows(rng, first, count, agencies, now):
+    for n in range(first, first + count):
+        posted_at = now - timedelta(minutes=rng.randrange(180 * 24 * 60))
+        # About one job in ten is already past its deadline
+        deadline = (now + timedelta(days=rng.randrange(-30, 270))).date()
+        country = rng.choice(COUNTRIES)
+        yield (n, f'{rng.choice(TITLES)} needed in {country}', country, deadline, sentence(rng, rng.randrange(40, 120)),
+               posted_at, rng.randrange(2000), job_agency(n, agencies), posted_at)
+
+
+def job_agency(job_id, agencies):
+    return agencies[0] + (job_id - 1) % (agencies[1] - agencies[0])
+
+
+def pairs(count, users, jobs, salt):
+    # Distinct (user, job) pairs: the k-th pair of a user is k jobs further on
+    # from a per-user starting point, so the unique keys never collide.
+    user_count = users[1] - users[0]
+    job_count = jobs[1] - jobs[0]
+    for n in range(count):
+        user = n % user_count
+        k = n // user_count
+        yield users[0] + user, jobs[0] + (user * 7919 + salt + k) % job_count
+
+
+def application_rows(rng, count, users, jobs, now):
+    for user_id, job_id in pairs(count, users, jobs, 0):
+        applied_at = now - timedelta(minutes=rng.randrange(120 * 24 * 60))
+        yield (f'Load User{user_id}', f'user{user_id}@load.test', f'0180{user_id:07d}', 'cv/load-test.pdf',
+               rng.choice(STATUSES), applied_at, applied_at, user_id, job_id)
+
+
+def bookmark_rows(rng, count, users, jobs, now):
+    # Offset from the application pairs so bookmarks mostly land on other jobs
+    for user_id, job_id in pairs(count, users, jobs, 104729):
+        yield user_id, job_id, now - timedelta(minutes=rng.randrange(60 * 24 * 60))
+
+
+def notification_rows(rng, count, users, agencies, now):
+    user_count = users[1] - users[0]
+    agency_count = agencies[1] - agencies[0]
+    for n in range(count):
+        timestamp = now - timedelta(seconds=rng.randrange(90 * 24 * 3600))
+        # Recipients are 90% users; older notifications are mostly read
+        if n % 10:
+            user_id, agency_id = users[0] + rng.randrange(user_count), None
+        else:
+            user_id, agency_id = None, agencies[0] + rng.randrange(agency_count)
+        is_read = rng.random() < 0.8
+        yield sentence(rng, 8), rng.choice(('info', 'info', 'success', 'error')), timestamp, is_read, user_id, agency_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=0.01, help='fraction of the full-size dataset (default 0.01)')
+    for table in FULL_SCALE:
+        parser.add_argument(f'--{table}', type=int, help=f'number of {table} (overrides --scale)')
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--manifest', default='loadtest_manifest.json')
+    args = parser.parse_args()
+
+    sizes = {table: getattr(args, table) if getattr(args, table) is not None else max(int(full * args.scale), 1)
+             for table, full in FULL_SCALE.items()}
+    rng = random.Random(args.seed)
+    now = datetime.now().replace(microsecond=0)
+
+    connection = connect()
+    migrations.migrate(connection)
+    cursor = connection.cursor()
+    # Every row is generated consistent, so skip the per-row checks while loading
+    cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+    agency_first = next_id(cursor, 'agencies')
+    user_first = next_id(cursor, 'users')
+    job_first = next_id(cursor, 'jobs')
+    agencies = (agency_first, agency_first + sizes['agencies'])
+    users = (user_first, user_first + sizes['users'])
+    jobs = (job_first, job_first + sizes['jobs'])
+    sizes['applications'] = min(sizes['applications'], sizes['users'] * sizes['jobs'])
+    sizes['bookmarks'] = min(sizes['bookmarks'], sizes['users'] * sizes['jobs'])
+
+    insert_rows(connection, """
+        INSERT INTO agencies (id, username, password, email, phone, company_name, trade_license, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, agency_rows(agency_first, sizes['agencies'], args.password), sizes['agencies'], 'agencies', args.batch_size)
+    insert_rows(connection, """
+        INSERT INTO users (id, username, password, email, phone, firstname, lastname)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, user_rows(user_first, sizes['users'], args.password), sizes['users'], 'users', args.batch_size)
+    insert_rows(connection, """
+        INSERT INTO jobs (id, title, country, deadline, description, posted_at, views, agency_id, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, job_rows(rng, job_first, sizes['jobs'], agencies, now), sizes['jobs'], 'jobs', args.batch_size)
+    insert_rows(connection, """
+        INSERT IGNORE INTO applications (name, email, contact, cv_path, status, applied_at, updated_at, user_id, job_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, application_rows(rng, sizes['applications'], users, jobs, now), sizes['applications'], 'applications',
+        args.batch_size)
+    insert_rows(connection, """
+        INSERT IGNORE INTO job_bookmarks (user_id, job_id, bookmarked_at) VALUES (%s, %s, %s)
+    """, bookmark_rows(rng, sizes['bookmarks'], users, jobs, now), sizes['bookmarks'], 'bookmarks', args.batch_size)
+    insert_rows(connection, """
+        INSERT INTO notifications (message, category, timestamp, is_read, user_id, agency_id)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, notification_rows(rng, sizes['notifications'], users, agencies, now), sizes['notifications'],
+        'notifications', args.batch_size)
+
+    started = time.perf_counter()
+    # Backfills job_search, job_terms and job signatures for the new jobs, then the per-job counters
+    search.create_search_table(cursor)
+    recommend.backfill(cursor, args.batch_size)
+    dedupe.backfill(cursor, args.batch_size)
+    counters.reconcile(cursor)
+    connection.commit()
+    print(f'search, recommendation and duplicate indexes and counters rebuilt in {time.perf_counter() - started:.1f}s')
+    cursor.close()
+    connection.close()
+
+    with open(args.manifest, 'w') as f:
+        json.dump({'password': args.password, 'agencies': agencies, 'users': users, 'jobs': jobs,
+                   'sizes': sizes, 'seed': args.seed, 'generated_at': now.isoformat()}, f, indent=2)
+    print(f'Wrote {args.manifest}')
+
+
+if __name__ == '__main__':
+    main()
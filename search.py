@@ -0,0 +1,130 @@
+import MySQLdb.cursors
+
+# Job search runs against job_search, a denormalized copy of each job's
+# searchable text (title, description, country and the agency's company name)
+# with FULLTEXT indexes. Rows are written by post_job/edit_job and removed with
+# the job through the ON DELETE CASCADE foreign key.
+SEARCH_DOCUMENT_SELECT = """
+    SELECT j.id, j.agency_id, j.country, j.deadline, j.posted_at, j.title,
+        CONCAT_WS(' ', j.description, j.country, a.company_name)
+    FROM jobs j
+    JOIN agencies a ON j.agency_id = a.id
+"""
+
+
+def create_search_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_search (
+            job_id INT PRIMARY KEY,
+            agency_id INT NOT NULL,
+            country VARCHAR(50) NOT NULL,
+            deadline DATE NOT NULL,
+            posted_at DATETIME,
+            title VARCHAR(100) NOT NULL,
+            body TEXT NOT NULL,
+            FULLTEXT KEY ft_job_search_title (title),
+            FULLTEXT KEY ft_job_search_all (title, body),
+            KEY idx_job_search_country (country),
+            KEY idx_job_search_deadline (deadline),
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB
+    """)
+    # Backfill jobs that predate the search table
+    cursor.execute(f"""
+        INSERT IGNORE INTO job_search (job_id, agency_id, country, deadline, posted_at, title, body)
+        {SEARCH_DOCUMENT_SELECT}
+        LEFT JOIN job_search s ON s.job_id = j.id
+        WHERE s.job_id IS NULL
+    """)
+
+
+def index_job(cursor, job_id):
+    index_jobs(cursor, [job_id])
+
+
+def index_jobs(cursor, job_ids):
+    if not job_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(job_ids))
+    cursor.execute(f"""
+        INSERT INTO job_search (job_id, agency_id, country, deadline, posted_at, title, body)
+        {SEARCH_DOCUMENT_SELECT}
+        WHERE j.id IN ({placeholders})
+        ON DUPLICATE KEY UPDATE agency_id = VALUES(agency_id), country = VALUES(country),
+            deadline = VALUES(deadline), title = VALUES(title), body = VALUES(body)
+    """, job_ids)
+
+
+def search_jobs(connection, q=None, country=None, agency_id=None, deadline_from=None, deadline_to=None,
+                limit=20, offset=0, after=None, snippet_length=200, facet_cache=None):
+    # Filters shared by the result query and the facet query. The facet counts
+    # ignore the country filter so every country stays selectable. Without q,
+    # results are newest first and page after the (posted_at, job_id) cursor;
+    # relevance-ranked pages use offset.
+    where = ["s.deadline >= CURDATE()"]
+    params = []
+    if q:
+        where.append("MATCH(s.title, s.body) AGAINST (%s IN NATURAL LANGUAGE MODE)")
+        params.append(q)
+    if agency_id:
+        where.append("s.agency_id = %s")
+        params.append(agency_id)
+    if deadline_from:
+        where.append("s.deadline >= %s")
+        params.append(deadline_from)
+    if deadline_to:
+        where.append("s.deadline <= %s")
+        params.append(deadline_to)
+    facet_where = ' AND '.join(where)
+    facet_params = list(params)
+    if country:
+        where.append("s.country = %s")
+        params.append(country)
+    result_where = ' AND '.join(where)
+
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    if q:
+        # Title matches weigh double
+        score = "(MATCH(s.title) AGAINST (%s IN NATURAL LANGUAGE MODE) * 2 + MATCH(s.title, s.body) AGAINST (%s IN NATURAL LANGUAGE MODE))"
+        order = "relevance DESC, s.posted_at DESC, s.job_id DESC"
+        score_params = [q, q]
+    else:
+        score = "0"
+        order = "s.posted_at DESC, s.job_id DESC"
+        score_params = []
+        offset = 0
+        if after:
+            where.append("(s.posted_at < %s OR (s.posted_at = %s AND s.job_id < %s))")
+            params += [after[0], after[0], after[1]]
+            result_where = ' AND '.join(where)
+    cursor.execute(f"""
+        SELECT j.id, j.title, j.country, j.deadline, j.posted_at, j.views,
+            LEFT(j.description, %s) AS snippet, a.company_name AS posted_by, {score} AS relevance
+        FROM job_search s
+        JOIN jobs j ON j.id = s.job_id
+        JOIN agencies a ON a.id = s.agency_id
+        WHERE {result_where}
+        ORDER BY {order}
+        LIMIT %s OFFSET %s
+    """, [snippet_length] + score_params + params + [limit + 1, offset])
+    results = list(cursor.fetchall())
+
+    # Counts for searches without q depend only on the filters, so they are
+    # shared between visitors and pages until the cache entry expires
+    facet_key = None if q or facet_cache is None else ('facets', agency_id, deadline_from, deadline_to)
+    facets = facet_cache.get(facet_key) if facet_key else None
+    if facets is None:
+        cursor.execute(f"""
+            SELECT s.country, COUNT(*) AS count
+            FROM job_search s
+            WHERE {facet_where}
+            GROUP BY s.country
+            ORDER BY count DESC, s.country
+        """, facet_params)
+        facets = list(cursor.fetchall())
+        if facet_key:
+            facet_cache.set(facet_key, facets)
+    cursor.close()
+
+    has_more = len(results) > limit
+    return results[:limit], facets, has_more
@@ -0,0 +1,27 @@
+# Version counters for listings. Writers bump a listing's row in the same
+# transaction as their change, so a page's ETag is a primary-key read instead
+# of an aggregate over every row the listing covers.
+LISTINGS = ('jobs',)
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name VARCHAR(50) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    for name in LISTINGS:
+        cursor.execute("INSERT IGNORE INTO data_versions (name) VALUES (%s)", (name,))
+
+
+def bump(cursor, name):
+    # Row-locks the counter until commit, so call it last in the transaction
+    cursor.execute("UPDATE data_versions SET version = version + 1, updated_at = NOW() WHERE name = %s", (name,))
+
+
+def current(cursor, name):
+    # Returns (version, updated_at)
+    cursor.execute("SELECT version, updated_at FROM data_versions WHERE name = %s", (name,))
+    return cursor.fetchone() or (0, None)
@@ -0,0 +1,71 @@
+import threading
+from collections import Counter
+
+from worker import PeriodicWorker
+
+
+# Write-behind job view counter. job_details only bumps an in-memory Counter;
+# the flusher folds the deltas into jobs.views with one UPDATE per flush. Each
+# process buffers and flushes its own deltas additively, so several workers
+# can run side by side. At most VIEW_FLUSH_INTERVAL seconds of views (or
+# VIEW_FLUSH_THRESHOLD views) are lost if a process dies.
+class ViewCounter(PeriodicWorker):
+    name = 'view-counter-flusher'
+
+    def __init__(self, app, db):
+        super().__init__(app, db, app.config.get('VIEW_FLUSH_INTERVAL', 10))
+        self.threshold = app.config.get('VIEW_FLUSH_THRESHOLD', 5000)
+        self.stats.update({'flushes': 0, 'flushed_views': 0, 'flush_failures': 0})
+        self._pending = Counter()
+        self._pending_total = 0
+        self._buffer_lock = threading.Lock()
+
+    def increment(self, job_id, amount=1):
+        with self._buffer_lock:
+            self._pending[job_id] += amount
+            self._pending_total += amount
+            full = self._pending_total >= self.threshold
+        if full:
+            self.wake()
+
+    def pending(self, job_ids):
+        with self._buffer_lock:
+            return {job_id: self._pending[job_id] for job_id in job_ids if job_id in self._pending}
+
+    def run_once(self):
+        self.flush()
+        self.mark_run()
+
+    def flush(self):
+        with self._buffer_lock:
+            deltas, self._pending = self._pending, Counter()
+            self._pending_total = 0
+        if not deltas:
+            return 0
+        ids = list(deltas)
+        cases = ' '.join(['WHEN %s THEN %s'] * len(ids))
+        params = [value for job_id in ids for value in (job_id, deltas[job_id])]
+        placeholders = ', '.join(['%s'] * len(ids))
+        conn = self.db.connection
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"UPDATE jobs SET views = views + CASE id {cases} ELSE 0 END WHERE id IN ({placeholders})",
+                           params + ids)
+            conn.commit()
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            with self._buffer_lock:
+                self._pending.update(deltas)
+                self._pending_total += sum(deltas.values())
+            self.count(flush_failures=1)
+            raise
+        finally:
+            cursor.close()
+        self.count(flushes=1, flushed_views=sum(deltas.values()))
+        return len(ids)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        with self._buffer_lock:
+            stats.update({'pending_jobs': len(self._pending), 'pending_views': self._pending_total})
+        return stats
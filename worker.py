@@ -0,0 +1,63 @@
+import threading
+from datetime import datetime
+
+
+# Base for the in-process background workers (expiry reaper, notification
+# fan-out, ...). Subclasses implement run_once(); the loop runs it inside an
+# app context every `interval` seconds, or sooner when wake() is called.
+class PeriodicWorker:
+    name = 'worker'
+
+    def __init__(self, app, db, interval):
+        self.app = app
+        self.db = db
+        self.interval = interval
+        self.stats = {'runs': 0, 'errors': 0, 'last_run_at': None, 'last_error': None}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.run_once()
+            except Exception as e:
+                self.count(errors=1)
+                self.note(last_error=str(e))
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+
+    def note(self, **values):
+        with self._lock:
+            self.stats.update(values)
+
+    def mark_run(self):
+        self.count(runs=1)
+        self.note(last_run_at=datetime.now().isoformat(timespec='seconds'))
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
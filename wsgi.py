@@ -0,0 +1,12 @@
+"""WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py runs the one-time setup in the master and starts each
+worker's pool and background threads after the fork. Other servers can call
+app.prepare() once (or run `flask migrate`) and app.start_worker() in each
+worker process.
+"""
+from app import create_app
+
+app = create_app()